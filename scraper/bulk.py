@@ -0,0 +1,203 @@
+"""
+Streaming ingest of Comtrade bulk files.
+
+The zip archive is decompressed while it downloads and only the columns in
+``BULK_COLUMNS`` are kept. Rows are written in chunks to Parquet files
+partitioned by period and trade flow, so memory use does not grow with the
+size of the file and no intermediate csv is written.
+
+Layout of the output, queryable with ``read_bulk`` or any Parquet reader:
+
+    dest/period=201601/flow=1/ALL.parquet
+"""
+
+import io
+import os
+import struct
+import zlib
+from glob import glob
+import requests
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import secret
+
+PARQUET_DEST = '//172.26.1.102/dstore/uncomtrade/parquet/'
+
+# Position in bulk csv: (header name, column name in Parquet)
+BULK_COLUMNS = { 2: ('Period', 'period'),
+                 6: ('Trade Flow Code', 'flow'),
+                 8: ('Reporter Code', 'reporter'),
+                11: ('Partner Code', 'partner'),
+                14: ('Commodity Code', 'commodity'),
+                16: ('Qty Unit Code', 'qty_unit'),
+                18: ('Qty', 'qty'),
+                19: ('Netweight (kg)', 'netweight'),
+                20: ('Trade Value (US$)', 'val')
+}
+SCHEMA = pa.schema([('reporter', pa.int64()),
+                    ('partner', pa.int64()),
+                    ('commodity', pa.string()),
+                    ('qty_unit', pa.int64()),
+                    ('qty', pa.float64()),
+                    ('netweight', pa.float64()),
+                    ('val', pa.float64())])
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+
+class ZipMemberStream(io.RawIOBase):
+    """Read-only stream over the first member of a zip archive.
+
+    The archive is consumed front to back from an iterable of byte chunks,
+    e.g. ``Response.iter_content``, so the member can be decompressed while
+    it is still downloading. Only stored and deflated members are supported.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.raw = b''
+        self.out = b''
+        self.finished = False
+        self._read_header()
+
+    def _fill(self, n):
+        """Buffer at least ``n`` raw bytes, or as many as are left."""
+        while len(self.raw) < n:
+            try:
+                self.raw += next(self.chunks)
+            except StopIteration:
+                break
+
+    def _read_header(self):
+        self._fill(ZIP_LOCAL_HEADER.size)
+        (signature, _, flag, method, _, _, _,
+         size, _, name_len, extra_len) = ZIP_LOCAL_HEADER.unpack(self.raw[:ZIP_LOCAL_HEADER.size])
+        if signature != b'PK\x03\x04':
+            raise ValueError('Not a zip archive.')
+        skip = ZIP_LOCAL_HEADER.size + name_len + extra_len
+        self._fill(skip)
+        self.raw = self.raw[skip:]
+        if method == 8:
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        elif method == 0 and not flag & 0x08:
+            # Stored member of known size
+            self.decompressor = None
+            self.remaining = size
+        else:
+            raise ValueError('Unsupported zip compression method {}.'.format(method))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.out and not self.finished:
+            if not self.raw:
+                self._fill(1)
+                if not self.raw:
+                    raise EOFError('Zip archive ended unexpectedly.')
+            data, self.raw = self.raw, b''
+            if self.decompressor is None:
+                self.out = data[:self.remaining]
+                self.remaining -= len(self.out)
+                self.finished = self.remaining == 0
+            else:
+                self.out = self.decompressor.decompress(data)
+                self.finished = self.decompressor.eof
+        n = min(len(b), len(self.out))
+        b[:n] = self.out[:n]
+        self.out = self.out[n:]
+        return n
+
+
+def write_partitioned(stream, dest=PARQUET_DEST, tag='ALL', chunksize=500000):
+    """Write a bulk csv stream to Parquet, partitioned by period and flow.
+
+    Parameters
+    ----------
+    stream : binary file-like
+        Uncompressed bulk csv, with header.
+    dest : str
+        Root directory of the partitioned dataset.
+    tag : str, default 'ALL'
+        File name within each partition. Files from earlier ingests with the
+        same tag are replaced, for every flow of the periods written.
+    chunksize : int, default 500000
+        Number of csv rows held in memory at a time.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows written.
+    """
+
+    headers = [BULK_COLUMNS[i][0] for i in sorted(BULK_COLUMNS)]
+    names = [BULK_COLUMNS[i][1] for i in sorted(BULK_COLUMNS)]
+    reader = pd.read_csv(stream, usecols=sorted(BULK_COLUMNS), header=0, chunksize=chunksize,
+                         encoding='utf-8',
+                         dtype={'Commodity Code': str, 'Reporter Code': 'Int64',
+                                'Partner Code': 'Int64', 'Qty Unit Code': 'Int64'})
+    writers = {}
+    n_rows = 0
+    try:
+        for df in reader:
+            df = df[headers]
+            df.columns = names
+            for (period, flow), g in df.groupby(['period', 'flow']):
+                path = os.path.join(dest, 'period={}'.format(period), 'flow={}'.format(flow))
+                if (period, flow) not in writers:
+                    os.makedirs(path, exist_ok=True)
+                    writers[(period, flow)] = pq.ParquetWriter(
+                        os.path.join(path, '.' + tag + '.parquet.tmp'), SCHEMA)
+                table = pa.Table.from_pandas(g.drop(['period', 'flow'], axis=1), schema=SCHEMA,
+                                             preserve_index=False)
+                writers[(period, flow)].write_table(table)
+            n_rows += len(df)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # Swap in the new files only once the whole stream has been written
+    for period in {p for p, f in writers}:
+        for old in glob(os.path.join(dest, 'period={}'.format(period), 'flow=*', tag + '.parquet')):
+            os.remove(old)
+    for period, flow in writers:
+        path = os.path.join(dest, 'period={}'.format(period), 'flow={}'.format(flow))
+        os.replace(os.path.join(path, '.' + tag + '.parquet.tmp'), os.path.join(path, tag + '.parquet'))
+    return n_rows
+
+
+def ingest_bulk(period, freq='A', reporter='ALL', dest=PARQUET_DEST, chunksize=500000):
+    """Download a bulk file and stream it into the partitioned Parquet dataset.
+
+    Parameters
+    ----------
+    period : int or str
+        YYYY for annual data ('A') or YYYYMM for monthly data ('M').
+    freq : {'A', 'M'}, default 'A'.
+    reporter : str, default 'ALL'
+        Reporter code, or 'ALL' for all reporters in one file.
+    """
+
+    url = 'http://comtrade.un.org/api/get/bulk/C/{}/{}/{}/HS?token={}'.format(
+        freq, period, reporter, secret.auth_code)
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        stream = io.BufferedReader(ZipMemberStream(r.iter_content(chunk_size=1024 * 1024)),
+                                   buffer_size=1024 * 1024)
+        n_rows = write_partitioned(stream, dest=dest, tag=str(reporter), chunksize=chunksize)
+    print('Successfully ingested data for {}, reporter {} ({:,} rows).'.format(period, reporter, n_rows))
+    return n_rows
+
+
+def read_bulk(dest=PARQUET_DEST, columns=None, filters=None):
+    """Read the partitioned bulk dataset.
+
+    Parameters
+    ----------
+    columns : list, optional
+        Columns to read, e.g. ['period', 'reporter', 'commodity', 'val'].
+    filters : list, optional
+        Row filters in ``pyarrow.parquet`` form, e.g. [('period', '=', 201601), ('flow', '=', 1)].
+        Partitions that do not match are never read.
+    """
+    return pq.read_table(dest, columns=columns, filters=filters).to_pandas()
@@ -0,0 +1,235 @@
+"""
+Crawler for the MOF tariff code tree (2, 4, 6, 8 and 11 digits).
+
+The tree is crawled breadth first, one level at a time, with the listings of
+a level fetched in a thread pool. Codes are stored in SQLite together with a
+digest of every listing. On refresh, the listings down to ``check`` digits
+(chapters and headings by default, about a hundred requests) are always
+fetched; below that, a subtree is only descended into if the listing of its
+parent has changed, has never been crawled or is not complete. A listing is
+complete once the listings of all its children are stored and complete, so
+a crawl that was interrupted carries on where it stopped. ``full=True``
+re-crawls everything.
+
+Refresh the code tree:
+
+    python codetree.py [--full] [--workers N] [--rate R]
+"""
+
+import argparse
+import ast
+import hashlib
+import os
+import re
+import sqlite3
+from time import strftime, sleep
+import requests
+import engine
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+
+requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+URL = 'https://portal.sw.nat.gov.tw/APGA/GoodsSearch_toByCode'
+LEVELS = [2, 4, 6, 8, 11]
+DB_PATH = 'code_tree.sqlite'
+LEGACY_PATH = 'elevens_list_noname.txt'
+
+
+def listing_code(label):
+    """Leading digits of a listing label, e.g. '0101100010' of '0101100010 純種繁殖用'."""
+    match = re.match(r'\d+', label)
+    return match.group(0) if match else label
+
+
+class CodeTree:
+    """SQLite store of the tariff code tree.
+
+    Parameters
+    ----------
+    path : str, default 'code_tree.sqlite'
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS codes (
+                level INTEGER, label TEXT, code TEXT, parent TEXT,
+                PRIMARY KEY (level, label)
+            )""")
+        self.conn.execute('CREATE INDEX IF NOT EXISTS codes_level_code ON codes (level, code)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS codes_parent ON codes (level, parent)')
+        # One row per crawled listing: the children of ``parent`` at ``level``
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                level INTEGER, parent TEXT, digest TEXT, crawled TEXT, complete INTEGER DEFAULT 0,
+                PRIMARY KEY (level, parent)
+            )""")
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(listings)')]
+        if 'complete' not in columns:
+            # Stores from before the flag are checked once on the next refresh
+            self.conn.execute('ALTER TABLE listings ADD COLUMN complete INTEGER DEFAULT 0')
+        self.conn.commit()
+
+    def digest(self, level, parent):
+        """Digest of the stored listing, or None if never crawled."""
+        row = self.conn.execute('SELECT digest FROM listings WHERE level = ? AND parent = ?',
+                                (level, parent)).fetchone()
+        return row[0] if row else None
+
+    def complete(self, level, parent):
+        """Whether the listing and the listings of its whole subtree are stored."""
+        row = self.conn.execute('SELECT complete FROM listings WHERE level = ? AND parent = ?',
+                                (level, parent)).fetchone()
+        return bool(row and row[0])
+
+    def update_complete(self):
+        """Recompute the ``complete`` flag of every listing, from the deepest level up."""
+        self.conn.execute('UPDATE listings SET complete = 1 WHERE level = ?', (LEVELS[-1],))
+        for level, child_level in reversed(list(zip(LEVELS, LEVELS[1:]))):
+            self.conn.execute("""
+                UPDATE listings SET complete = NOT EXISTS (
+                    SELECT 1 FROM codes c
+                    WHERE c.level = listings.level AND c.parent = listings.parent
+                    AND NOT EXISTS (
+                        SELECT 1 FROM listings l
+                        WHERE l.level = ? AND l.parent = c.label AND l.complete
+                    )
+                )
+                WHERE level = ?""", (child_level, level))
+
+    def children(self, level, parent):
+        """Labels of the stored children of ``parent`` at ``level``."""
+        rows = self.conn.execute('SELECT label FROM codes WHERE level = ? AND parent = ?',
+                                 (level, parent))
+        return [row[0] for row in rows]
+
+    def remove(self, level, label):
+        """Remove a code and its whole subtree."""
+        self.conn.execute('DELETE FROM codes WHERE level = ? AND label = ?', (level, label))
+        i = LEVELS.index(level)
+        if i + 1 < len(LEVELS):
+            self.conn.execute('DELETE FROM listings WHERE level = ? AND parent = ?',
+                              (LEVELS[i + 1], label))
+            for child in self.children(LEVELS[i + 1], label):
+                self.remove(LEVELS[i + 1], child)
+
+    def store(self, level, parent, labels, digest):
+        """Replace the children of ``parent`` at ``level`` with ``labels``."""
+        for label in set(self.children(level, parent)) - set(labels):
+            self.remove(level, label)
+        self.conn.executemany('INSERT OR REPLACE INTO codes VALUES (?, ?, ?, ?)',
+                              [(level, label, listing_code(label), parent) for label in labels])
+        self.conn.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, 0)',
+                          (level, parent, digest, strftime('%Y-%m-%d %H:%M:%S')))
+
+    def codes(self, level=11):
+        """Sorted codes at ``level``."""
+        rows = self.conn.execute('SELECT code FROM codes WHERE level = ? ORDER BY code', (level,))
+        return [row[0] for row in rows]
+
+    def count(self, level):
+        """Number of stored codes at ``level``."""
+        return self.conn.execute('SELECT COUNT(*) FROM codes WHERE level = ?', (level,)).fetchone()[0]
+
+
+def fetch_listing(level, form, bucket=None):
+    """POST one GoodsSearch_toByCode request and return the listed labels.
+
+    Every attempt first takes a token from ``bucket`` (an ``engine.TokenBucket``), if given.
+    """
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            resp = engine.thread_session().post(URL + str(level), data=form, verify=False)
+            resp.raise_for_status()
+            return [d['cnyChinese'] for d in resp.json()['listBy' + str(level)]]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print('An error has occurred with message %s. Retrying.' % e)
+            sleep(10)
+
+
+def crawl(tree=None, full=False, check=4, workers=8, rate=None):
+    """
+    Crawl the code tree breadth first and store it in ``tree``.
+
+    Parameters
+    ----------
+    tree : CodeTree, optional
+        Store to update. Defaults to 'code_tree.sqlite'.
+    full : bool, default False
+        If False, only descend into subtrees whose parent listing changed.
+    check : int, default 4
+        Listings down to this level are fetched even if unchanged.
+    workers : int, default 8
+        Maximum number of requests in flight.
+    rate : float, optional
+        Politeness limit: maximum requests per second across all workers.
+        No limit if None.
+
+    Returns
+    -------
+    requests : int
+        Number of listings fetched.
+    """
+
+    if tree is None:
+        tree = CodeTree()
+    bucket = engine.TokenBucket(rate=rate, capacity=workers) if rate else None
+    # (parent label, form identifying the parent) pairs to list at this level
+    frontier = [('', {})]
+    fetched = 0
+    for i, level in enumerate(LEVELS):
+        fetch = lambda node: fetch_listing(level, node[1], bucket)
+        next_frontier = []
+        changed = 0
+        for (parent, form), labels in engine.map_ordered(fetch, frontier, workers):
+            fetched += 1
+            digest = hashlib.sha1('\n'.join(labels).encode('utf-8')).hexdigest()
+            if not full and digest == tree.digest(level, parent):
+                # Unchanged, but children may not have been crawled yet
+                if i + 1 < len(LEVELS):
+                    next_frontier += [(label, dict(form, **{'code' + str(level): label}))
+                                      for label in labels
+                                      if level < check or not tree.complete(LEVELS[i + 1], label)]
+                continue
+            tree.store(level, parent, labels, digest)
+            changed += 1
+            if i + 1 < len(LEVELS):
+                next_frontier += [(label, dict(form, **{'code' + str(level): label}))
+                                  for label in labels]
+        tree.update_complete()
+        tree.conn.commit()
+        print('Level %d: %d listings fetched, %d changed, %d codes on %s.'
+              % (level, len(frontier), changed, tree.count(level), strftime('%Y-%m-%d %H:%M:%S')))
+        frontier = next_frontier
+    return fetched
+
+
+def load_codes(level=11, path=DB_PATH, legacy_path=LEGACY_PATH):
+    """
+    Return the sorted list of codes at ``level``.
+
+    Reads the crawled tree at ``path``. If it has not been crawled yet,
+    11-digit codes fall back to the list literal at ``legacy_path``.
+    """
+
+    if os.path.isfile(path):
+        codes = CodeTree(path).codes(level)
+        if codes:
+            return codes
+    if level == 11 and os.path.isfile(legacy_path):
+        with open(legacy_path, encoding='utf-8', mode='r') as file:
+            return ast.literal_eval(file.read())
+    raise FileNotFoundError('No %d-digit codes found. Run codetree.crawl() first.' % level)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl or refresh the MOF tariff code tree.')
+    parser.add_argument('--full', action='store_true', help='re-crawl unchanged subtrees too')
+    parser.add_argument('--check', type=int, default=4, choices=LEVELS,
+                        help='always fetch listings down to this level')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, help='maximum requests per second')
+    args = parser.parse_args()
+    crawl(full=args.full, check=args.check, workers=args.workers, rate=args.rate)
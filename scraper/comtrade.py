@@ -1,12 +1,18 @@
 import urllib.parse
 import requests
-import json
-import pandas as pd
-from time import strftime, sleep
+from time import strftime
 import datetime
 import calendar
 import os.path
 import secret
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools'))
+import refdata
+import engine
+import bulk
+from journal import Journal, committed_size, DONE, EMPTY, SPLIT
+from planner import Planner, make_job, cells, n_rows
+from functools import lru_cache
 
 def check_availability(period, freq='A'):
     """
@@ -28,40 +34,14 @@ def check_availability(period, freq='A'):
     return r.json()
 
 def download_bulk(period=datetime.datetime.now().year - 1, freq='A', stream=True):
-    """Return a zip file containing exactly one csv file."""
+    """
+    Return a zip file containing exactly one csv file.
+    To skip the zip file and load the data directly as Parquet, use
+    ``bulk.ingest_bulk``.
+    """
     url = 'http://comtrade.un.org/api/get/bulk/C/{}/{}/ALL/HS?token={}'.format(freq, period, secret.auth_code)
     dest = '//172.26.1.102/dstore/uncomtrade/monthly/'
     filename = dest + str(period) + '.zip'
-    col_ind = { 6: 'Trade Flow Code',
-                8: 'Reporter Code',
-               11: 'Partner Code',
-               14: 'Commodity Code',
-               16: 'Qty Unit Code',
-               18: 'Qty',
-               19: 'Netweight (kg)',
-               20: 'Trade Value (US$)'
-    }
-    
-    # def write_stream_data(resp, filename=filename, reduce=reduce):
-        # if reduce == True:
-            # cols = list(col_ind.keys())
-        # else:
-            # cols = None
-            
-        # counter = 0
-        # for lines in resp.iter_lines(chunk_size=100 * 1024,
-                                     # decode_unicode='utf-8'):
-            # if counter == 0:
-                # Create file and write with headers
-                # df = pd.read_csv(lines, usecols=cols, header=0)
-                # df.to_csv(filename, index=False, encoding='utf-8')
-                # counter += 1
-            # else:
-                # Append to the existing csv with no header
-                # df = pd.read_csv(lines, usecols=cols, header=None)
-                # with open(filename, encoding='utf-8', mode='a') as file:
-                    # df.to_csv(file, index=False, header=False)
-        
     if stream == False:
         r = requests.get(url)
         with open(filename, encoding='utf-8', mode='w', newline='') as file:
@@ -77,32 +57,43 @@ def download_bulk(period=datetime.datetime.now().year - 1, freq='A', stream=True
     print('Successfully downloaded data for {} ({} MB).'.format(str(period), str(size)))
     return
 
-def download_monthly(year):
+def download_monthly(year, fmt='zip'):
+    """
+    Download bulk files for all 12 months of ``year``.
+    
+    fmt : {'zip', 'parquet'}, default 'zip'.
+    If 'parquet', stream each file into the partitioned dataset at
+    ``bulk.PARQUET_DEST`` instead of saving the zip.
+    """
     for m in range(1, 13):
         period = str(year) + str(m).zfill(2)
-        download_bulk(period, freq='M', stream=True)
+        if fmt == 'parquet':
+            bulk.ingest_bulk(period, freq='M')
+        else:
+            download_bulk(period, freq='M', stream=True)
 
-reporters = pd.read_csv('//172.26.1.102/dstore/uncomtrade/reporter.csv')
 asean = ['Singapore', 'Malaysia', 'Indonesia', 'Brunei Darussalam',
          'Lao People\'s Dem. Rep.', 'Viet Nam', 'Thailand', 'Myanmar',
          'Cambodia', 'Philippines']
 south = asean + ['India', 'Sri Lanka', 'Bangladesh', 'Nepal', 'Bhutan', 'Pakistan',
                  'Australia', 'New Zealand']
-asean_code = reporters[reporters['text'].isin(asean)]['id'].values
-south_code = reporters[reporters['text'].isin(south)]['id'].values
+
+def reporter_codes(names):
+    """Return codes of the reporters named in ``names``."""
+    reporters = refdata.reporters()
+    return reporters[reporters['text'].isin(names)]['id'].values
 
 def get_asean_data(partner='490'):
-    batch = [south_code[0:5], south_code[5:10], south_code[10:15], south_code[15:18]]
+    jobs = [make_job(ps='all', r=','.join(group), p=partner, freq='A')
+            for group in chunk(reporter_codes(south), 5)]
+    for job in jobs:
+        job['cc'] = 'TOTAL'
     counter = 1
-    for i in range(4):
-        url = 'http://comtrade.un.org/api/get?max=50000&type=C&freq=A&px=HS&ps=all&\
-r={}&p={}&rg=1&cc=TOTAL&fmt=csv'.format('%2C'.join(batch[i]), partner)
+    for job, data in engine.run_jobs(url, jobs, bucket=bucket, session=session):
         filename = str(counter) + '.csv'
-        r = requests.get(url)
         with open(filename, encoding='utf-8', mode='w', newline='') as file:
-            file.write(r.text)
+            file.write(data)
         counter += 1
-        sleep(1) 
     
 # Entire classification-years may be downloaded.
 # Reporter-classification-years may be accessed as well.
@@ -112,37 +103,105 @@ r={}&p={}&rg=1&cc=TOTAL&fmt=csv'.format('%2C'.join(batch[i]), partner)
 # (per authorization code or IP address if no authorization code is used).
 
 def get_reporters():
-    
-    url = 'http://comtrade.un.org/data/cache/reporterAreas.json'
-    resp = requests.get(url)
-    parsed_json = json.loads(resp.text)
-    reporter_dict = parsed_json['results']
-    reporter_df = pd.DataFrame(reporter_dict)
-    reporter_array = reporter_df['id'].values
-    reporter_list = [c for c in reporter_array if c != 'all']
-	
-    d = {reporter_dict[i]['id']: reporter_dict[i]['text'] for i in range(1, len(reporter_dict))}
-    return([reporter_list, d])
+    return([refdata.reporter_list(), refdata.reporter_dict()])
 
 def get_partners():
-    
-    url = 'http://comtrade.un.org/data/cache/partnerAreas.json'
-    resp = requests.get(url)
-    parsed_json = json.loads(resp.text)
-    partner_dict = parsed_json['results']
-    partner_df = pd.DataFrame(partner_dict)
-    partner_array = partner_df['id'].values
-    partner_list = [c for c in partner_array if c != 'all' and c != '0']
-    
-    d = {partner_dict[i]['id']: partner_dict[i]['text'] for i in range(1, len(partner_dict))}
-    return([partner_list, d])
+    return([refdata.partner_list(), refdata.partner_dict()])
+
 
-reporter_list = get_reporters()[0]
-reporter_dict =  get_reporters()[1]
-partner_list = get_partners()[0]
-partner_dict =  get_partners()[1]
 url = 'http://comtrade.un.org/api/get?'
+bucket = engine.hourly_bucket(1000)
+session = engine.make_session()
+NO_DATA = ('No data matches your query or your query is too complex. '
+           'Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,')
+
+
+@lru_cache(maxsize=None)
+def get_journal():
+    """Download journal, opened on first use rather than on import."""
+    return Journal()
 
+@lru_cache(maxsize=None)
+def get_planner():
+    """Query planner, opened on first use rather than on import."""
+    return Planner()
+
+def chunk(seq, size):
+    """Split ``seq`` into consecutive lists of at most ``size`` elements."""
+    seq = list(seq)
+    return [seq[i : i + size] for i in range(0, len(seq), size)]
+
+def is_empty(text):
+    """Whether the csv response says no data matches the query."""
+    rows = text.split(sep = '\r\n')
+    return len(rows) < 2 or rows[1] == NO_DATA
+
+def chunk_key(job):
+    """Journal key identifying the chunk requested by payload ``job``."""
+    return '|'.join(k + '=' + str(job[k]) for k in ['freq', 'r', 'p', 'ps', 'rg', 'cc'])
+
+def parse_key(key):
+    """Inverse of ``chunk_key``."""
+    return dict(item.split('=', 1) for item in key.split('|'))
+
+def write_jobs(filename, plan_jobs, workers=8):
+    """
+    Fetch all planned payloads concurrently and write the responses
+    to a single csv file, keeping the header of the first response only.
+
+    ``plan_jobs`` is called with the set of (reporter, partner, period)
+    cells already downloaded and returns payloads covering the rest.
+    Progress is recorded in the download journal, so rerunning after a crash
+    skips finished chunks and appends to the existing file. Responses that
+    reach the row cap are split and queried again.
+    """
+
+    journal, planner = get_journal(), get_planner()
+    offset = journal.resume(filename, filename)
+    downloaded = {c for key in journal.finished(filename) for c in cells(parse_key(key))}
+    jobs = plan_jobs(downloaded)
+    journal.discard_pending(filename)
+    journal.register(filename, [chunk_key(job) for job in jobs])
+    journal.report(filename)
+
+    with open(filename, encoding = 'utf-8', mode = 'a' if offset else 'w', newline = '') as file:
+        counter = 1 if offset else 0
+        while jobs:
+            splits = []
+            for job, data in engine.run_jobs(url, jobs, bucket=bucket, workers=workers,
+                                             session=session):
+                desc = 'period ' + job['ps'] + ', reporters ' + job['r'] + ', partners ' + job['p']
+                planner.record(job, data)
+                if is_empty(data):
+                    print('No data matches for ' + desc + '.')
+                    journal.mark(filename, chunk_key(job), EMPTY, offset=committed_size(file))
+                    continue
+                if n_rows(data) >= planner.cap:
+                    parts = planner.split(job)
+                    if parts:
+                        print('Row cap reached for ' + desc + '. Splitting query.')
+                        journal.mark(filename, chunk_key(job), SPLIT)
+                        journal.register(filename, [chunk_key(part) for part in parts])
+                        splits.extend(parts)
+                        continue
+                    print('Row cap reached for ' + desc + '. Data may be truncated.')
+                n = n_rows(data)
+                rows = data.split(sep = '\r\n')
+                if counter != 0:
+                    data = '\r\n'.join(rows[1:])
+                file.write(data)
+                journal.mark(filename, chunk_key(job), DONE, rows=n,
+                             offset=committed_size(file))
+                print('Data for ' + desc + ' written on ' + strftime("%Y-%m-%d %H:%M:%S") + '.')
+                counter += 1
+            jobs = splits
+    journal.report(filename)
+    return
+
+
+def taiwan_jobs(year, month, exclude=()):
+    """Return payloads for all reporters, with Taiwan as partner."""
+    return get_planner().plan(refdata.reporter_list(), ['490'], [str(year) + str(month).zfill(2)], exclude=exclude)
 
 def get_taiwan(year, month):
     """
@@ -152,94 +211,9 @@ def get_taiwan(year, month):
     """
     
     filename = str(year) + '-' + str(month).zfill(2) + '.csv'
-    file = open(filename, encoding = 'utf-8', mode = 'w', newline = '')
-    
-    # Iteration part
-    counter = 0
-    for i in range(0, len(reporter_list) // 5 * 5 - 5 + 1, 5):
-        country_group = ','.join(reporter_list[i : i + 5])
-        payload = {'max': 50000,
-                   'type': 'C',
-                   'freq': 'M',
-                   'px': 'HS',
-                   'ps': str(year) + str(month).zfill(2),
-                   'r': country_group,
-                   'p': '490',
-                   'rg': '1',
-                   'cc': 'AG6',
-                   'fmt': 'csv'
-        }
-        while True:
-            try:
-                resp = requests.get(url + urllib.parse.urlencode(payload))
-                if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                    break
-            except:
-                sleep(1)
-            else:
-                if resp.text == '{"Message":"An error has occurred."}':
-                    print('An error has occurred with message:\n' + resp.text)
-                    sleep(600)
-                if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                    print('An error has occurred with message:\n' + resp.text)
-                    sleep(5)
-        if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-            print('No data matches for ' + country_group + '.')
-            sleep(37)
-            continue
-        data = resp.text
-        if counter != 0:
-            with_header = data.split(sep = '\r\n')
-            header_removed = [with_header[x] for x in range(len(with_header)) if x != 0]
-            data = '\r\n'.join(header_removed)
-        file.write(data)
-        print('Data for ' + country_group + ' written on ' + 
-            strftime("%Y-%m-%d %H:%M:%S") + '.')
-        counter += 1
-        sleep(37)
-    
-    # Last iteration
-    country_group = ','.join(reporter_list[len(reporter_list) // 5 * 5 : len(reporter_list)])
-    payload = {'max': 50000,
-               'type': 'C',
-               'freq': 'M',
-               'px': 'HS',
-               'ps': str(year) + str(month).zfill(2),
-               'r': country_group,
-               'p': '490',
-               'rg': '1',
-               'cc': 'AG6',
-               'fmt': 'csv'
-    }
-    while True:
-        try:
-            resp = requests.get(url + urllib.parse.urlencode(payload))
-            if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                break
-        except:
-            sleep(1)
-        else:
-            if resp.text == '{"Message":"An error has occurred."}':
-                print('An error has occurred with message:\n' + resp.text)
-                sleep(600)
-            if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                print('An error has occurred with message:\n' + resp.text)
-                sleep(5)
-    if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-        print('No data matches for ' + country_group + '.')
-        return()
-    data = resp.text
-    if counter != 0:
-        with_header = data.split(sep = '\r\n')
-        header_removed = [with_header[x] for x in range(len(with_header)) if x != 0]
-        data = '\r\n'.join(header_removed)
-    file.write(data)
-    print('Data for ' + country_group + ' written on ' + 
-        strftime("%Y-%m-%d %H:%M:%S") + '.')
-    
+    write_jobs(filename, lambda exclude: taiwan_jobs(year, month, exclude))
     print('\nData for ' + calendar.month_name[month] + ', ' + str(year) +
         ' written on ' + strftime("%Y-%m-%d %H:%M:%S") + '.\n')
-    file.close()
     return()
 
 def get_taiwan_all():
@@ -250,6 +224,10 @@ def get_taiwan_all():
     return()
 
 
+def taiwan_annual_jobs(year, exclude=()):
+    """Return payloads for all reporters, with Taiwan as partner."""
+    return get_planner().plan(refdata.reporter_list(), ['490'], [str(year)], freq='A', exclude=exclude)
+
 def get_taiwan_annual(year):
     """
     Retrieve import data of all reporting countries where Taiwan is
@@ -258,304 +236,43 @@ def get_taiwan_annual(year):
     """
 
     filename = str(year) + '.csv'
-    file = open(filename, encoding = 'utf-8', mode = 'w', newline = '')
-    
-    # Iteration part
-    counter = 0
-    for i in reporter_list:
-        # country_group = ','.join(reporter_list[i : i + 5])
-        payload = {'max': 50000,
-                   'type': 'C',
-                   'freq': 'A',
-                   'px': 'HS',
-                   'ps': str(year),
-                   'r': str(i),
-                   'p': '490',
-                   'rg': '1',
-                   'cc': 'AG6',
-                   'fmt': 'csv'
-        }
-        while True:
-            try:
-                resp = requests.get(url + urllib.parse.urlencode(payload))
-                if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                    break
-            except:
-                sleep(1)
-            else:
-                if resp.text == '{"Message":"An error has occurred."}':
-                    print('An error has occurred with message:\n' + resp.text)
-                    sleep(37)
-                    continue
-                if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                    print('An error has occurred with message:\n' + resp.text)
-                    sleep(5)
-        if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-            print('No data matches for ' + str(i) + '.')
-            sleep(37)
-            continue
-        data = resp.text
-        if counter != 0:
-            with_header = data.split(sep = '\r\n')
-            header_removed = [with_header[x] for x in range(len(with_header)) if x != 0]
-            data = '\r\n'.join(header_removed)
-        file.write(data)
-        print('Data for ' + str(i) + ' written on ' + 
-            strftime("%Y-%m-%d %H:%M:%S") + '.')
-        counter += 1
-        sleep(37)
-    
-    # Last iteration
-    # country_group = ','.join(reporter_list[len(reporter_list) // 5 * 5 : len(reporter_list)])
-    # payload = {'max': 50000,
-               # 'type': 'C',
-               # 'freq': 'A',
-               # 'px': 'HS',
-               # 'ps': str(year),
-               # 'r': country_group,
-               # 'p': '490',
-               # 'rg': '1',
-               # 'cc': 'AG6',
-               # 'fmt': 'csv'
-    # }
-    # while True:
-        # try:
-            # resp = requests.get(url + urllib.parse.urlencode(payload))
-            # if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                # break
-        # except:
-            # sleep(1)
-        # else:
-            # if resp.text == '{"Message":"An error has occurred."}':
-                # print('An error has occurred with message:\n' + resp.text)
-                # sleep(600)
-            # if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                # print('An error has occurred with message:\n' + resp.text)
-                # sleep(5)
-    # if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-        # print('No data matches for ' + country_group + '.')
-        # return()
-    # data = resp.text
-    # if counter != 0:
-        # with_header = data.split(sep = '\r\n')
-        # header_removed = [with_header[x] for x in range(len(with_header)) if x != 0]
-        # data = '\r\n'.join(header_removed)
-    # file.write(data)
-    # print('Data for ' + country_group + ' written on ' + 
-        # strftime("%Y-%m-%d %H:%M:%S") + '.')
-    
-    print('\nData for ' + calendar.month_name[month] + ', ' + str(year) +
-        ' written on ' + strftime("%Y-%m-%d %H:%M:%S") + '.\n')
-    file.close()
+    write_jobs(filename, lambda exclude: taiwan_annual_jobs(year, exclude))
+    print('\nData for ' + str(year) + ' written on ' + strftime("%Y-%m-%d %H:%M:%S") + '.\n')
     return()
 
 def get_taiwan_annual_all():
     for year in [2016]:
-        get_taiwan(year)
+        get_taiwan_annual(year)
     return()
 
 
+def import_jobs(reporter_id, exclude=()):
+    """Return payloads covering all time periods and all partner countries."""
+    periods = [str(year) + str(month).zfill(2) for year in range(2010, 2016) for month in range(1, 13)]
+    periods.extend(['2016' + str(month).zfill(2) for month in range(1, 5)])
+    return get_planner().plan([reporter_id], refdata.partner_list(), periods, exclude=exclude)
+
 def get_import(reporter_id):
     """
     Retrieve import data of one single reporting country from all partner countries.
     Loop over all time periods and all partner countries.
     """
     
-    filename = reporter_dict[reporter_id].replace(' ', '_').lower() + '.csv'
-    file = open(filename, encoding = 'utf-8', mode = 'w', newline = '')
-    periods = [str(year) + str(month).zfill(2) for year in range(2010, 2016) for month in range(1, 13)]
-    periods.extend(['2016' + str(month).zfill(2) for month in range(1, 5)])
-	
-    # Outer iteration part
-    counter = 0
-    for i in range(0, len(periods) // 3 * 3 - 3 + 1, 3):
-        period_group = ','.join(periods[i : i + 3])
-        # Inner iteration part, of outer iteration part
-        for j in range(0, len(partner_list) // 5 * 5 - 5 + 1, 5):
-            partner_group = ','.join(partner_list[j : j + 5])
-            payload = {'max': 50000,
-                       'type': 'C',
-                       'freq': 'M',
-                       'px': 'HS',
-                       'ps': period_group,
-                       'r': reporter_id,
-                       'p': partner_group,
-                       'rg': '1',
-                       'cc': 'AG6',
-                       'fmt': 'csv'
-            }
-            while True:
-                try:
-                    resp = requests.get(url + urllib.parse.urlencode(payload))
-                    if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                        break
-                except:
-                    sleep(1)
-                else:
-                    if resp.text == '{"Message":"An error has occurred."}':
-                        print('An error has occurred with message:\n' + resp.text)
-                        sleep(600)
-                    if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                        print('An error has occurred with message:\n' + resp.text)
-                        sleep(5)
-            if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-                print('No data matches for ' + period_group + ', partners ' + partner_group + '.')
-                sleep(37)
-                continue
-            data = resp.text
-            if counter != 0:
-                with_header = data.split(sep = '\r\n')
-                header_removed = [with_header[x] for x in range(len(with_header)) if x != 0]
-                data = '\r\n'.join(header_removed)
-            file.write(data)
-            print('Data for ' + period_group + ', partners ' + partner_group + ' written on ' + 
-                strftime("%Y-%m-%d %H:%M:%S") + '.')
-            counter += 1
-            sleep(37)
-
-        # Last inner iteration, of outer iteration part
-        partner_group = ','.join(partner_list[len(partner_list) // 5 * 5 : len(partner_list)])
-        payload = {'max': 50000,
-                   'type': 'C',
-                   'freq': 'M',
-                   'px': 'HS',
-                   'ps': period_group,
-                   'r': reporter_id,
-                   'p': partner_group,
-                   'rg': '1',
-                   'cc': 'AG6',
-                   'fmt': 'csv'
-        }
-        while True:
-            try:
-                resp = requests.get(url + urllib.parse.urlencode(payload))
-                if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                    break
-            except:
-                sleep(1)
-            else:
-                if resp.text == '{"Message":"An error has occurred."}':
-                    print('An error has occurred with message:\n' + resp.text)
-                    sleep(600)
-                if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                    print('An error has occurred with message:\n' + resp.text)
-                    sleep(5)
-        if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-            print('No data matches for ' + period_group + ', partners ' + partner_group + '.')
-            return()
-        data = resp.text
-        if counter != 0:
-            with_header = data.split(sep = '\r\n')
-            header_removed = [with_header[x] for x in range(len(with_header)) if x != 0]
-            data = '\r\n'.join(header_removed)
-        file.write(data)
-        print('Data for ' + period_group + ', partners ' + partner_group + ' written on ' + 
-            strftime("%Y-%m-%d %H:%M:%S") + '.')
-        
-        print('Data for ' + period_group + ' for ALL PARTNERS written on ' +
-            strftime("%Y-%m-%d %H:%M:%S") + '.')
-
-    # Last outer iteration
-    period_group = ','.join(periods[len(periods) // 3 * 3 : len(periods)])
-    # Inner iteration part, of last outer iteration
-    for j in range(0, len(partner_list) // 5 * 5 - 5 + 1, 5):
-        partner_group = ','.join(partner_list[j : j + 5])
-        payload = {'max': 50000,
-                   'type': 'C',
-                   'freq': 'M',
-                   'px': 'HS',
-                   'ps': period_group,
-                   'r': reporter_id,
-                   'p': partner_group,
-                   'rg': '1',
-                   'cc': 'AG6',
-                   'fmt': 'csv'
-        }
-        while True:
-            try:
-                resp = requests.get(url + urllib.parse.urlencode(payload))
-                if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                    break
-            except:
-                sleep(1)
-            else:
-                if resp.text == '{"Message":"An error has occurred."}':
-                    print('An error has occurred with message:\n' + resp.text)
-                    sleep(600)
-                if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                    print('An error has occurred with message:\n' + resp.text)
-                    sleep(5)
-        if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-            print('No data matches for ' + period_group + ', partners ' + partner_group + '.')
-            sleep(37)
-            continue
-        data = resp.text
-        if counter != 0:
-            with_header = data.split(sep = '\r\n')
-            header_removed = [with_header[x] for x in range(len(with_header)) if x != 0]
-            data = '\r\n'.join(header_removed)
-        file.write(data)
-        print('Data for ' + period_group + ', partners ' + partner_group + ' written on ' + 
-            strftime("%Y-%m-%d %H:%M:%S") + '.')
-        counter += 1
-        sleep(37)
-
-    # Last inner iteration, of last outer iteration
-    partner_group = ','.join(partner_list[len(partner_list) // 5 * 5 : len(partner_list)])
-    payload = {'max': 50000,
-               'type': 'C',
-               'freq': 'M',
-               'px': 'HS',
-               'ps': period_group,
-               'r': reporter_id,
-               'p': partner_group,
-               'rg': '1',
-               'cc': 'AG6',
-               'fmt': 'csv'
-    }
-    while True:
-        try:
-            resp = requests.get(url + urllib.parse.urlencode(payload))
-            if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                break
-        except:
-            sleep(1)
-        else:
-            if resp.text == '{"Message":"An error has occurred."}':
-                print('An error has occurred with message:\n' + resp.text)
-                sleep(600)
-            if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                print('An error has occurred with message:\n' + resp.text)
-                sleep(5)
-    if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-        print('No data matches for ' + period_group + ', partners ' + partner_group + '.')
-        return()
-    data = resp.text
-    if counter != 0:
-        with_header = data.split(sep = '\r\n')
-        header_removed = [with_header[x] for x in range(len(with_header)) if x != 0]
-        data = '\r\n'.join(header_removed)
-    file.write(data)
-    print('Data for ' + period_group + ', partners ' + partner_group + ' written on ' + 
-        strftime("%Y-%m-%d %H:%M:%S") + '.')
-    
-    print('Data for ' + period_group + ' for ALL PARTNERS written on ' + 
-        strftime("%Y-%m-%d %H:%M:%S") + '.')
-    
-    print('\nData for ' + reporter_dict[reporter_id].replace(' ', '_').lower() +
+    filename = refdata.reporter_dict()[reporter_id].replace(' ', '_').lower() + '.csv'
+    write_jobs(filename, lambda exclude: import_jobs(reporter_id, exclude))
+    print('\nData for ' + refdata.reporter_dict()[reporter_id].replace(' ', '_').lower() +
         ' written on ' + strftime("%Y-%m-%d %H:%M:%S") + '.\n')
-    file.close()
     return()
 
 def find_key(input_dict, value):
     return(next((k for k, v in input_dict.items() if v == value), None))
 
 def get_import_selected():
-    for reporter_id in [find_key(reporter_dict, x) for x in ['China', 'Indonesia', 'India', 'Viet Nam', 'Turkey', 'USA']]:
+    for reporter_id in [find_key(refdata.reporter_dict(), x) for x in ['China', 'Indonesia', 'India', 'Viet Nam', 'Turkey', 'USA']]:
         get_import(reporter_id)
 
 def get_import_all():
-    for reporter_id in reporter_dict:
+    for reporter_id in refdata.reporter_dict():
         get_import(reporter_id)
 
 
@@ -564,47 +281,20 @@ def get_import_from_world(reporter_id):
     Retrieve import data of one single reporting country from the world.
     Loop over 2014, 2015 (annually) and all partner countries.
     """
-    filename = reporter_dict[reporter_id].replace(' ', '_').lower() + '.csv'
+    filename = refdata.reporter_dict()[reporter_id].replace(' ', '_').lower() + '.csv'
     if os.path.isfile(filename) == True:
         return()
-    payload = {'max': 50000,
-               'type': 'C',
-               'freq': 'A',
-               'px': 'HS',
-               'ps': '2012,2013',
-               'r': reporter_id,
-               'p': '0',
-               'rg': '1',
-               'cc': 'AG6',
-               'fmt': 'csv'
-    }
-    while True:
-        try:
-            resp = requests.get(url + urllib.parse.urlencode(payload))
-            if resp.text != '{"Message":"An error has occurred."}' and resp.text != 'RATE LIMIT: You must wait 1 seconds.':
-                break
-        except:
-            sleep(1)
-        else:
-            if resp.text == '{"Message":"An error has occurred."}':
-                print('An error has occurred with message:\n' + resp.text)
-                sleep(600)
-            if resp.text == 'RATE LIMIT: You must wait 1 seconds.':
-                print('An error has occurred with message:\n' + resp.text)
-                sleep(5)
-                
-    if resp.text.split(sep = '\r\n')[1] == 'No data matches your query or your query is too complex. Request JSON or XML format for more information.,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,':
-        print('No data matches for ' + reporter_dict[reporter_id].replace(' ', '_').lower())
-        sleep(37)
+    data = engine.fetch(session, url, make_job(ps='2012,2013', r=reporter_id, p='0', freq='A'),
+                        bucket=bucket)
+    if is_empty(data):
+        print('No data matches for ' + refdata.reporter_dict()[reporter_id].replace(' ', '_').lower())
         return()
-    data = resp.text
-    filename = reporter_dict[reporter_id].replace(' ', '_').lower() + '.csv'
     with open(filename, encoding = 'utf-8', mode = 'w', newline = '') as file:
         file.write(data)
-    print('\nData for ' + reporter_dict[reporter_id].replace(' ', '_').lower() +
+    print('\nData for ' + refdata.reporter_dict()[reporter_id].replace(' ', '_').lower() +
         ' written on ' + strftime("%Y-%m-%d %H:%M:%S") + '.\n')
     return()
 
 def get_import_from_world_all():
-    for reporter_id in reporter_dict:
+    for reporter_id in refdata.reporter_dict():
         get_import_from_world(reporter_id)
\ No newline at end of file
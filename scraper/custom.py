@@ -1,92 +1,32 @@
 import requests
-import json
 from robobrowser import RoboBrowser
 import urllib.parse
 from time import strftime, sleep
 import calendar
 import shutil
 import os
+import engine
+import codetree
+import ga03
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
-def get_code():
+def get_code(full=False, rate=None):
+    """Crawl (or refresh) the tariff code tree and return the 11-digit codes."""
 
-    url = 'https://portal.sw.nat.gov.tw/APGA/GoodsSearch_toByCode'
-
-    resp = requests.post(url + '2', verify = False)
-    data = json.loads(resp.text)
-
-    twos = []
-    fours = []
-    sixs = []
-    eights = []
-    elevens = []
-    counter = 0
-
-    for i in range(len(data['listBy2'])):
-        twos.append(data['listBy2'][i]['cnyChinese'])
-
-    for elementOf2 in twos:
-        print(elementOf2)
-        form4 = {'code2':elementOf2}
-        resp4 = requests.post(url + '4', data = form4, verify = False)
-        data4 = json.loads(resp4.text)
-        
-        for j in range(len(data4['listBy4'])):
-            elementOf4 = data4['listBy4'][j]['cnyChinese']
-            print(elementOf4)
-            fours.append(elementOf4)
-            
-            form6 = {'code2':elementOf2, 'code4':elementOf4}
-            resp6 = requests.post(url + '6', data = form6, verify = False)
-            data6 = json.loads(resp6.text)
-            
-            for k in range(len(data6['listBy6'])):
-                elementOf6 = data6['listBy6'][k]['cnyChinese']
-                print(elementOf6)
-                sixs.append(elementOf6)
-                
-                form8 = {'code2':elementOf2, 'code4':elementOf4, 'code6':elementOf6}
-                resp8 = requests.post(url + '8', data = form8, verify = False)
-                data8 = json.loads(resp8.text)
-                
-                for l in range(len(data8['listBy8'])):
-                    elementOf8 = data8['listBy8'][l]['cnyChinese']
-                    print(elementOf8)
-                    eights.append(elementOf8)
-                    
-                    form11 = {'code2':elementOf2, 'code4':elementOf4, 'code6':elementOf6, 'code8':elementOf8}
-                    resp11 = requests.post(url + '11', data = form11, verify = False)
-                    data11 = json.loads(resp11.text)
-                    
-                    for m in range(len(data11['listBy11'])):
-                        elementOf11 = data11['listBy11'][m]['cnyChinese']
-                        print(elementOf11)
-                        counter += 1
-                        print('###### Writing code number %s' % (counter) + ' ######')
-                        elevens.append(elementOf11)
-    
-    for collection in ['twos', 'fours', 'sixs', 'eights', 'elevens']:
-        file = open(collection + '.txt', encoding = 'utf-8', mode = 'w')
-        for x in eval(collection):
-            file.write(x + '\n')
-        file.close()
-    
-    file2 = open('elevens_list.txt', encoding = 'utf-8', mode = 'w')
-    file2.write(str(elevens))
-    file2.close()
-    
-    return(elevens)
+    codetree.crawl(full=full, rate=rate)
+    return codetree.load_codes(11)
 
 url = 'https://portal.sw.nat.gov.tw/APGA/GA03_LIST?'
 
 def get_custom(year, month):
     
-    with open('elevens_list_noname.txt', encoding = 'utf-8', mode = 'r') as file:
-        elevens = eval(file.read())
+    elevens = codetree.load_codes(11)
 
     filename = str(year + 1911) + '-' + str(month).zfill(2) + '.txt'
+    # One browser for the whole month, reusing its keep-alive connection
+    browser = RoboBrowser(session=engine.make_session(1))
     with open(filename, encoding = 'utf-8', mode = 'w') as output:
         header = '國家|貨品分類|中文貨名|英文貨品|數量|數量單位|重量|重量單位|價值\n'
         output.write(header)
@@ -120,32 +60,18 @@ def get_custom(year, month):
                    
             while True:
                 try:
-                    browser = RoboBrowser()
                     browser.open(url + urllib.parse.urlencode(payload), verify = False)
                     if browser.response.status_code == 200:
+                        # Raises on a page without the data table, which is retried
+                        df = ga03.extract_table(browser.response.text, month, raw=True)
                         break
                 except:
                     print('An error has occurred. Retrying.')
                     print(browser.response.text)
                     sleep(60)
         
-            dataListNumber = 'dataList_' + str(month)
-            table = browser.find_all('table', {'id':dataListNumber})
-            tds = []
-            for table_element in table:
-                rows = table_element.find_all('tr')
-                for row in rows:
-                    td = row.find_all('td')
-                    tds.append(td)
-                
-            data = ''
-            for index in range(1, len(tds)):
-                row_data = tds[index]
-                if row_data[1].text == '合計':
-                    continue
-                for data_index in range(8):
-                    data += row_data[data_index].text + '|'
-                data += row_data[8].text + '\n'
+            # Cells as they appear on the page, unquoted
+            data = ''.join('|'.join(row) + '\n' for row in df.values)
 
             output.write(data)
             terminal_size = shutil.get_terminal_size()[0]
@@ -183,35 +109,17 @@ def get_custom(year, month):
                    
         while True:
             try:
-                browser = RoboBrowser()
                 browser.open(url + urllib.parse.urlencode(payload), verify = False)
                 if browser.response.status_code == 200:
+                    # Raises on a page without the data table, which is retried
+                    df = ga03.extract_table(browser.response.text, month, raw=True)
                     break
             except:
                 print('An error has occurred. Retrying.')
                 print(browser.response.text)
                 sleep(60)
 
-        dataListNumber = 'dataList_' + str(month)
-        table = browser.find_all('table', {'id':dataListNumber})
-        tds = []
-        for table_element in table:
-            rows = table_element.find_all('tr')
-            for row in rows:
-                td = row.find_all('td')
-                tds.append(td)
-            
-        data = ''
-        for index in range(1, len(tds)):
-            row_data = tds[index]
-            if row_data[1].text == '合計':
-                continue
-            for data_index in range(8):
-                data += row_data[data_index].text + '|'
-            if index != len(tds) - 1:
-                data += row_data[8].text + '\n'
-            else:
-                data += row_data[8].text
+        data = ''.join('|'.join(row) + '\n' for row in df.values).rstrip('\n')
 
         output.write(data)
         print('Data for',
@@ -1,10 +1,15 @@
 import datetime
 import requests
 import urllib.parse
-import pandas as pd
 from time import strftime, sleep
 import calendar
 import shutil
+import os
+from functools import lru_cache
+import engine
+import codetree
+import ga03
+from journal import Journal, BatchWriter
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 """
@@ -21,8 +26,13 @@ curr_year = curr_time.year - 1911
 prev_month = curr_time.month - 1
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
+@lru_cache(maxsize=None)
+def get_journal():
+    """Download journal, opened on first use rather than on import."""
+    return Journal()
+
 def get_custom_data(year=curr_year, month=prev_month, io='export',
-                    currency='usd'):
+                    currency='usd', workers=1, rate=1.0, fmt='tsv'):
     """
     Return monthly custom data.
     
@@ -32,6 +42,15 @@ def get_custom_data(year=curr_year, month=prev_month, io='export',
     month : int, default one month prior to current month.
     io: {'import', 'export'}, default 'export'.
     currency : {'usd', 'ntd'}, default 'usd'.
+    workers : int, default 1.
+        Number of batches fetched in parallel. Each worker keeps its own
+        pooled session.
+    rate : float or None, default 1.0.
+        Politeness limit: maximum requests per second across all workers.
+        None for no limit.
+    fmt : {'tsv', 'parquet'}, default 'tsv'.
+        Output format. Batches are streamed to disk as they arrive and the
+        month's file appears only once every batch is written.
     
     """
     
@@ -44,16 +63,21 @@ def get_custom_data(year=curr_year, month=prev_month, io='export',
         raise ValueError('Invalid io. Must be either "import" or "export".')
     if currency not in ['usd', 'ntd']:
         raise ValueError('Invalid currency. Must be either "usd" or "ntd".')
+    if fmt not in ['tsv', 'parquet']:
+        raise ValueError('Invalid fmt. Must be either "tsv" or "parquet".')
+    if workers < 1:
+        raise ValueError('Invalid workers. Must be at least 1.')
     
     # load list of commodity codes
-    with open('elevens_list_noname.txt', encoding='utf-8', mode='r') as file:
-        elevens = eval(file.read())
+    elevens = codetree.load_codes(11)
     
     # define some useful variables
     url = 'https://portal.sw.nat.gov.tw/APGA/GA03_LIST?'
-    colnames = ['國家', '貨品分類', '中文貨名', '英文貨名', '數量', '數量單位',
-    '重量', '重量單位', '價值']
-    df = pd.DataFrame(columns=colnames)    
+    colnames = ga03.COLNAMES
+    # parquet columns are typed; tsv cells are written as text, as they always were
+    dtype = {'國家': str, '貨品分類': str, '中文貨名': str, '英文貨名': str, '數量': float,
+             '數量單位': str, '重量': float, '重量單位': str, '價值': float}
+    bucket = engine.TokenBucket(rate=rate, capacity=workers) if rate else None
     
     def generate_payload(commodities, year=year, month=month, io=io,
                          currency=currency):
@@ -91,6 +115,18 @@ def get_custom_data(year=curr_year, month=prev_month, io='export',
                    ('Search', '開始查詢')]
         return payload
     
+    def text_cells(df):
+        """
+        Stripped cells, without thousands separators in numeric columns;
+        '-' and blanks are kept as they are.
+        
+        """
+        
+        df = df.apply(lambda col: col.str.strip())
+        for col in ga03.NUMERIC:
+            df[col] = df[col].str.replace(',', '')
+        return df
+    
     def get_data(payload):
         """
         Send request and save requested data as DataFrame.
@@ -98,18 +134,21 @@ def get_custom_data(year=curr_year, month=prev_month, io='export',
         """
         
         while True:
+            if bucket is not None:
+                bucket.acquire()
             try:
-                res = requests.get(url + urllib.parse.urlencode(payload), verify=False)
+                res = engine.thread_session().get(url + urllib.parse.urlencode(payload),
+                                                  verify=False)
                 if res.ok:
-                    break
-            except:
+                    # A page without the data table (busy, error, expired session) is
+                    # retried rather than recorded as an empty batch
+                    if fmt == 'parquet':
+                        return ga03.extract_table(res.text, month, colnames)
+                    return text_cells(ga03.extract_table(res.text, month, colnames, raw=True))
                 print('An error has occurred with status code %d. Retrying.' % res.status_code)
-                sleep(60)
-        tb = pd.read_html(res.text)
-        df = tb[11]
-        df.columns = colnames
-        df = df.query('貨品分類 != "合計"').drop(0, axis=0)
-        return df
+            except (requests.RequestException, ga03.TableNotFound) as e:
+                print('An error has occurred with message %s. Retrying.' % e)
+            sleep(60)
         
     def report_progress(start, end):
         """
@@ -123,19 +162,7 @@ def get_custom_data(year=curr_year, month=prev_month, io='export',
               'on', strftime("%Y-%m-%d %H:%M:%S"))
         return
 
-    # iterate over commodity codes
-    for com in range(0, len(elevens) // 250 * 250 - 250 + 1, 250):
-        start_ind = com
-        end_ind = com + 250
-        report_progress(elevens[start_ind], elevens[end_ind - 1])
-        batch = ','.join(elevens[start_ind:end_ind])
-        payload = generate_payload(commodities=batch)
-        df = pd.concat([df, get_data(payload)], axis=0, ignore_index=True)
-    last = ','.join(elevens[len(elevens) // 250 * 250 : len(elevens)])
-    payload = generate_payload(commodities=last)
-    df = pd.concat([df, get_data(payload)], axis=0, ignore_index=True)
-    
-    # write data
+    # output file
     if currency == 'usd':
         placeholder1 = 'us'
     else:
@@ -145,10 +172,34 @@ def get_custom_data(year=curr_year, month=prev_month, io='export',
     else:
         placeholder2 = 'import'
     filename = '//172.20.23.190/ds/Raw Data/MOF-{}-2003-2017-{}/\
-{}-{}.tsv'.format(placeholder1, placeholder2, str(year + 1911), str(month).zfill(2))
+{}-{}.{}'.format(placeholder1, placeholder2, str(year + 1911), str(month).zfill(2), fmt)
     # filename = str(year + 1911) + '-' + str(month).zfill(2) + '.tsv'
-    with open(filename, encoding='utf-8', mode='w') as output:
-        df.to_csv(output, sep='\t', header=True, index=False, encoding='utf-8')
+    
+    # batches of 250 commodity codes, journaled so a crashed month resumes
+    # from the last committed batch
+    batches = [elevens[i:i + 250] for i in range(0, len(elevens), 250)]
+    journal = get_journal()
+    keys = [batch[0] + '-' + batch[-1] for batch in batches]
+    journal.register(filename, keys)
+    finished = journal.finished(filename)
+    if finished.issuperset(keys) and os.path.exists(filename):
+        print('Data for', calendar.month_name[month] + ', %s' % (year + 1911), 'already downloaded.')
+        return
+    journal.report(filename)
+    
+    def fetch_batch(batch):
+        report_progress(batch[0], batch[-1])
+        return get_data(generate_payload(commodities=','.join(batch)))
+    
+    # fetch batches in parallel, write them in order
+    with BatchWriter(filename, journal, fmt=fmt,
+                     dtype=dtype if fmt == 'parquet' else None) as writer:
+        # opening the writer may reset the journal if the partial file is gone
+        finished = journal.finished(filename)
+        todo = [(batch, key) for batch, key in zip(batches, keys) if key not in finished]
+        for (batch, key), df in engine.map_ordered(lambda item: fetch_batch(item[0]), todo, workers):
+            writer.write(key, df)
+        writer.commit()
         
     terminal_size = shutil.get_terminal_size()[0]
     line = '=' * terminal_size + '\n'
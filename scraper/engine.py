@@ -0,0 +1,155 @@
+"""
+Concurrent fetch engine for rate-limited APIs.
+
+Requests are issued from a thread pool and throttled by a token bucket that
+is shared by every worker, so throughput is set by the quota rather than by
+fixed sleeps between requests. All workers reuse the keep-alive connections
+of a single pooled session.
+"""
+
+import threading
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+import requests
+from requests.adapters import HTTPAdapter
+
+ERROR_MESSAGE = '{"Message":"An error has occurred."}'
+RATE_LIMIT_MESSAGE = 'RATE LIMIT: You must wait 1 seconds.'
+_local = threading.local()
+
+
+class TokenBucket:
+    """Thread-safe token bucket.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    capacity : float, default 1
+        Maximum number of tokens that can be accumulated (burst size).
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until one token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+def hourly_bucket(quota=1000, capacity=1):
+    """Return a token bucket allowing ``quota`` requests per hour."""
+    return TokenBucket(rate=quota / 3600, capacity=capacity)
+
+
+def make_session(pool_size=8):
+    """Return a session whose connection pool holds ``pool_size`` keep-alive connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def thread_session():
+    """Return a pooled session owned by the calling thread, created on first use."""
+    if not hasattr(_local, 'session'):
+        _local.session = make_session(1)
+    return _local.session
+
+
+def fetch(session, url, payload, bucket=None, **kwargs):
+    """Send one GET request and return the response text, retrying on errors.
+
+    A token is taken from ``bucket`` before every attempt, retries included,
+    since every attempt counts against the quota.
+    """
+
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            resp = session.get(url + urllib.parse.urlencode(payload), **kwargs)
+        except requests.RequestException as e:
+            print('An error has occurred with message:\n' + str(e))
+            sleep(1)
+            continue
+        if resp.text == ERROR_MESSAGE:
+            print('An error has occurred with message:\n' + resp.text)
+            sleep(60)
+            continue
+        if resp.text == RATE_LIMIT_MESSAGE:
+            print('An error has occurred with message:\n' + resp.text)
+            sleep(5)
+            continue
+        return resp.text
+
+
+def map_ordered(func, items, workers=8):
+    """Apply ``func`` to ``items`` in a thread pool.
+
+    Items are consumed lazily and at most ``2 * workers`` calls are pending at
+    any time, so a long item list is never submitted (and buffered) at once.
+
+    Yields
+    ------
+    (item, result) : tuple
+        Each item with its result, in the order ``items`` were given.
+    """
+
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            item, future = pending.popleft()
+            result = future.result()
+            for item_next in items:
+                pending.append((item_next, executor.submit(func, item_next)))
+                break
+            yield item, result
+
+
+def run_jobs(url, jobs, bucket=None, workers=8, session=None, **kwargs):
+    """Fetch the payloads in ``jobs`` concurrently.
+
+    Parameters
+    ----------
+    url : str
+        Base URL the url-encoded payload is appended to.
+    jobs : iterable of dict
+        Request payloads. Consumed lazily, so it may be a generator.
+    bucket : TokenBucket, optional
+        Shared rate limiter. No throttling if None.
+    workers : int, default 8
+        Maximum number of requests in flight.
+    session : requests.Session, optional
+        Pooled session to use. A new one is created if None.
+
+    Yields
+    ------
+    (job, text) : tuple
+        Each payload with its response text, in the order ``jobs`` were given.
+    """
+
+    if session is None:
+        session = make_session(workers)
+    return map_ordered(lambda job: fetch(session, url, job, bucket, **kwargs), jobs, workers)
@@ -0,0 +1,114 @@
+"""
+Extractor for the data table of MOF GA03_LIST result pages.
+
+A result page carries a dozen layout tables; the data sits in the one with
+id ``dataList_<month>``. Rather than parsing the whole page, the table is
+located by its id in the raw html and only that fragment is parsed with
+lxml. Numeric columns are returned typed, without thousands separators, or
+as the raw cell text.
+
+Benchmark against ``pd.read_html`` on saved result pages:
+
+    python ga03.py MONTH page1.html [page2.html ...]
+"""
+
+import io
+import re
+import sys
+import timeit
+import pandas as pd
+import lxml.html
+
+COLNAMES = ['國家', '貨品分類', '中文貨名', '英文貨名', '數量', '數量單位',
+            '重量', '重量單位', '價值']
+NUMERIC = ['數量', '重量', '價值']
+
+
+class TableNotFound(ValueError):
+    """The page has no data table, e.g. a busy, error or expired-session page."""
+
+
+def extract_table(html, month, colnames=COLNAMES, raw=False):
+    """
+    Return the data rows of table ``dataList_<month>`` as a DataFrame.
+
+    The first row of the table is the header and is dropped, as are subtotal
+    rows ('合計') and rows with fewer cells than ``colnames``. An empty frame
+    means the table is there but has no data rows.
+
+    Parameters
+    ----------
+    html : str
+        Result page.
+    month : int
+    colnames : list, default COLNAMES
+    raw : bool, default False
+        Return every cell as its text, untrimmed, as written by
+        ``custom.get_custom``. Otherwise cells are stripped and quantity,
+        weight and value are float, without thousands separators; values
+        that are not numbers (e.g. '-' or blank) become NaN.
+
+    Raises
+    ------
+    TableNotFound
+        If the page has no table ``dataList_<month>``.
+    """
+
+    start = re.search(r'<table[^>]*\bid=["\']?dataList_%d\b' % month, html)
+    if start is None:
+        raise TableNotFound('No table dataList_%d in page' % month)
+    # The data table has no nested tables, so the first closing tag ends it
+    end = html.find('</table>', start.start())
+    end = len(html) if end < 0 else end + len('</table>')
+    table = lxml.html.fragment_fromstring(html[start.start():end])
+
+    rows = []
+    for i, tr in enumerate(table.iter('tr')):
+        cells = [td.text_content() for td in tr.iter('td')]
+        if i == 0 or len(cells) < len(colnames) or cells[1].strip() == '合計':
+            continue
+        cells = cells[:len(colnames)]
+        rows.append(cells if raw else [cell.strip() for cell in cells])
+    df = pd.DataFrame(rows, columns=colnames)
+    if not raw:
+        for col in NUMERIC:
+            df[col] = pd.to_numeric(df[col].str.replace(',', ''),
+                                    errors='coerce').astype(float)
+    return df
+
+
+def extract_read_html(html, colnames=COLNAMES):
+    """Previous extraction path of ``custom2.get_data``, kept for benchmarking."""
+    df = pd.read_html(io.StringIO(html))[11]
+    df.columns = colnames
+    df = df.query('貨品分類 != "合計"').drop(0, axis=0)
+    return df
+
+
+def benchmark(paths, month, number=5):
+    """
+    Time ``pd.read_html`` against ``extract_table`` on saved result pages.
+
+    Returns
+    -------
+    timings : DataFrame
+        Seconds per page for each method, with row counts.
+    """
+
+    results = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        old = timeit.timeit(lambda: extract_read_html(html), number=number) / number
+        new = timeit.timeit(lambda: extract_table(html, month), number=number) / number
+        results.append({'page': path,
+                        'read_html': old,
+                        'extract_table': new,
+                        'speedup': old / new,
+                        'rows_read_html': len(extract_read_html(html)),
+                        'rows_extract_table': len(extract_table(html, month))})
+    return pd.DataFrame(results).set_index('page')
+
+
+if __name__ == '__main__':
+    print(benchmark(sys.argv[2:], int(sys.argv[1])))
@@ -0,0 +1,230 @@
+"""
+Persistent job manifest for long-running, rate-limited downloads.
+
+Every output file (``dataset``) is split into chunks identified by a string
+key, e.g. one Comtrade query or one batch of MOF commodity codes. Each chunk
+is recorded as 'pending', 'done', 'empty' or 'split' (re-queried as smaller
+chunks) together with the size of the output file after it was committed,
+so an interrupted run can truncate the file back to its last committed chunk
+and resume from there.
+"""
+
+import os
+import shutil
+import sqlite3
+from time import strftime
+
+PENDING, DONE, EMPTY, SPLIT = 'pending', 'done', 'empty', 'split'
+
+
+class Journal:
+    """SQLite-backed record of download chunks.
+
+    Parameters
+    ----------
+    path : str, default 'download_journal.sqlite'
+        Location of the SQLite database. Created if it does not exist.
+    """
+
+    def __init__(self, path='download_journal.sqlite'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                dataset TEXT NOT NULL,
+                key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                rows INTEGER,
+                offset INTEGER,
+                seq INTEGER,
+                updated TEXT,
+                PRIMARY KEY (dataset, key)
+            )""")
+        self.conn.commit()
+
+    def register(self, dataset, keys):
+        """Add ``keys`` as pending chunks of ``dataset``; existing chunks are left as they are."""
+        self.conn.executemany('INSERT OR IGNORE INTO chunks (dataset, key, status) VALUES (?, ?, ?)',
+                              [(dataset, k, PENDING) for k in keys])
+        self.conn.commit()
+
+    def finished(self, dataset):
+        """Return the set of chunk keys of ``dataset`` that are done or empty."""
+        cur = self.conn.execute('SELECT key FROM chunks WHERE dataset = ? AND status IN (?, ?)',
+                                (dataset, DONE, EMPTY))
+        return {row[0] for row in cur}
+
+    def keys(self, dataset, status):
+        """Return the set of chunk keys of ``dataset`` with ``status``."""
+        cur = self.conn.execute('SELECT key FROM chunks WHERE dataset = ? AND status = ?',
+                                (dataset, status))
+        return {row[0] for row in cur}
+
+    def mark(self, dataset, key, status, rows=0, offset=None):
+        """Record ``key`` as ``status``, together with the output file size after it was written."""
+        seq = self.conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM chunks WHERE dataset = ?',
+                                (dataset,)).fetchone()[0]
+        self.conn.execute("""
+            INSERT OR REPLACE INTO chunks (dataset, key, status, rows, offset, seq, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (dataset, key, status, rows, offset, seq, strftime('%Y-%m-%d %H:%M:%S')))
+        self.conn.commit()
+
+    def offset(self, dataset):
+        """Return the output file size recorded by the last committed chunk (0 if none)."""
+        row = self.conn.execute("""
+            SELECT offset FROM chunks
+            WHERE dataset = ? AND status != ? AND offset IS NOT NULL
+            ORDER BY seq DESC LIMIT 1""", (dataset, PENDING)).fetchone()
+        return row[0] if row else 0
+
+    def discard_pending(self, dataset):
+        """Forget pending chunks of ``dataset``, e.g. before registering a new plan."""
+        self.conn.execute('DELETE FROM chunks WHERE dataset = ? AND status = ?', (dataset, PENDING))
+        self.conn.commit()
+
+    def reset(self, dataset, keys=None):
+        """Mark every chunk of ``dataset`` (or only ``keys``) as pending again."""
+        sql = 'UPDATE chunks SET status = ?, rows = NULL, offset = NULL, seq = NULL WHERE dataset = ?'
+        if keys is None:
+            self.conn.execute(sql, (PENDING, dataset))
+        else:
+            self.conn.executemany(sql + ' AND key = ?', [(PENDING, dataset, k) for k in keys])
+        self.conn.commit()
+
+    def progress(self, dataset):
+        """Return a dict of chunk counts by status, plus total rows written."""
+        counts = {PENDING: 0, DONE: 0, EMPTY: 0, SPLIT: 0}
+        cur = self.conn.execute('SELECT status, COUNT(*) FROM chunks WHERE dataset = ? GROUP BY status',
+                                (dataset,))
+        counts.update(dict(cur.fetchall()))
+        counts['rows'] = self.conn.execute('SELECT COALESCE(SUM(rows), 0) FROM chunks WHERE dataset = ?',
+                                           (dataset,)).fetchone()[0]
+        return counts
+
+    def report(self, dataset):
+        """Print progress of ``dataset``."""
+        p = self.progress(dataset)
+        total = p[PENDING] + p[DONE] + p[EMPTY]
+        finished = p[DONE] + p[EMPTY]
+        print('{}: {}/{} chunks finished ({:.1f}%), {} empty, {} split, {:,} rows.'
+              .format(dataset, finished, total, finished / total * 100 if total else 100.0,
+                      p[EMPTY], p[SPLIT], p['rows']))
+        return
+
+    def resume(self, dataset, filename):
+        """Prepare ``filename`` for appending the remaining chunks of ``dataset``.
+
+        The file is truncated to the size recorded by the last committed chunk,
+        discarding anything written after it. If the file is missing or shorter
+        than recorded, the journal of ``dataset`` is reset so it is rebuilt
+        from scratch. Chunks found empty before any data was written stay
+        finished.
+
+        Returns
+        -------
+        offset : int
+            Size of the file after truncation; 0 means start a new file.
+        """
+
+        offset = self.offset(dataset)
+        if offset == 0:
+            return 0
+        if not os.path.isfile(filename) or os.path.getsize(filename) < offset:
+            print('Output file for {} is missing or incomplete. Restarting.'.format(dataset))
+            self.reset(dataset)
+            return 0
+        with open(filename, mode='r+b') as file:
+            file.truncate(offset)
+        return offset
+
+
+def committed_size(file):
+    """Flush ``file`` to disk and return its size in bytes."""
+    file.flush()
+    os.fsync(file.fileno())
+    return os.fstat(file.fileno()).st_size
+
+
+class BatchWriter:
+    """Stream DataFrame batches of one dataset to disk, journaling each batch.
+
+    Batches go to ``filename + '.part'`` as they arrive, so at most one batch
+    is held in memory. A crashed run resumes after the last committed batch.
+    ``commit`` renames the partial output to ``filename`` in one step, so the
+    final file never holds a partial month.
+
+    Parameters
+    ----------
+    filename : str
+        Final output path; also the dataset name in the journal.
+    journal : Journal
+    fmt : {'tsv', 'parquet'}, default 'tsv'
+        'tsv' appends to a single tab-separated file. 'parquet' writes one
+        file per batch into a directory that is read as a single dataset,
+        e.g. with ``pd.read_parquet(filename)``.
+    dtype : dict, optional
+        Column types applied before writing Parquet, so that every batch
+        has the same schema.
+    """
+
+    def __init__(self, filename, journal, fmt='tsv', dtype=None):
+        if fmt not in ['tsv', 'parquet']:
+            raise ValueError('Invalid fmt. Must be either "tsv" or "parquet".')
+        self.filename = filename
+        self.partial = filename + '.part'
+        self.journal = journal
+        self.fmt = fmt
+        self.dtype = dtype
+        self.file = None
+
+    def __enter__(self):
+        if self.fmt == 'tsv':
+            offset = self.journal.resume(self.filename, self.partial)
+            self.file = open(self.partial, encoding='utf-8', mode='a' if offset else 'w')
+        else:
+            os.makedirs(self.partial, exist_ok=True)
+            # Drop batch files the journal does not know as finished
+            finished = {k + '.parquet' for k in self.journal.finished(self.filename)}
+            present = set(os.listdir(self.partial))
+            for name in present - finished:
+                os.remove(os.path.join(self.partial, name))
+            # Fetch again the batches whose files are gone, as ``Journal.resume`` does for TSV
+            missing = [k for k in self.journal.keys(self.filename, DONE)
+                       if k + '.parquet' not in present]
+            if missing:
+                print('{} batch files of {} are missing. Fetching them again.'
+                      .format(len(missing), self.filename))
+                self.journal.reset(self.filename, missing)
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        return False
+
+    def write(self, key, df):
+        """Write batch ``df`` and record it in the journal under ``key``."""
+        offset = None
+        if self.fmt == 'tsv':
+            df.to_csv(self.file, sep='\t', header=self.file.tell() == 0, index=False, encoding='utf-8')
+            offset = committed_size(self.file)
+        else:
+            if self.dtype is not None:
+                df = df.astype(self.dtype)
+            path = os.path.join(self.partial, key + '.parquet')
+            # Hidden while being written, so readers of the directory skip it
+            tmp = os.path.join(self.partial, '.' + key + '.parquet.tmp')
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        self.journal.mark(self.filename, key, DONE if len(df) else EMPTY, rows=len(df), offset=offset)
+        return
+
+    def commit(self):
+        """Close the partial output and move it to ``filename``."""
+        self.__exit__()
+        if self.fmt == 'parquet' and os.path.isdir(self.filename):
+            shutil.rmtree(self.filename)
+        os.replace(self.partial, self.filename)
+        return
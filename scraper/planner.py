@@ -0,0 +1,213 @@
+"""
+Query planner for the Comtrade API.
+
+Every query returns at most ``max`` (50,000) rows and accepts at most five
+reporters, five partners and five periods. The planner estimates the number
+of rows of each (reporter, partner, period) cell from past responses, falling
+back on bulk availability metadata, and packs as many cells per query as fit
+under the cap. Responses that still reach the cap are split and re-queried.
+"""
+
+import csv
+import io
+import sqlite3
+
+CAP = 50000
+MAX_CODES = 5
+# Share of a reporter-period bulk record count expected in one partner's HS6
+# imports, used only for cells without history
+AVAILABILITY_SHARE = 0.001
+DEFAULT_ROWS = 1000
+
+
+class Planner:
+    """Row-count estimates and query packing.
+
+    Parameters
+    ----------
+    path : str, default 'download_journal.sqlite'
+        SQLite database holding observed row counts.
+    cap : int, default 50000
+        Maximum rows returned per query.
+    fill : float, default 0.8
+        Fraction of ``cap`` a planned query may be estimated to fill.
+    """
+
+    def __init__(self, path='download_journal.sqlite', cap=CAP, fill=0.8):
+        self.cap = cap
+        self.budget = cap * fill
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS observed (
+                freq TEXT, cc TEXT, r TEXT, p TEXT, ps TEXT, rows INTEGER,
+                PRIMARY KEY (freq, cc, r, p, ps)
+            )""")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS availability (
+                freq TEXT, r TEXT, ps TEXT, rows INTEGER,
+                PRIMARY KEY (freq, r, ps)
+            )""")
+        self.conn.commit()
+
+    def load_availability(self, records):
+        """Store record counts from ``comtrade.check_availability``."""
+        self.conn.executemany('INSERT OR REPLACE INTO availability VALUES (?, ?, ?, ?)',
+                              [(d['freq'][0], str(d['r']), str(d['ps']), d['TotalRecords'])
+                               for d in records])
+        self.conn.commit()
+
+    def record(self, job, text):
+        """Store the rows returned for each cell of ``job``.
+
+        Responses that reached the cap are incomplete and are not recorded.
+        """
+
+        if n_rows(text) >= self.cap:
+            return
+        counts = {cell: 0 for cell in cells(job)}
+        reader = csv.reader(io.StringIO(text))
+        header = next(reader, [])
+        if not {'Reporter Code', 'Partner Code', 'Period'}.issubset(header):
+            # No data: every cell of the query is empty
+            header = None
+        if header is not None:
+            r_ind, p_ind, ps_ind = (header.index(c) for c in ['Reporter Code', 'Partner Code', 'Period'])
+            for row in reader:
+                if len(row) > ps_ind:
+                    key = (row[r_ind], row[p_ind], row[ps_ind])
+                    if key in counts:
+                        counts[key] += 1
+        self.conn.executemany('INSERT OR REPLACE INTO observed VALUES (?, ?, ?, ?, ?, ?)',
+                              [(job['freq'], job['cc']) + cell + (rows,) for cell, rows in counts.items()])
+        self.conn.commit()
+        return
+
+    def estimate(self, r, p, ps, freq='M', cc='AG6'):
+        """Estimated number of rows for one cell.
+
+        In order of preference: the observed count of the cell, the mean
+        observed count of the same reporter and partner in other periods, a
+        share of the reporter's bulk record count for the period, and
+        ``DEFAULT_ROWS``.
+        """
+
+        row = self.conn.execute("""
+            SELECT rows FROM observed WHERE freq = ? AND cc = ? AND r = ? AND p = ? AND ps = ?""",
+            (freq, cc, r, p, ps)).fetchone()
+        if row is not None:
+            return row[0]
+        row = self.conn.execute("""
+            SELECT AVG(rows) FROM observed WHERE freq = ? AND cc = ? AND r = ? AND p = ?""",
+            (freq, cc, r, p)).fetchone()
+        if row[0] is not None:
+            return row[0]
+        row = self.conn.execute('SELECT rows FROM availability WHERE freq = ? AND r = ? AND ps = ?',
+                                (freq, r, ps)).fetchone()
+        if row is not None:
+            return row[0] * AVAILABILITY_SHARE
+        return DEFAULT_ROWS
+
+    def plan(self, reporters, partners, periods, freq='M', cc='AG6', exclude=()):
+        """Return payloads covering every cell, packed under the row cap.
+
+        Parameters
+        ----------
+        reporters, partners, periods : list of str
+            Codes to cover. Queries are packed along partners, or along
+            reporters when there is a single partner.
+        exclude : set of (reporter, partner, period), optional
+            Cells already downloaded.
+
+        Returns
+        -------
+        jobs : list of dict
+        """
+
+        exclude = set(exclude)
+        by_reporter = len(partners) == 1 and len(reporters) > 1
+        if by_reporter:
+            outer, inner = partners, reporters
+            cell = lambda o, i, ps: (i, o, ps)
+        else:
+            outer, inner = reporters, partners
+            cell = lambda o, i, ps: (o, i, ps)
+
+        jobs = []
+        for o in outer:
+            # Group each inner code's outstanding periods into runs of at most
+            # five whose estimated rows fit the budget
+            groups = {}
+            for i in inner:
+                run, run_rows = [], 0
+                for ps in periods:
+                    c = cell(o, i, ps)
+                    if c in exclude:
+                        continue
+                    rows = self.estimate(*c, freq=freq, cc=cc)
+                    if run and (len(run) == MAX_CODES or run_rows + rows > self.budget):
+                        groups.setdefault(tuple(run), []).append((run_rows, i))
+                        run, run_rows = [], 0
+                    run.append(ps)
+                    run_rows += rows
+                if run:
+                    groups.setdefault(tuple(run), []).append((run_rows, i))
+
+            # First-fit decreasing: inner codes sharing a period group are packed
+            # into queries of at most five codes within the budget
+            for run, items in groups.items():
+                bins = []
+                for rows, i in sorted(items, reverse=True):
+                    for b in bins:
+                        if len(b[1]) < MAX_CODES and b[0] + rows <= self.budget:
+                            b[0] += rows
+                            b[1].append(i)
+                            break
+                    else:
+                        bins.append([rows, [i]])
+                for rows, codes in bins:
+                    r, p = (codes, o) if by_reporter else (o, codes)
+                    jobs.append(make_job(r, p, run, freq, cc))
+        return jobs
+
+    def split(self, job):
+        """Split a query whose response reached the cap into two.
+
+        Partners are halved first, then reporters, then periods. Returns an
+        empty list if the query covers a single cell.
+        """
+
+        for dim in ['p', 'r', 'ps']:
+            codes = job[dim].split(',')
+            if len(codes) > 1:
+                half = len(codes) // 2
+                first, second = dict(job), dict(job)
+                first[dim], second[dim] = ','.join(codes[:half]), ','.join(codes[half:])
+                return [first, second]
+        return []
+
+
+def make_job(r, p, ps, freq='M', cc='AG6'):
+    """Return payload for an import (rg=1) query."""
+    join = lambda x: x if isinstance(x, str) else ','.join(x)
+    return {'max': CAP,
+            'type': 'C',
+            'freq': freq,
+            'px': 'HS',
+            'ps': join(ps),
+            'r': join(r),
+            'p': join(p),
+            'rg': '1',
+            'cc': cc,
+            'fmt': 'csv'
+    }
+
+
+def cells(job):
+    """Return the (reporter, partner, period) cells requested by ``job``."""
+    return [(r, p, ps) for r in job['r'].split(',') for p in job['p'].split(',')
+            for ps in job['ps'].split(',')]
+
+
+def n_rows(text):
+    """Number of data rows in a csv response."""
+    return max(len([row for row in text.split('\r\n') if row]) - 1, 0)
@@ -0,0 +1,150 @@
+"""
+Incremental sync of Comtrade bulk files.
+
+The availability listing (``comtrade.check_availability``) gives the
+publication date of every reporter-period dataset. It is compared against a
+local catalog of what has been ingested, and only datasets that are new or
+have been republished since are downloaded, one reporter at a time, into the
+partitioned Parquet dataset of ``bulk.py``. Every change is logged.
+
+Files are tagged by reporter code, so a dataset kept up to date by sync should
+not also receive 'ALL' files from ``comtrade.download_monthly``.
+
+Nightly refresh of the current and previous year:
+
+    python sync.py
+"""
+
+import argparse
+import datetime
+import sqlite3
+from time import strftime
+import bulk
+import comtrade
+
+
+class Catalog:
+    """SQLite catalog of ingested bulk datasets.
+
+    Parameters
+    ----------
+    path : str, default 'bulk_catalog.sqlite'
+    """
+
+    def __init__(self, path='bulk_catalog.sqlite'):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS datasets (
+                freq TEXT, r TEXT, ps TEXT,
+                published TEXT, records INTEGER, rows INTEGER, ingested TEXT,
+                PRIMARY KEY (freq, r, ps)
+            )""")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS changes (
+                synced TEXT, freq TEXT, r TEXT, ps TEXT, change TEXT,
+                published_old TEXT, published_new TEXT, rows INTEGER
+            )""")
+        self.conn.commit()
+
+    def published(self, freq, r, ps):
+        """Publication date of the ingested dataset, or None if never ingested."""
+        row = self.conn.execute('SELECT published FROM datasets WHERE freq = ? AND r = ? AND ps = ?',
+                                (freq, r, ps)).fetchone()
+        return row[0] if row else None
+
+    def record(self, freq, r, ps, published, records, rows, change, published_old=None):
+        """Store a completed ingest and log the change."""
+        now = strftime('%Y-%m-%d %H:%M:%S')
+        self.conn.execute('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?)',
+                          (freq, r, ps, published, records, rows, now))
+        self.conn.execute('INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (now, freq, r, ps, change, published_old, published, rows))
+        self.conn.commit()
+
+    def changes(self, since=None):
+        """Return the change log as a list of tuples, optionally only entries since ``since``."""
+        query = 'SELECT * FROM changes'
+        params = ()
+        if since is not None:
+            query += ' WHERE synced >= ?'
+            params = (since,)
+        return self.conn.execute(query + ' ORDER BY synced', params).fetchall()
+
+
+def outdated(listing, catalog):
+    """
+    Return (record, change) pairs for datasets in ``listing`` that are new
+    or republished since they were ingested.
+    """
+
+    result = []
+    for d in listing:
+        freq, r, ps = d['freq'][0], str(d['r']), str(d['ps'])
+        old = catalog.published(freq, r, ps)
+        if old is None:
+            result.append((d, 'new'))
+        elif d['publicationDate'] > old:
+            result.append((d, 'revised'))
+    return result
+
+
+def sync(periods, freq='M', catalog=None, dest=bulk.PARQUET_DEST, dry_run=False):
+    """
+    Download only new or revised bulk datasets.
+
+    Parameters
+    ----------
+    periods : list
+        YYYY for annual data ('A') or YYYYMM for monthly data ('M').
+    freq : {'A', 'M'}, default 'M'.
+    catalog : Catalog, optional
+        Catalog to compare against. Defaults to 'bulk_catalog.sqlite'.
+    dry_run : bool, default False
+        If True, only report what would be downloaded.
+
+    Returns
+    -------
+    changed : list of (reporter, period, change) tuples
+    """
+
+    if catalog is None:
+        catalog = Catalog()
+    changed = []
+    for period in periods:
+        listing = comtrade.check_availability(period, freq)
+        comtrade.get_planner().load_availability(listing)
+        todo = outdated(listing, catalog)
+        print('{}: {} datasets available, {} new or revised.'.format(period, len(listing), len(todo)))
+        for d, change in todo:
+            r, ps = str(d['r']), str(d['ps'])
+            changed.append((r, ps, change))
+            if dry_run:
+                print('  {} {} ({}), published {}'.format(change, d.get('rDesc', r), ps,
+                                                          d['publicationDate']))
+                continue
+            old = catalog.published(freq, r, ps)
+            rows = bulk.ingest_bulk(ps, freq=freq, reporter=r, dest=dest)
+            catalog.record(freq, r, ps, d['publicationDate'], d.get('TotalRecords'), rows, change,
+                           published_old=old)
+    return changed
+
+
+def recent_periods(years=2, freq='M'):
+    """Periods of the current and previous ``years - 1`` years, up to last month."""
+    today = datetime.date.today()
+    if freq == 'A':
+        return [str(today.year - i) for i in range(years)]
+    periods = []
+    for year in range(today.year - years + 1, today.year + 1):
+        last = today.month - 1 if year == today.year else 12
+        periods += [str(year) + str(m).zfill(2) for m in range(1, last + 1)]
+    return periods
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download new or revised Comtrade bulk files.')
+    parser.add_argument('periods', nargs='*', help='YYYY or YYYYMM (default: last two years)')
+    parser.add_argument('--freq', default='M', choices=['A', 'M'])
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    sync(args.periods or recent_periods(freq=args.freq), freq=args.freq, dry_run=args.dry_run)
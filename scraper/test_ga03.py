@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import ga03
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'samples', 'ga03_sample.html')
+
+
+@pytest.fixture
+def html():
+    with open(SAMPLE, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_matches_read_html(html):
+    new = ga03.extract_table(html, 5)
+    old = ga03.extract_read_html(html).reset_index(drop=True)
+    for col in ga03.COLNAMES:
+        if col in ga03.NUMERIC:
+            expected = pd.to_numeric(old[col].astype(str).str.replace(',', ''),
+                                     errors='coerce')
+            np.testing.assert_allclose(new[col].to_numpy(), expected.to_numpy(dtype=float))
+        else:
+            # read_html reads blank cells as NaN and strips the others
+            assert new[col].tolist() == old[col].fillna('').astype(str).str.strip().tolist()
+
+
+def test_keeps_rows_without_values(html):
+    df = ga03.extract_table(html, 5)
+    assert df['貨品分類'].tolist() == ['03021100001', '03021100002', '03021100001',
+                                   '84713000000']
+    assert df['價值'].isnull().tolist() == [False, True, False, False]
+    assert df['重量'].isnull().tolist() == [False, False, True, False]
+
+
+def test_raw(html):
+    df = ga03.extract_table(html, 5, raw=True)
+    assert df.iloc[0].tolist() == ['美國', '03021100001', '活鱒魚', 'Live trout', '1,234', 'KGM',
+                                   '2,468.5', 'KGM', '10,000']
+    assert df.iloc[1].tolist() == ['美國', '03021100002', '其他活鱒魚', 'Other live trout, "fresh"',
+                                   '-', '', '12', 'KGM', '-']
+    assert df.loc[2, '英文貨名'] == ' Live trout '
+
+
+def test_missing_table(html):
+    with pytest.raises(ga03.TableNotFound):
+        ga03.extract_table(html, 6)
+    with pytest.raises(ga03.TableNotFound):
+        ga03.extract_table('<html><body>系統忙碌中，請稍後再試</body></html>', 5)
+
+
+def test_empty_table():
+    html = '<table id="dataList_5"><tr><td>國家</td><td>貨品分類</td></tr></table>'
+    assert ga03.extract_table(html, 5).empty
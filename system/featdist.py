@@ -0,0 +1,180 @@
+"""
+Population mean and standard deviation of the supplier features, for ``normalize_features``.
+
+Inquiries are sharded across a pool of processes. Each worker keeps its own read-only copy of
+the catalogue and export records (inherited on fork, or sent once when the worker starts),
+computes features one batch of inquiries at a time and folds them into running statistics;
+partial statistics are merged as shards complete. Feature rows are never stacked, so memory
+does not grow with the number of inquiries.
+
+    python featdist.py inquiries.csv processed_ctlg.csv export_compressed.csv [--workers N]
+                       [--sample FRAC] [--output feature_distribution.csv]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import features as fs
+
+OUTPUT_PATH = 'feature_distribution.csv'
+_ctlg, _ex = None, None
+
+
+class RunningStats:
+    """Running count, mean and sum of squared deviations of each column (Welford), mergeable
+    across batches and processes (Chan et al.). Missing values are skipped, as in
+    ``DataFrame.mean`` and ``DataFrame.std``.
+
+    Parameters
+    ----------
+    columns : list
+        Feature names.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.n = np.zeros(len(self.columns))
+        self.mean = np.zeros(len(self.columns))
+        self.m2 = np.zeros(len(self.columns))
+
+    def merge(self, n, mean, m2):
+        """Fold in the count, mean and sum of squared deviations of another set of rows."""
+        total = self.n + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * n / total, 0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta ** 2 * self.n * n / total, 0)
+        self.n = total
+        return self
+
+    def update(self, X):
+        """Fold in the rows of DataFrame ``X``."""
+        values = X[self.columns].to_numpy(dtype=float)
+        n = np.count_nonzero(~np.isnan(values), axis=0).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, np.nansum(values, axis=0) / n, 0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+        return self.merge(n, mean, m2)
+
+    def combine(self, other):
+        """Fold in another ``RunningStats``."""
+        return self.merge(other.n, other.mean, other.m2)
+
+    def result(self):
+        """DataFrame of ``mean`` and sample ``std`` of each feature."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(self.n > 0, self.mean, np.nan)
+            std = np.where(self.n > 1, np.sqrt(self.m2 / (self.n - 1)), np.nan)
+        return pd.DataFrame({'mean': mean, 'std': std}, index=self.columns, columns=['mean', 'std'])
+
+
+def _init(ctlg, ex):
+    global _ctlg, _ex
+    _ctlg, _ex = ctlg, ex
+
+
+def shard_stats(inqs, batch_size=200):
+    """Running statistics of the features of the inquiries ``inqs``, computed ``batch_size``
+    inquiries at a time against the worker's catalogue and export records.
+    """
+
+    stats = RunningStats(fs.FEATURE_COLUMNS)
+    for start in range(0, len(inqs), batch_size):
+        stats.update(fs.compute_features_batch(_ctlg, _ex, inqs.iloc[start:start + batch_size]))
+    return stats, len(inqs)
+
+
+def estimate_feature_dist(ctlg, ex, inqs, workers=None, shard_size=1000, batch_size=200,
+                          sample=None, random_state=None, path=OUTPUT_PATH, verbose=True):
+    """Estimate and save population mean and standard deviation for each feature.
+
+    Parameters
+    ----------
+    ctlg : DataFrame
+        Processed catalogue indexed by ``ban``.
+    ex : DataFrame
+        Export records indexed by ``ban``.
+    inqs : DataFrame
+        Each row represents an inquiry.
+    workers : int, optional
+        Number of processes. Defaults to the number of CPUs; 1 runs in this process.
+    shard_size : int, default 1000
+        Inquiries sent to a worker at a time.
+    batch_size : int, default 200
+        Inquiries whose features are computed at a time within a shard.
+    sample : int or float, optional
+        Estimate from a random sample of this many inquiries (int) or this fraction of them
+        (float) instead of all of them.
+    random_state : int, optional
+        Seed of the sample.
+    path : str, default 'feature_distribution.csv'
+        Output file. Nothing is written if None.
+    verbose : bool, default True
+        Print progress as shards complete.
+
+    Returns
+    -------
+    dist : DataFrame
+        ``mean`` and ``std`` of each feature.
+    """
+
+    if sample is not None:
+        key = 'frac' if isinstance(sample, float) else 'n'
+        inqs = inqs.sample(random_state=random_state, **{key: sample})
+    workers = workers or os.cpu_count() or 1
+    shards = [inqs.iloc[start:start + shard_size] for start in range(0, len(inqs), shard_size)]
+    stats = RunningStats(fs.FEATURE_COLUMNS)
+    done = 0
+
+    def report(n):
+        nonlocal done
+        done += n
+        if verbose:
+            print('{} of {} inquiries done.'.format(done, len(inqs)))
+
+    if workers == 1 or len(shards) <= 1:
+        _init(ctlg, ex)
+        for shard in shards:
+            partial, n = shard_stats(shard, batch_size)
+            stats.combine(partial)
+            report(n)
+    else:
+        # Forked workers inherit ``ctlg`` and ``ex`` instead of unpickling a copy each
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init,
+                                 initargs=(ctlg, ex)) as pool:
+            futures = [pool.submit(shard_stats, shard, batch_size) for shard in shards]
+            for future in as_completed(futures):
+                partial, n = future.result()
+                stats.combine(partial)
+                report(n)
+
+    dist = stats.result()
+    if path is not None:
+        dist.to_csv(path)
+    return dist
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate the feature distribution of inquiries.')
+    parser.add_argument('inquiries')
+    parser.add_argument('catalogue')
+    parser.add_argument('export')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--sample', type=float, help='fraction of inquiries to sample')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    args = parser.parse_args()
+    inqs = pd.read_csv(args.inquiries, parse_dates=True, index_col='creation_date', encoding='utf-8',
+                       dtype={'code_val': str, 'dept': 'category'})
+    ctlg = pd.read_csv(args.catalogue, index_col='ban', parse_dates=['mod_date'],
+                       dtype={'ban': str, 'code_val': str})
+    ex = pd.read_csv(args.export, index_col='ban', dtype={'ban': str})
+    dist = estimate_feature_dist(ctlg, ex, inqs, workers=args.workers, sample=args.sample,
+                                 random_state=args.seed, path=args.output)
+    dist.to_csv(sys.stdout)
@@ -0,0 +1,302 @@
+import weakref
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import fetcher as ft
+from textnorm import process_string
+
+# (supplier column, catalogue column, suffix) of each text compared with inquiries
+TEXT_COLUMNS = [('item_name', 'prod_name', 'i'),
+                ('item_desc', 'prod_desc', 'd'),
+                ('keyword', 'keyword', 'k'),
+                ('comm_name', 'prod_name', 'h')]
+# (inquiry column, suffix) of each inquiry text
+QUERY_COLUMNS = [('prod_name', 'p'), ('prod_desc', 'd')]
+FEATURE_COLUMNS = ['n_items',
+                   'comp_ip', 'max_comp_ip', 'min_comp_ip',  # item vs prod
+                   'comp_id', 'max_comp_id', 'min_comp_id',  # item vs desc
+                   'comp_dp', 'max_comp_dp', 'min_comp_dp',  # desc vs prod
+                   'comp_dd', 'max_comp_dd', 'min_comp_dd',  # desc vs desc
+                   'comp_kp', 'max_comp_kp', 'min_comp_kp',  # keyword vs prod
+                   'comp_kd', 'max_comp_kd', 'min_comp_kd',  # keyword vs desc
+                   'recency', 'n_comms',
+                   'comp_hp', 'max_comp_hp', 'min_comp_hp',  # hs vs prod
+                   'comp_hd', 'max_comp_hd', 'min_comp_hd',  # hs vs desc
+                   'isexporter']
+_engines = {}
+
+
+def n_common_terms(string, term_list):
+    return len(set(string.split(' ')) & set(term_list))
+
+
+def compatibility(s, term_list, func='mean'):
+    """Reduce the number of terms shared with ``term_list`` over the ``|``-joined items of each
+    string of ``s``. Reference implementation of the features computed by ``FeatureEngine``.
+    """
+
+    func={'mean': pd.Series.mean,
+          'max': pd.Series.max,
+          'min': pd.Series.min}[func]
+    comp = (s.str.split('|')
+            .apply(lambda ls:
+                   pd.Series(map(lambda x: n_common_terms(x, term_list), ls))))
+    comp = func(comp, axis=1)
+    return comp
+
+
+def term_matrix(texts, vocabulary):
+    """Binary item x term matrix of space-separated ``texts``, adding new terms to ``vocabulary``.
+
+    Missing texts give empty rows. Returns the matrix (with as many columns as ``vocabulary``
+    has terms so far) and the boolean mask of non-missing texts.
+    """
+
+    codes, uniques = pd.factorize(pd.Series(texts, dtype=object))
+    indptr, indices = [0], []
+    for s in uniques:
+        indices += sorted({vocabulary.setdefault(t, len(vocabulary)) for t in str(s).split(' ')})
+        indptr.append(len(indices))
+    # Missing texts point to an extra empty row
+    indptr.append(len(indices))
+    unique_matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                                      shape=(len(uniques) + 1, len(vocabulary)))
+    codes = np.where(codes < 0, len(uniques), codes)
+    return unique_matrix[codes], codes < len(uniques)
+
+
+def segment_reduce(values, groups, n_groups, fill):
+    """Mean, max and min of ``values`` per group id in ``groups`` (0 to ``n_groups`` - 1).
+
+    Empty groups get ``fill`` (an array of one value per group).
+    """
+
+    order = np.argsort(groups, kind='mergesort')
+    values, groups = values[order].astype(float), groups[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    present = counts > 0
+    starts = (np.cumsum(counts) - counts)[present]
+    mean, max_, min_ = (np.array(fill, dtype=float) for _ in range(3))
+    mean[present] = np.bincount(groups, weights=values, minlength=n_groups)[present] / counts[present]
+    if len(values):
+        max_[present] = np.maximum.reduceat(values, starts)
+        min_[present] = np.minimum.reduceat(values, starts)
+    return mean, max_, min_
+
+
+class FeatureEngine:
+    """Compatibility features of many inquiries, computed on sparse term matrices.
+
+    Catalogue item names, descriptions and keywords, and the HS descriptions of exported
+    commodities, are held as binary item x term matrices over one vocabulary. Inquiry term lists
+    are sparse rows over the same vocabulary. The number of terms an item shares with an inquiry
+    is then an element-wise product of sparse rows, and ``comp_*``, ``max_comp_*`` and
+    ``min_comp_*`` are its mean, max and min over the items of each supplier. All inquiries of a
+    batch are scored at once.
+
+    Features are the same as those of ``compatibility`` over the ``|``-joined strings of
+    ``fetcher.fetch_suppliers`` and ``fetcher.fetch_export``: missing items are skipped, and a
+    supplier without items counts as a single empty item.
+
+    Parameters
+    ----------
+    ctlg : DataFrame
+        Processed catalogue indexed by ``ban``.
+    ex : DataFrame
+        Export records indexed by ``ban``.
+    """
+
+    def __init__(self, ctlg, ex):
+        # Weak, so that the cache entry of ``ctlg`` (see ``fetcher.per_frame``) does not keep
+        # either frame alive
+        self._ctlg, self._ex = weakref.ref(ctlg), weakref.ref(ex)
+        self.n_rows = len(ctlg)
+        self.n_export = len(ex)
+        self.vocabulary = {}
+        self.matrices, self.valid = {}, {}
+        for name, col, _ in TEXT_COLUMNS[:3]:
+            self.matrices[name], self.valid[name] = term_matrix(ctlg[col].values, self.vocabulary)
+
+        # First record of each commodity of each supplier, sorted by ban, as in ``ExportSummary``
+        records = ex.reset_index().drop_duplicates(['ban', 'code_val'])
+        records = records.iloc[np.argsort(records['ban'].values, kind='mergesort')]
+        self.export_bans = pd.Index(records['ban'].unique())
+        self.export_starts = records['ban'].searchsorted(self.export_bans, 'left')
+        self.export_ends = records['ban'].searchsorted(self.export_bans, 'right')
+        self.matrices['comm_name'], self.valid['comm_name'] = term_matrix(records['prod_name'].values,
+                                                                          self.vocabulary)
+        for m in self.matrices.values():
+            m.resize((m.shape[0], len(self.vocabulary)))
+
+    @property
+    def ctlg(self):
+        return self._ctlg()
+
+    @property
+    def ex(self):
+        return self._ex()
+
+    def query_matrix(self, term_lists):
+        """Binary inquiry x term matrix of ``term_lists``. Terms outside the vocabulary are
+        dropped, since no item has them.
+        """
+
+        indptr, indices = [0], []
+        for terms in term_lists:
+            indices += sorted({self.vocabulary[t] for t in terms if t in self.vocabulary})
+            indptr.append(len(indices))
+        return sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                                 shape=(len(term_lists), len(self.vocabulary)))
+
+    def score(self, name, positions, queries, query_rows, groups, n_groups, fill):
+        """Mean, max and min number of common terms of the ``name`` items at ``positions`` with
+        the inquiry rows ``query_rows`` of ``queries``, per group id in ``groups``.
+        """
+
+        valid = self.valid[name][positions]
+        positions, query_rows, groups = positions[valid], query_rows[valid], groups[valid]
+        common = self.matrices[name][positions].multiply(queries[query_rows]).sum(axis=1)
+        return segment_reduce(np.asarray(common).ravel(), groups, n_groups, fill)
+
+    def export_positions(self, bans):
+        """Positions of the export items of each of ``bans``, and the position in ``bans`` of
+        each of them.
+        """
+
+        idx = self.export_bans.get_indexer(bans)
+        found = idx >= 0
+        starts = np.where(found, self.export_starts[idx], 0)
+        lengths = np.where(found, self.export_ends[idx] - self.export_starts[idx], 0)
+        offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + np.arange(lengths.sum()) - offsets
+        return positions, np.repeat(np.arange(len(bans)), lengths)
+
+    def compute(self, inqs, candidates=None):
+        """Return features of the suppliers of each inquiry of ``inqs``.
+
+        Parameters
+        ----------
+        inqs : DataFrame
+            Buyer inquiries, with columns ``code_val``, ``prod_name``, ``prod_desc`` and
+            ``buyer_country``.
+        candidates : list of list-like, optional
+            BANs to keep among the suppliers of each inquiry, e.g. from
+            ``retrieval.candidates``. All suppliers if None.
+
+        Returns
+        -------
+        features : DataFrame
+            Indexed by (``inquiry``, ``ban``), where ``inquiry`` is the position of the inquiry
+            in ``inqs``. Columns as in ``compute_features``.
+        """
+
+        queries, empty = {}, {}
+        for col, suffix in QUERY_COLUMNS:
+            term_lists = [s.split(' ') for s in process_string(inqs[col].reset_index(drop=True))]
+            queries[suffix] = self.query_matrix(term_lists)
+            # A supplier without items counts as one empty item, sharing the empty term only
+            empty[suffix] = np.array([float('' in terms) for terms in term_lists])
+
+        index = ft.code_index(self.ctlg)
+        ban_values = self.ctlg.index.values
+        supps, positions, query_rows, groups = [], [], [], []
+        offset = 0
+        for i, code in enumerate(inqs['code_val'].values):
+            supp = ft.fetch_suppliers(self.ctlg, code)
+            if candidates is not None:
+                supp = supp[supp.index.isin(candidates[i])]
+            pos = index.positions_of(code)
+            local = supp.index.get_indexer(ban_values[pos])
+            pos, local = pos[local >= 0], local[local >= 0]
+            supps.append(supp)
+            positions.append(pos)
+            query_rows.append(np.full(len(pos), i))
+            groups.append(offset + local)
+            offset += len(supp)
+        supp = pd.concat(supps, keys=range(len(supps)), names=['inquiry', 'ban'])
+        pair_rows = np.repeat(np.arange(len(supps)), [len(s) for s in supps])
+        positions = np.concatenate(positions or [np.array([], dtype=int)])
+        query_rows = np.concatenate(query_rows or [np.array([], dtype=int)])
+        groups = np.concatenate(groups or [np.array([], dtype=int)])
+
+        export = ft.fetch_export_batch(self.ex, [(s.index, ctry) for s, ctry
+                                                 in zip(supps, inqs['buyer_country'].values)])
+        ex_positions, ex_groups = self.export_positions(export.index.get_level_values('ban'))
+
+        features = {'n_items': supp['n_items'].values, 'recency': supp['recency'].values,
+                    'n_comms': export['n_comms'].values, 'isexporter': export['isexporter'].values}
+        for name, _, text in TEXT_COLUMNS:
+            if name == 'comm_name':
+                pos, rows, grp = ex_positions, pair_rows[ex_groups], ex_groups
+            else:
+                pos, rows, grp = positions, query_rows, groups
+            for suffix, q in queries.items():
+                fill = empty[suffix][pair_rows]
+                (features['comp_' + text + suffix], features['max_comp_' + text + suffix],
+                 features['min_comp_' + text + suffix]) = self.score(name, pos, q, rows, grp,
+                                                                      len(supp), fill)
+        return pd.DataFrame(features, index=supp.index, columns=FEATURE_COLUMNS)
+
+
+def feature_engine(ctlg, ex):
+    """Return the ``FeatureEngine`` of ``ctlg`` and ``ex``, built on first use and kept while
+    ``ctlg`` is alive. Rebuilt for another ``ex`` or if the number of rows of either changed.
+    """
+
+    engine = ft.per_frame(_engines, ctlg, lambda c: FeatureEngine(c, ex))
+    if engine.ex is not ex or engine.n_export != len(ex):
+        engine = _engines[id(ctlg)] = FeatureEngine(ctlg, ex)
+    return engine
+
+
+def compute_features_batch(ctlg, ex, inqs, candidates=None):
+    """Return features of the suppliers of many inquiries, indexed by (``inquiry``, ``ban``).
+
+    See ``FeatureEngine.compute``.
+    """
+
+    return feature_engine(ctlg, ex).compute(inqs, candidates)
+
+
+def compute_features(ctlg, ex, inq, candidates=None):
+    """Return DataFrame of calculated features.
+
+    Parameters
+    ----------
+    ctlg : DataFrame
+        Processed catalogue indexed by ``ban``.
+
+    ex : DataFrame
+        Export records indexed by ``ban``.
+
+    inq : Series
+        A single buyer inquiry.
+
+    candidates : list-like, optional
+        BANs to keep among the suppliers, e.g. from ``retrieval.candidates``. All suppliers if
+        None.
+
+    Returns
+    -------
+    features : DataFrame
+        Currently there are 28 features:
+
+        1) ``n_items`` : number of items in the supplier's catalogue.
+
+        2) ``{type_}comp_{combination}`` : product compatibility. There are three types (total, max,
+           min) and eight possible combinations.
+
+        3) ``recency`` : date difference between last modified date and today.
+
+        4) ``n_comms`` : number of unique commodities exported by the supplier (with non-empty
+           description).
+
+        5) ``isexporter`` : whether the supplier has shipped to buyer's country in recent years.
+
+    See ``compute_features_batch`` to score many inquiries in one pass.
+    """
+
+    features = compute_features_batch(ctlg, ex, pd.DataFrame([inq]),
+                                      None if candidates is None else [candidates])
+    features.index = features.index.droplevel('inquiry')
+    return features
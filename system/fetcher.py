@@ -1,11 +1,188 @@
+import hashlib
+import os
+import weakref
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 import datetime
 
+AGG_DIR = os.path.join(os.path.expanduser('~'), '.trademodel', 'supplier_agg')
+AGG_LEVELS = (2, 4, 6)
+SUPPLIER_COLUMNS = ['n_items', 'item_name', 'item_desc', 'keyword', 'recency']
+_indexes = {}
+_aggregates = {}
+_summaries = {}
+
 
 def concat_str(g):
     return g.str.cat(sep='|')
 
 
+class CodeIndex:
+    """Sorted prefix index over the ``code_val`` column of a catalogue.
+
+    Codes are sorted once; the rows whose code starts with a given prefix are
+    then a contiguous range of the sorted codes, found with two binary
+    searches.
+
+    Parameters
+    ----------
+    ctlg : DataFrame
+        Catalogue with a ``code_val`` column of TAITRA codes (str).
+    """
+
+    def __init__(self, ctlg):
+        codes = ctlg['code_val']
+        valid = np.flatnonzero(codes.notnull().values)
+        values = codes.values[valid].astype(str)
+        order = np.argsort(values, kind='mergesort')
+        self.codes = values[order]
+        self.positions = valid[order]
+        self.n_rows = len(ctlg)
+
+    def positions_of(self, code):
+        """Row positions, in catalogue order, of codes starting with ``code``."""
+        if not code:
+            return np.sort(self.positions)
+        # Smallest string greater than every string starting with ``code``
+        upper = code[:-1] + chr(ord(code[-1]) + 1)
+        lo, hi = np.searchsorted(self.codes, [code, upper])
+        return np.sort(self.positions[lo:hi])
+
+    def rows(self, ctlg, code):
+        """Rows of ``ctlg`` whose code starts with ``code``."""
+        return ctlg.iloc[self.positions_of(code)]
+
+
+def per_frame(cache, df, factory):
+    """Return ``cache``'s object for ``df``, made by ``factory(df)`` on first use and kept while
+    ``df`` is alive. Made again if the number of rows of ``df`` changed.
+    """
+
+    key = id(df)
+    obj = cache.get(key)
+    if obj is None or obj.n_rows != len(df):
+        obj = factory(df)
+        if key not in cache:
+            weakref.finalize(df, cache.pop, key, None)
+        cache[key] = obj
+    return obj
+
+
+def code_index(ctlg):
+    """Return the ``CodeIndex`` of ``ctlg``, built on first use and kept while ``ctlg`` is alive.
+
+    The index is rebuilt if the number of rows changed. Call ``CodeIndex(ctlg)`` directly after
+    modifying codes in place.
+    """
+
+    return per_frame(_indexes, ctlg, CodeIndex)
+
+
+class SupplierAggregates:
+    """Per-(code prefix, ban) aggregates of a catalogue, for ``fetch_suppliers`` lookups.
+
+    For each code level (2, 4 and 6 digits) the catalogue is grouped once by code prefix and ban
+    into ``n_items``, the joined ``item_name``, ``item_desc`` and ``keyword``, and ``last_mod``
+    (latest modification date). Tables are stored on disk under the catalogue version, a hash of
+    its contents, so a new catalogue gets new tables and an unchanged one is never regrouped.
+    Lookups by code are kept in an LRU cache.
+
+    Parameters
+    ----------
+    ctlg : DataFrame
+        Catalogue indexed by ``ban``.
+    cache_dir : str, optional
+        Directory of the stored tables. Nothing is written if None.
+    maxsize : int, default 4096
+        Number of codes whose lookups are kept in memory.
+    """
+
+    def __init__(self, ctlg, cache_dir=AGG_DIR, maxsize=4096):
+        # Weak, so that the cache entry of ``ctlg`` (see ``per_frame``) does not keep it alive
+        self._ctlg = weakref.ref(ctlg)
+        self.cache_dir = cache_dir
+        self.maxsize = maxsize
+        self.n_rows = len(ctlg)
+        columns = ['code_val', 'prod_name', 'prod_desc', 'keyword', 'mod_date']
+        # Row hashes in order: the tables are built from, and line up with, the rows as ordered
+        row_hashes = pd.util.hash_pandas_object(ctlg[columns].reset_index(), index=False)
+        self.version = hashlib.sha1(row_hashes.values.tobytes()).hexdigest()
+        self.tables = {}
+        self.lookups = OrderedDict()
+
+    @property
+    def ctlg(self):
+        return self._ctlg()
+
+    def build(self, level):
+        """Group the catalogue by ``level``-digit code prefix and ban."""
+        codes = self.ctlg['code_val']
+        items = self.ctlg[codes.str.len() >= level]
+        grouped = items.groupby([items['code_val'].str[:level].rename('prefix'), items.index])
+        table = pd.DataFrame({'n_items': grouped['prod_name'].count(),
+                              'item_name': grouped['prod_name'].agg(concat_str),
+                              'item_desc': grouped['prod_desc'].agg(concat_str),
+                              'keyword': grouped['keyword'].agg(concat_str),
+                              'last_mod': grouped['mod_date'].max()},
+                             columns=['n_items', 'item_name', 'item_desc', 'keyword', 'last_mod'])
+        table.index.names = ['prefix', 'ban']
+        return table.sort_index()
+
+    def table(self, level):
+        """Aggregate table of ``level``, loaded from disk or built on first use."""
+        if level not in self.tables:
+            path = None
+            if self.cache_dir is not None:
+                path = os.path.join(self.cache_dir, '{}_{}.pkl'.format(self.version, level))
+            if path is not None and os.path.isfile(path):
+                table = pd.read_pickle(path)
+            else:
+                table = self.build(level)
+                if path is not None:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    table.to_pickle(path + '.tmp')
+                    os.replace(path + '.tmp', path)
+            self.tables[level] = table
+        return self.tables[level]
+
+    def lookup(self, code):
+        """Aggregates of the suppliers of ``code``, indexed by ``ban``, without recency."""
+        if code in self.lookups:
+            self.lookups.move_to_end(code)
+            return self.lookups[code]
+        if len(code) in AGG_LEVELS:
+            table = self.table(len(code))
+            prefixes = table.index.get_level_values('prefix')
+            lo, hi = prefixes.searchsorted(code, 'left'), prefixes.searchsorted(code, 'right')
+            result = table.iloc[lo:hi].reset_index(level='prefix', drop=True)
+        else:
+            result = self.build_for(code)
+        self.lookups[code] = result
+        if len(self.lookups) > self.maxsize:
+            self.lookups.popitem(last=False)
+        return result
+
+    def build_for(self, code):
+        """Aggregates of the suppliers of a code of any length, computed from the catalogue."""
+        items = code_index(self.ctlg).rows(self.ctlg, code)
+        grouped = items.groupby(level='ban')
+        return pd.DataFrame({'n_items': grouped['prod_name'].count(),
+                             'item_name': grouped['prod_name'].agg(concat_str),
+                             'item_desc': grouped['prod_desc'].agg(concat_str),
+                             'keyword': grouped['keyword'].agg(concat_str),
+                             'last_mod': grouped['mod_date'].max()},
+                            columns=['n_items', 'item_name', 'item_desc', 'keyword', 'last_mod'])
+
+
+def supplier_aggregates(ctlg):
+    """Return the ``SupplierAggregates`` of ``ctlg``, created on first use and kept while ``ctlg``
+    is alive. Recreated if the number of rows changed.
+    """
+
+    return per_frame(_aggregates, ctlg, SupplierAggregates)
+
+
 def fetch_suppliers(ctlg, code):
     """Return suppliers from TT selling product labeled with TAITRA code starting with ``code``,    
     indexed by ``ban``.
@@ -13,7 +190,8 @@ def fetch_suppliers(ctlg, code):
     Parameters
     ----------
     code : str
-        TAITRA code of length 2, 4, or 6.
+        TAITRA code of length 2, 4, or 6. Suppliers are looked up in the precomputed aggregates
+        of ``ctlg`` (see ``SupplierAggregates``); only recency is computed per call.
         
     Returns
     -------
@@ -21,18 +199,89 @@ def fetch_suppliers(ctlg, code):
         Columns: ``n_items``, ``item_name``, ``item_desc``, ``keyword``, and ``recency``.
     """
     
-    suppliers = ctlg[ctlg['code_val'].str.contains('^' + code, na=False)]
-    suppliers = (suppliers.groupby(level='ban')
-                 .agg({'prod_name': ['count', lambda g: concat_str(g)],
-                       'prod_desc': lambda g: concat_str(g),
-                       'keyword': lambda g: concat_str(g),
-                       'mod_date': lambda g: datetime.datetime.now() - g.max()
-                       }))
-    suppliers['mod_date'] = suppliers['mod_date'].astype('timedelta64[D]')
-    suppliers = suppliers.swaplevel(axis=1)
-    suppliers.columns = suppliers.columns.droplevel()
-    suppliers.columns = ['n_items', 'item_name', 'item_desc', 'keyword', 'recency']
-    return suppliers
+    suppliers = supplier_aggregates(ctlg).lookup(code)
+    recency = (datetime.datetime.now() - suppliers['last_mod']).dt.days
+    suppliers = suppliers.drop('last_mod', axis=1).assign(recency=recency)
+    return suppliers[SUPPLIER_COLUMNS]
+
+
+class ExportSummary:
+    """Per-supplier export summaries, for ``fetch_export`` and ``fetch_export_batch``.
+
+    Parameters
+    ----------
+    ex : DataFrame
+        Export records indexed by ``ban``, with columns ``code_val``, ``prod_name`` and
+        ``country``.
+
+    Attributes
+    ----------
+    per_ban : DataFrame
+        ``n_comms`` and ``comm_name`` of every supplier, indexed by ``ban``.
+    pairs : MultiIndex
+        Distinct (ban, country) pairs shipped to.
+    """
+
+    def __init__(self, ex):
+        self.n_rows = len(ex)
+        records = ex.reset_index()
+        named = records[records['prod_name'].notnull()]
+        # First record of each commodity, as in drop_duplicates('code_val') per supplier
+        firsts = records.drop_duplicates(['ban', 'code_val'])
+        self.per_ban = pd.DataFrame({'n_comms': named.groupby('ban')['code_val'].nunique(),
+                                     'comm_name': firsts.groupby('ban')['prod_name'].agg(concat_str)},
+                                    columns=['n_comms', 'comm_name'])
+        self.per_ban['n_comms'] = self.per_ban['n_comms'].fillna(0).astype(int)
+        self.pairs = pd.MultiIndex.from_frame(records[['ban', 'country']].drop_duplicates())
+
+
+def export_summary(ex):
+    """Return the ``ExportSummary`` of ``ex``, created on first use and kept while ``ex`` is alive.
+    Recreated if the number of rows changed.
+    """
+
+    return per_frame(_summaries, ex, ExportSummary)
+
+
+def fetch_export_batch(ex, inquiries):
+    """Return export records of the suppliers of many inquiries at once.
+
+    Parameters
+    ----------
+    inquiries : list of (bans, ctry) pairs, or dict of inquiry id to (bans, ctry)
+        BAN of target suppliers and buyer's country of each inquiry. Repeated BANs of an
+        inquiry count once.
+
+    Returns
+    -------
+    export : DataFrame
+        Indexed by (``inquiry``, ``ban``), where ``inquiry`` is the position (or id) of the
+        inquiry, with one row per distinct BAN in the order given. Columns as in
+        ``fetch_export``. Suppliers without export records have ``n_comms`` 0, an empty
+        ``comm_name`` and ``isexporter`` False.
+    """
+
+    summary = export_summary(ex)
+    if hasattr(inquiries, 'keys'):
+        keys, inquiries = list(inquiries.keys()), list(inquiries.values())
+    else:
+        inquiries = list(inquiries)
+        keys = list(range(len(inquiries)))
+    inquiries = [(pd.unique(np.asarray(bans, dtype=object)), ctry) for bans, ctry in inquiries]
+    # One row per (inquiry, supplier) pair, stacked
+    lengths = [len(bans) for bans, _ in inquiries]
+    bans = np.concatenate([np.asarray(bans, dtype=object) for bans, _ in inquiries]
+                          or [np.array([], dtype=object)])
+    ctrys = np.repeat(np.array([ctry for _, ctry in inquiries], dtype=object), lengths)
+    index = pd.MultiIndex.from_arrays([np.repeat(np.array(keys, dtype=object), lengths), bans],
+                                      names=['inquiry', 'ban'])
+
+    export = summary.per_ban.reindex(bans)
+    export = pd.DataFrame({'n_comms': export['n_comms'].fillna(0).astype(int).values,
+                           'comm_name': export['comm_name'].fillna('').values,
+                           'isexporter': pd.MultiIndex.from_arrays([bans, ctrys]).isin(summary.pairs)},
+                          index=index, columns=['n_comms', 'comm_name', 'isexporter'])
+    return export
 
 
 def fetch_export(ex, bans, ctry):
@@ -49,20 +298,18 @@ def fetch_export(ex, bans, ctry):
     Returns
     -------
     export : DataFrame
-        Columns:
+        One row per distinct BAN, sorted by BAN. Columns:
         - ``n_comms`` : number of unique commodities exported by the supplier (with non-empty description).
         - ``comm_name`` : HS descriptions for each commodity.
         - ``isexporter`` : whether the supplier has shipped to buyer's country in recent years.
+
+        Suppliers without export records are included with ``n_comms`` 0, an empty
+        ``comm_name`` and ``isexporter`` False, rather than raising ``KeyError``, so that every
+        supplier of an inquiry gets features.
+
+    See ``fetch_export_batch`` to look up many inquiries in one pass.
     """
     
-    export = ex.loc[bans]
-    export = (export.groupby(level='ban')
-              .apply(lambda g: pd.DataFrame(
-                  dict(n_comms=[g.loc[g['prod_name'].notnull(), 'code_val'].nunique()],
-                       comm_name=[concat_str(g.drop_duplicates('code_val')['prod_name'])],
-                       isexporter=[(g['country'] == ctry).any()])
-                  )))
-    export = export.swaplevel()
-    export.index = export.index.droplevel()
-    export = export[['n_comms', 'comm_name', 'isexporter']]
-    return export
\ No newline at end of file
+    export = fetch_export_batch(ex, [(bans, ctry)])
+    export.index = export.index.droplevel('inquiry')
+    return export.sort_index()
\ No newline at end of file
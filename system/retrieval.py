@@ -0,0 +1,263 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import fetcher as ft
+from textnorm import process_string
+
+INDEX_PATH = os.path.join(os.path.expanduser('~'), '.trademodel', 'retrieval.pkl')
+CATALOGUE_COLUMNS = ['prod_name', 'prod_desc', 'keyword']
+SOURCES = ('catalogue', 'export')
+
+
+def term_counts(texts):
+    """Dict of ban to dict of term frequencies of the space-separated ``texts``, indexed by ban."""
+    terms = texts.dropna().astype(str).str.split(' ').explode()
+    terms = terms[terms.notnull() & (terms != '')]
+    counts = terms.groupby([terms.index, terms.values]).size()
+    docs = {}
+    for (ban, term), n in zip(counts.index, counts.values):
+        docs.setdefault(ban, {})[term] = int(n)
+    return docs
+
+
+class InvertedIndex:
+    """Inverted index from normalized terms to the suppliers (BANs) using them.
+
+    Each supplier is one document made of the terms of its catalogue items (names, descriptions
+    and keywords) and of the HS descriptions of its exported commodities. Postings map each term
+    to the term frequency in every supplier using it.
+
+    The index is built incrementally: ``add_catalogue`` and ``add_export`` replace the terms of
+    the suppliers of a new extract and leave the others as they are. Only postings of the
+    affected terms change.
+
+    Parameters
+    ----------
+    k1 : float, default 1.2
+        BM25 term frequency saturation.
+    b : float, default 0.75
+        BM25 document length normalization.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.bans = []
+        self.doc_ids = {}
+        self.docs = {source: {} for source in SOURCES}
+        self.postings = {}
+        self.lengths = []
+        self._arrays = {}
+        self._length_array = None
+
+    def __getstate__(self):
+        # Array caches are rebuilt on demand
+        state = self.__dict__.copy()
+        state['_arrays'], state['_length_array'] = {}, None
+        return state
+
+    def _doc(self, ban):
+        if ban not in self.doc_ids:
+            self.doc_ids[ban] = len(self.bans)
+            self.bans.append(ban)
+            self.lengths.append(0)
+        return self.doc_ids[ban]
+
+    def _set(self, source, ban, counts):
+        """Replace the ``source`` terms of ``ban`` with ``counts`` (term to frequency)."""
+        doc = self._doc(ban)
+        old = self.docs[source].pop(doc, {})
+        for term, n in old.items():
+            postings = self.postings[term]
+            postings[doc] -= n
+            if not postings[doc]:
+                del postings[doc]
+            if not postings:
+                del self.postings[term]
+            self._arrays.pop(term, None)
+        for term, n in counts.items():
+            postings = self.postings.setdefault(term, {})
+            postings[doc] = postings.get(doc, 0) + n
+            self._arrays.pop(term, None)
+        if counts:
+            self.docs[source][doc] = counts
+        self.lengths[doc] += sum(counts.values()) - sum(old.values())
+        self._length_array = None
+
+    def _update(self, source, docs, replace_all):
+        for ban, counts in docs.items():
+            self._set(source, ban, counts)
+        if replace_all:
+            for doc in list(self.docs[source]):
+                if self.bans[doc] not in docs:
+                    self._set(source, self.bans[doc], {})
+
+    def add_catalogue(self, ctlg, replace_all=False):
+        """Index the processed catalogue extract ``ctlg`` (indexed by ``ban``).
+
+        The catalogue terms of every supplier in ``ctlg`` are replaced. If ``replace_all``,
+        suppliers missing from ``ctlg`` lose their catalogue terms.
+        """
+
+        texts = pd.concat([ctlg[col] for col in CATALOGUE_COLUMNS])
+        self._update('catalogue', term_counts(texts), replace_all)
+
+    def add_export(self, ex, replace_all=False):
+        """Index the HS descriptions of the commodities exported in ``ex`` (indexed by ``ban``).
+
+        Descriptions are indexed as they are, since ``prod_name`` of the export records is
+        already normalized (it is compared with inquiry terms directly, as in
+        ``features.FeatureEngine``). As in ``fetcher.ExportSummary``, each commodity of a
+        supplier counts once.
+        """
+
+        records = ex.reset_index().drop_duplicates(['ban', 'code_val'])
+        texts = pd.Series(records['prod_name'].values, index=records['ban'].values)
+        self._update('export', term_counts(texts), replace_all)
+
+    def arrays(self, term):
+        """Document ids and term frequencies of the postings of ``term``."""
+        if term not in self._arrays:
+            postings = self.postings.get(term, {})
+            self._arrays[term] = (np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                                  np.fromiter(postings.values(), dtype=float, count=len(postings)))
+        return self._arrays[term]
+
+    def search(self, terms, k=10, bans=None, scoring='bm25'):
+        """Return the ``k`` suppliers scoring highest for ``terms``.
+
+        Parameters
+        ----------
+        terms : list-like
+            Normalized query terms. Repeated terms count once.
+        k : int, default 10
+        bans : list-like, optional
+            Only score these suppliers.
+        scoring : {'bm25', 'overlap'}, default 'bm25'
+            BM25, or the number of distinct query terms used by the supplier.
+
+        Returns
+        -------
+        scores : Series
+            Scores of at most ``k`` suppliers using at least one of ``terms``, indexed by
+            ``ban``, highest first.
+
+        Terms are scored one at a time, in decreasing order of their highest possible
+        contribution. Once the contributions left cannot lift an unscored supplier into the top
+        ``k``, the remaining terms only update suppliers already scored.
+        """
+
+        if scoring not in ('bm25', 'overlap'):
+            raise ValueError('Invalid scoring "{}"'.format(scoring))
+        if self._length_array is None:
+            self._length_array = np.array(self.lengths, dtype=float)
+        lengths = self._length_array
+        n_docs = np.count_nonzero(lengths)
+        terms = [t for t in set(terms) if t in self.postings]
+        if scoring == 'bm25':
+            avgdl = lengths.sum() / max(n_docs, 1)
+            df = np.array([len(self.postings[t]) for t in terms], dtype=float)
+            idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            bounds = idf * (self.k1 + 1)
+        else:
+            bounds = np.ones(len(terms))
+        order = np.argsort(-bounds, kind='mergesort')
+
+        allowed = None
+        if bans is not None:
+            allowed = np.zeros(len(self.bans), dtype=bool)
+            ids = [self.doc_ids[ban] for ban in bans if ban in self.doc_ids]
+            allowed[ids] = True
+        scores = np.zeros(len(self.bans))
+        seen = np.zeros(len(self.bans), dtype=bool)
+        remaining = bounds.sum()
+        pruned = False
+        for j in order:
+            remaining -= bounds[j]
+            ids, tfs = self.arrays(terms[j])
+            keep = seen[ids] if pruned else (allowed[ids] if allowed is not None else None)
+            if keep is not None:
+                ids, tfs = ids[keep], tfs[keep]
+            if scoring == 'bm25':
+                norm = self.k1 * (1 - self.b + self.b * lengths[ids] / avgdl)
+                scores[ids] += idf[j] * tfs * (self.k1 + 1) / (tfs + norm)
+            else:
+                scores[ids] += 1
+            seen[ids] = True
+            if not pruned and np.count_nonzero(seen) >= k > 0:
+                kth = np.partition(scores[seen], -k)[-k]
+                pruned = remaining < kth
+
+        ids = np.flatnonzero(seen)
+        if len(ids) > k:
+            ids = ids[np.argpartition(-scores[ids], k - 1)[:k]]
+        ids = ids[np.lexsort((ids, -scores[ids]))]
+        return pd.Series(scores[ids], index=pd.Index([self.bans[i] for i in ids], name='ban'))
+
+    def save(self, path=INDEX_PATH):
+        """Pickle the index to ``path``."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+
+def load_index(path=INDEX_PATH):
+    """Return the index pickled at ``path``, or a new empty one."""
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    return InvertedIndex()
+
+
+def update_index(ctlg=None, ex=None, path=INDEX_PATH, replace_all=False):
+    """Add a new catalogue and/or export extract to the index at ``path`` and save it.
+
+    Parameters
+    ----------
+    ctlg : DataFrame, optional
+        Processed catalogue extract indexed by ``ban``.
+    ex : DataFrame, optional
+        Export records indexed by ``ban``.
+    replace_all : bool, default False
+        If True, the extracts are complete: suppliers missing from them lose their terms.
+
+    Returns
+    -------
+    index : InvertedIndex
+    """
+
+    index = load_index(path)
+    if ctlg is not None:
+        index.add_catalogue(ctlg, replace_all)
+    if ex is not None:
+        index.add_export(ex, replace_all)
+    index.save(path)
+    return index
+
+
+def candidates(index, ctlg, inqs, k=100, scoring='bm25'):
+    """Return the ``k`` best candidate suppliers of each inquiry of ``inqs``.
+
+    Candidates are the suppliers of the inquiry's code (as in ``fetcher.fetch_suppliers``)
+    ranked by ``index.search`` on the terms of the inquiry's ``prod_name`` and ``prod_desc``. If
+    fewer than ``k`` of them use any of these terms, the others follow in BAN order.
+
+    Returns
+    -------
+    candidates : list of Index
+        BANs of each inquiry, best first. Pass to ``features.compute_features_batch``.
+    """
+
+    names = process_string(inqs['prod_name'].reset_index(drop=True))
+    descs = process_string(inqs['prod_desc'].reset_index(drop=True))
+    result = []
+    for code, name, desc in zip(inqs['code_val'].values, names, descs):
+        suppliers = ft.supplier_aggregates(ctlg).lookup(code).index
+        found = index.search(name.split(' ') + desc.split(' '), k, suppliers, scoring).index
+        if len(found) < k:
+            found = found.append(suppliers[~suppliers.isin(found)][:k - len(found)])
+        result.append(found)
+    return result
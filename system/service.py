@@ -0,0 +1,295 @@
+"""
+Resident supplier-scoring service.
+
+The catalogue, export records, feature distribution, ``slreg`` weights and retrieval index are
+loaded once and kept warm in memory. A background thread polls the source files; when a new
+extract lands, a complete new snapshot is loaded and swapped in, and requests in flight finish
+on the old one.
+
+    python service.py --catalogue processed_ctlg.csv --export export_compressed.csv [--port 8765]
+
+Endpoints (JSON):
+
+    POST /score    {"code_val": "0302", "prod_name": "...", "prod_desc": "...",
+                    "buyer_country": "US", "top": 10, "candidates": 200}
+                   -> {"suppliers": [{"ban": ..., "prob": ...}, ...], "latency_ms": {...}}
+    GET  /metrics  request count and latency percentiles of recent requests
+    GET  /health   sources and load time of the current snapshot
+
+The theta file, as written by ``suppsearch_learn.ipynb``, holds one ``slreg`` weight per line:
+one per feature of ``features.FEATURE_COLUMNS``, in that order, then the intercept.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import numpy as np
+import pandas as pd
+import fetcher as ft
+import features as fs
+import retrieval as rt
+import slreg as slr
+
+HOST = '127.0.0.1'
+PORT = 8765
+WINDOW = 1000
+
+
+def read_catalogue(path):
+    # BANs as strings, as in the export records, so suppliers match across both
+    return pd.read_csv(path, index_col='ban', parse_dates=['mod_date'],
+                       dtype={'ban': str, 'code_val': str})
+
+
+def read_export(path):
+    return pd.read_csv(path, index_col='ban', dtype={'ban': str})
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+class Snapshot:
+    """Data of one version of the sources, loaded and warmed up at once.
+
+    Parameters
+    ----------
+    paths : dict
+        Paths of ``catalogue``, ``export``, ``distribution``, ``theta`` and, optionally,
+        ``index`` (a pickled ``retrieval.InvertedIndex``).
+    """
+
+    def __init__(self, paths):
+        self.paths = dict(paths)
+        self.stamps = {name: _stamp(path) for name, path in self.paths.items() if path}
+        self.ctlg = read_catalogue(paths['catalogue'])
+        self.ex = read_export(paths['export'])
+        dist = pd.read_csv(paths['distribution'], index_col=0)
+        # Constant features are only centered
+        self.mean, self.std = dist['mean'], dist['std'].replace(0, 1)
+        columns = fs.FEATURE_COLUMNS + ['intercept']
+        if paths.get('theta') and os.path.isfile(paths['theta']):
+            with open(paths['theta'], 'r') as f:
+                self.theta = np.array([float(x) for x in f.read().split('\n') if x.strip()])
+        else:
+            self.theta = np.zeros(len(columns))
+        if len(self.theta) != len(columns):
+            raise ValueError('theta has {} weights, expected {}: one per feature of '
+                             'features.FEATURE_COLUMNS, then the intercept'
+                             .format(len(self.theta), len(columns)))
+        self.index = None
+        if paths.get('index') and os.path.isfile(paths['index']):
+            self.index = rt.load_index(paths['index'])
+        # Build the lookup structures now rather than on the first request
+        ft.code_index(self.ctlg)
+        ft.export_summary(self.ex)
+        fs.feature_engine(self.ctlg, self.ex)
+        self.loaded = time.strftime('%Y-%m-%d %H:%M:%S')
+        # Supplier lookups keep LRU caches that are not safe to update from several threads
+        self.lock = threading.Lock()
+
+    def changed(self):
+        """Whether any source file changed since this snapshot was loaded."""
+        return any(_stamp(path) != self.stamps.get(name)
+                   for name, path in self.paths.items() if path)
+
+    def score(self, inq, top=10, candidates=200):
+        """Return the ``top`` suppliers of inquiry ``inq`` (dict) by predicted probability.
+
+        Suppliers are first narrowed to the best ``candidates`` text matches, if the snapshot
+        has a retrieval index and ``candidates`` is not None.
+
+        Returns
+        -------
+        ranked : DataFrame
+            ``prob`` of each supplier, indexed by ``ban``, highest first.
+        timings : dict
+            Seconds spent on retrieval, features and scoring.
+        """
+
+        inqs = pd.DataFrame([inq], columns=['code_val', 'prod_name', 'prod_desc', 'buyer_country'])
+        timings = {}
+        with self.lock:
+            start = time.perf_counter()
+            bans = None
+            if self.index is not None and candidates is not None:
+                bans = rt.candidates(self.index, self.ctlg, inqs, k=candidates)
+            timings['retrieval'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            X = fs.compute_features_batch(self.ctlg, self.ex, inqs, bans)
+            X.index = X.index.droplevel('inquiry')
+            timings['features'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        X = (X.astype(float) - self.mean[X.columns]) / self.std[X.columns]
+        X['intercept'] = 1
+        prob = slr.predict_prob(X.values, self.theta)
+        ranked = pd.DataFrame({'prob': prob}, index=X.index).sort_values('prob', ascending=False)
+        timings['scoring'] = time.perf_counter() - start
+        return ranked.head(top), timings
+
+
+class Service:
+    """Holds the current ``Snapshot``, reloads it when sources change and records latencies.
+
+    Parameters
+    ----------
+    paths : dict
+        See ``Snapshot``.
+    interval : float, default 30
+        Seconds between checks for new extracts. No reloading if None.
+    """
+
+    def __init__(self, paths, interval=30):
+        self.snapshot = Snapshot(paths)
+        self.interval = interval
+        self.latencies = deque(maxlen=WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        if interval is not None:
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            if self.snapshot.changed():
+                try:
+                    snapshot = Snapshot(self.snapshot.paths)
+                except Exception as e:
+                    # Extracts may still be being written; try again at the next check
+                    print('Reload failed with message %s. Keeping the current data.' % e)
+                    continue
+                self.snapshot = snapshot
+                self.reloads += 1
+                print('Reloaded data on %s.' % snapshot.loaded)
+
+    def score(self, inq, top=10, candidates=200):
+        """Ranked suppliers of ``inq`` and latencies in milliseconds, as a JSON-ready dict."""
+        start = time.perf_counter()
+        try:
+            ranked, timings = self.snapshot.score(inq, top, candidates)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        timings['total'] = time.perf_counter() - start
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(timings['total'])
+        return {'suppliers': [{'ban': ban, 'prob': float(p)}
+                              for ban, p in zip(ranked.index.tolist(), ranked['prob'])],
+                'latency_ms': {k: round(v * 1000, 3) for k, v in timings.items()}}
+
+    def metrics(self):
+        """Request counts and latency percentiles (ms) of the last ``WINDOW`` requests."""
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            metrics = {'requests': self.requests, 'errors': self.errors, 'reloads': self.reloads}
+        if len(latencies):
+            metrics['latency_ms'] = {'p50': round(float(np.percentile(latencies, 50)), 3),
+                                     'p95': round(float(np.percentile(latencies, 95)), 3),
+                                     'p99': round(float(np.percentile(latencies, 99)), 3),
+                                     'max': round(float(latencies.max()), 3)}
+        return metrics
+
+    def health(self):
+        snapshot = self.snapshot
+        return {'loaded': snapshot.loaded, 'sources': snapshot.paths,
+                'suppliers': int(snapshot.ctlg.index.nunique()),
+                'retrieval': snapshot.index is not None}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(service):
+    """Request handler class serving ``service``."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send(200, service.metrics())
+            elif self.path == '/health':
+                self._send(200, service.health())
+            else:
+                self._send(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._send(404, {'error': 'Not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                inq = {col: body.get(col) for col in ['code_val', 'prod_name', 'prod_desc',
+                                                      'buyer_country']}
+                if not inq['code_val']:
+                    raise ValueError('code_val is required')
+                top, candidates = int(body.get('top', 10)), body.get('candidates', 200)
+                if candidates is not None:
+                    candidates = int(candidates)
+                if top < 1 or (candidates is not None and candidates < 1):
+                    raise ValueError('top and candidates must be positive')
+            except (ValueError, TypeError) as e:
+                self._send(400, {'error': str(e)})
+                return
+            try:
+                self._send(200, service.score(inq, top, candidates))
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(paths, host=HOST, port=PORT, interval=30):
+    """Load the data and serve it on ``host``:``port`` until interrupted."""
+    service = Service(paths, interval)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print('Serving on http://%s:%d (data loaded on %s).' % (host, port, service.snapshot.loaded))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve supplier rankings for buyer inquiries.')
+    parser.add_argument('--catalogue', required=True, help='processed catalogue CSV')
+    parser.add_argument('--export', required=True, help='export records CSV')
+    parser.add_argument('--distribution', default='feature_distribution.csv')
+    parser.add_argument('--theta', default='theta.txt')
+    parser.add_argument('--index', default=rt.INDEX_PATH, help='pickled retrieval index')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--interval', type=float, default=30,
+                        help='seconds between checks for new extracts')
+    args = parser.parse_args()
+    serve({'catalogue': args.catalogue, 'export': args.export, 'distribution': args.distribution,
+           'theta': args.theta, 'index': args.index},
+          args.host, args.port, args.interval)
@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import sparse
 
 
 def sigmoid(a):
@@ -11,6 +12,16 @@ def predict_prob(X, theta):
     return sigmoid(X @ theta)
 
 
+def log_loss(z, y):
+    """Mean cross-entropy of labels ``y`` given log-odds ``z = X @ theta``.
+
+    Computed as ``log(1 + exp(z)) - y * z`` with ``np.logaddexp``, which neither overflows nor
+    takes the log of 0 for confident predictions.
+    """
+
+    return np.mean(np.logaddexp(0, z) - y * z)
+
+
 def gradient_descent(X, y, theta, alpha):
     """Gradient descent for logistic regression.
     
@@ -27,7 +38,175 @@ def gradient_descent(X, y, theta, alpha):
     """
     
     m = len(y)
-    pred = predict_prob(X, theta)
-    theta = theta - alpha / m * X.T @ (pred - y)
-    J = 1 / m * (- y @ np.log(pred + 1e-13) - (1 - y) @ np.log(1 - pred + 1e-13))
-    return theta, J
\ No newline at end of file
+    z = X @ theta
+    theta = theta - alpha / m * X.T @ (sigmoid(z) - y)
+    J = log_loss(z, y)
+    return theta, J
+
+
+def train(X, y, theta=None, alpha=0.01, batch_size=32, n_epochs=100, l2=0.0, intercept=True,
+          validation=0.1, X_val=None, y_val=None, patience=5, tol=1e-4, random_state=None,
+          verbose=False):
+    """Mini-batch stochastic gradient descent for logistic regression, with early stopping.
+
+    Each epoch visits the training examples once, in a new random order, ``batch_size`` at a
+    time. Buffers are allocated once; for dense ``X`` the inner loop works on views and updates
+    in place. After every epoch the loss on the validation set is checked, and training stops
+    once it has not improved by ``tol`` for ``patience`` epochs.
+
+    Parameters
+    ----------
+    X : array or scipy.sparse matrix, shape (m, n)
+        Features, with the intercept column (if any) last.
+    y : array, shape (m,)
+        Labels, 0 or 1.
+    theta : array, shape (n,), optional
+        Initial weights. Zeros if None.
+    alpha : float, default 0.01
+        Learning rate.
+    batch_size : int, default 32
+    n_epochs : int, default 100
+        Maximum number of passes through the training set.
+    l2 : float, default 0.0
+        L2 regularization strength.
+    intercept : bool, default True
+        Whether the last column is the intercept, which is not regularized.
+    validation : float, default 0.1
+        Fraction of examples held out for early stopping, if ``X_val`` is not given. No early
+        stopping if 0, or if there are fewer than 2 examples. At least one example is left for
+        training.
+    X_val, y_val : optional
+        Validation set, dense or sparse whatever ``X`` is.
+    patience : int, default 5
+    tol : float, default 1e-4
+    random_state : int, optional
+        Seed of the shuffles.
+    verbose : bool, default False
+        Print the losses of every epoch.
+
+    Returns
+    -------
+    theta : array
+        Weights with the lowest validation loss (last weights without validation, or if the
+        validation loss never improved).
+
+    history : dict
+        ``train`` and ``val`` losses of every epoch (regularization included), and
+        ``best_epoch``.
+    """
+
+    rng = np.random.RandomState(random_state)
+    issparse = sparse.issparse(X)
+    if issparse:
+        X = sparse.csr_matrix(X, dtype=float)
+    else:
+        X = np.ascontiguousarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if X.shape[0] == 0:
+        raise ValueError('X has no rows')
+    # Holding out a validation set needs at least one row on either side
+    if X_val is None and validation and X.shape[0] > 1:
+        order = rng.permutation(X.shape[0])
+        n_val = min(max(int(round(validation * X.shape[0])), 1), X.shape[0] - 1)
+        X, X_val = X[order[n_val:]], X[order[:n_val]]
+        y, y_val = y[order[n_val:]], y[order[:n_val]]
+    if X_val is not None and y_val is not None:
+        y_val = np.asarray(y_val, dtype=float)
+        # Same layout as ``X``
+        if issparse:
+            X_val = sparse.csr_matrix(X_val, dtype=float)
+        elif sparse.issparse(X_val):
+            X_val = X_val.toarray()
+        else:
+            X_val = np.ascontiguousarray(X_val, dtype=float)
+    else:
+        X_val = y_val = None
+
+    m, n = X.shape
+    batch_size = min(batch_size, m)
+    theta = np.zeros(n) if theta is None else np.array(theta, dtype=float)
+    penalty = np.full(n, float(l2))
+    if intercept:
+        penalty[-1] = 0
+
+    # Preallocated buffers
+    if not issparse:
+        X_shuffled = np.empty_like(X)
+    y_shuffled = np.empty_like(y)
+    order = np.arange(m)
+    z = np.empty(batch_size)
+    loss = np.empty(batch_size)
+    grad = np.empty(n)
+    decay = np.empty(n)
+    best_theta = theta.copy()
+    z_val = None if y_val is None else np.empty(len(y_val))
+
+    def regularization():
+        np.multiply(theta, theta, out=decay)
+        return 0.5 * decay @ penalty
+
+    history = {'train': [], 'val': [], 'best_epoch': None}
+    best, wait = np.inf, 0
+    for epoch in range(n_epochs):
+        rng.shuffle(order)
+        np.take(y, order, out=y_shuffled)
+        if issparse:
+            X_shuffled = X[order]
+        else:
+            np.take(X, order, axis=0, out=X_shuffled)
+
+        total = 0.0
+        for start in range(0, m, batch_size):
+            stop = min(start + batch_size, m)
+            b = stop - start
+            Xb, yb, zb, lb = X_shuffled[start:stop], y_shuffled[start:stop], z[:b], loss[:b]
+            if issparse:
+                zb[:] = Xb @ theta
+            else:
+                np.dot(Xb, theta, out=zb)
+            # Loss log(1 + exp(z)) - y * z, before the update
+            np.logaddexp(0, zb, out=lb)
+            total += lb.sum() - yb @ zb
+            # Residuals sigmoid(z) - y, in place, with sigmoid(z) = (1 + tanh(z / 2)) / 2, which
+            # does not overflow for large |z| as exp(-z) does
+            zb *= 0.5
+            np.tanh(zb, out=zb)
+            zb += 1
+            zb *= 0.5
+            zb -= yb
+            if issparse:
+                grad[:] = Xb.T @ zb
+            else:
+                np.dot(Xb.T, zb, out=grad)
+            grad *= 1 / b
+            np.multiply(penalty, theta, out=decay)
+            grad += decay
+            grad *= alpha
+            theta -= grad
+        history['train'].append(total / m + regularization())
+
+        if z_val is not None:
+            if issparse:
+                z_val[:] = X_val @ theta
+            else:
+                np.dot(X_val, theta, out=z_val)
+            val = log_loss(z_val, y_val) + regularization()
+            history['val'].append(val)
+            if val < best - tol:
+                best, wait = val, 0
+                np.copyto(best_theta, theta)
+                history['best_epoch'] = epoch
+            else:
+                wait += 1
+        if verbose:
+            print('Epoch {}: train loss {:.6f}{}'.format(
+                epoch + 1, history['train'][-1],
+                ', validation loss {:.6f}'.format(history['val'][-1]) if history['val'] else ''))
+        if z_val is not None and wait >= patience:
+            break
+
+    if z_val is None or history['best_epoch'] is None:
+        # Without validation, or if it never improved (e.g. a NaN loss), keep the last weights
+        history['best_epoch'] = len(history['train']) - 1
+        return theta, history
+    return best_theta, history
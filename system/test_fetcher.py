@@ -0,0 +1,84 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import fetcher as ft
+
+
+@pytest.fixture(autouse=True)
+def agg_dir(tmp_path, monkeypatch):
+    """Store aggregate tables under ``tmp_path`` rather than in the home directory."""
+    monkeypatch.setattr(ft, 'supplier_aggregates', lambda ctlg: ft.per_frame(
+        ft._aggregates, ctlg, lambda c: ft.SupplierAggregates(c, cache_dir=str(tmp_path))))
+    return tmp_path
+
+
+@pytest.fixture
+def ctlg():
+    now = datetime.datetime.now()
+    return pd.DataFrame({'code_val': ['030211', '030212', '0303', '030211', '7318', None],
+                         'prod_name': ['trout', 'salmon', 'tuna', 'eel', 'bolt', 'nut'],
+                         'prod_desc': ['live trout', np.nan, 'frozen tuna', 'live eel', 'steel',
+                                       'steel nut'],
+                         'keyword': ['fish', 'fish', 'fish', np.nan, 'metal', 'metal'],
+                         'mod_date': [now - datetime.timedelta(days=d)
+                                      for d in (10, 3, 40, 5, 1, 2)]},
+                        index=pd.Index(['01', '01', '02', '03', '04', '05'], name='ban'))
+
+
+def test_fetch_suppliers(ctlg):
+    suppliers = ft.fetch_suppliers(ctlg, '0302')
+    assert suppliers.columns.tolist() == ft.SUPPLIER_COLUMNS
+    assert suppliers.index.tolist() == ['01', '03']
+    assert suppliers['n_items'].tolist() == [2, 1]
+    assert suppliers.loc['01', 'item_name'] == 'trout|salmon'
+    assert suppliers.loc['01', 'item_desc'] == 'live trout'
+    # Days since the latest modification
+    assert suppliers['recency'].tolist() == [3, 5]
+
+
+def test_fetch_suppliers_any_length(ctlg):
+    assert ft.fetch_suppliers(ctlg, '03').index.tolist() == ['01', '02', '03']
+    assert ft.fetch_suppliers(ctlg, '0302110').empty
+
+
+def test_version_follows_row_order(ctlg, agg_dir):
+    ft.fetch_suppliers(ctlg, '0302')
+    reordered = ctlg.iloc[::-1]
+    aggregates = ft.supplier_aggregates(reordered)
+    assert aggregates.version != ft.supplier_aggregates(ctlg).version
+    assert aggregates.version == ft.supplier_aggregates(ctlg.iloc[::-1].copy()).version
+    # Tables are rebuilt for the new order rather than loaded from the stored ones
+    built = []
+    build = aggregates.build
+    aggregates.build = lambda level: built.append(level) or build(level)
+    suppliers = ft.fetch_suppliers(reordered, '0302')
+    assert built == [4]
+    assert len(list(agg_dir.iterdir())) == 2
+    assert suppliers.loc['01', 'item_name'] == 'salmon|trout'
+
+
+@pytest.fixture
+def ex():
+    return pd.DataFrame({'code_val': ['0302', '0302', '0303', '7318'],
+                         'prod_name': ['fish', 'fish', np.nan, 'bolt'],
+                         'country': ['US', 'JP', 'US', 'DE']},
+                        index=pd.Index(['01', '01', '01', '04'], name='ban'))
+
+
+def test_fetch_export(ex):
+    export = ft.fetch_export(ex, ['04', '01'], 'US')
+    assert export.index.tolist() == ['01', '04']
+    assert export['n_comms'].tolist() == [1, 1]
+    assert export['comm_name'].tolist() == ['fish', 'bolt']
+    assert export['isexporter'].tolist() == [True, False]
+
+
+def test_fetch_export_missing_and_repeated_bans(ex):
+    export = ft.fetch_export(ex, ['01', '09', '01'], 'JP')
+    # One row per distinct BAN; BANs without records are kept, empty
+    assert export.index.tolist() == ['01', '09']
+    assert export.loc['09'].tolist() == [0, '', False]
+    batch = ft.fetch_export_batch(ex, [(['09', '01', '09'], 'JP'), (['04'], 'DE')])
+    assert batch.index.tolist() == [(0, '09'), (0, '01'), (1, '04')]
+    assert batch['isexporter'].tolist() == [False, True, True]
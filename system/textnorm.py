@@ -0,0 +1,78 @@
+import hashlib
+import os
+import re
+import string
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from nltk.corpus import stopwords
+from nltk.stem import SnowballStemmer, WordNetLemmatizer
+
+NORM_DIR = os.path.join(os.path.expanduser('~'), '.trademodel', 'textnorm')
+CATALOGUE_COLUMNS = ('prod_name', 'prod_desc', 'keyword')
+STOPWORDS = frozenset(stopwords.words('english'))
+
+_sno = SnowballStemmer('english')
+_wnl = WordNetLemmatizer()
+_whitespace = re.compile(r'[\t\n\r\f\v]')
+_digits = re.compile(r'\d+')
+# capture commas followed by any number of whitespaces
+_commas = re.compile(r', *')
+_spaces = re.compile(r' +')
+_punctuation = str.maketrans('', '', string.punctuation)
+
+
+@lru_cache(maxsize=65536)
+def normalize_token(token):
+    """Apply SnowballStemmer then WordNetLemmatizer to singularize missed words."""
+    return _wnl.lemmatize(_sno.stem(token))
+
+
+def normalize(s):
+    """Return the distinct normalized terms of string ``s``, space-separated in sorted order.
+
+    Non-strings give an empty string.
+    """
+
+    if not isinstance(s, str):
+        return ''
+    s = _whitespace.sub('', s.strip().lower())
+    s = _commas.sub(' ', _digits.sub('', s)).translate(_punctuation)
+    return ' '.join(sorted({normalize_token(x) for x in _spaces.split(s) if x not in STOPWORDS}))
+
+
+def process_string(s):
+    """Normalize every string of Series ``s``; each distinct value is normalized once."""
+    isstr = s.map(lambda x: isinstance(x, str)).astype(bool)
+    uniques = pd.unique(s[isstr])
+    mapping = dict(zip(uniques, map(normalize, uniques)))
+    # By position, as the index (e.g. ``ban``) may repeat
+    out = np.full(len(s), '', dtype=object)
+    out[isstr.values] = s[isstr].map(mapping).values
+    return pd.Series(out, index=s.index)
+
+
+def process_catalogue(ctlg, columns=CATALOGUE_COLUMNS, cache_dir=NORM_DIR):
+    """Return a copy of ``ctlg`` with ``columns`` normalized by ``process_string``.
+
+    The normalized columns are stored on disk under a hash of their raw contents, so each
+    catalogue version is normalized once.
+    """
+
+    columns = list(columns)
+    # Row hashes in order, since the stored columns are positional
+    row_hashes = pd.util.hash_pandas_object(ctlg[columns], index=False)
+    version = hashlib.sha1(row_hashes.values.tobytes()).hexdigest()
+    path = os.path.join(cache_dir, version + '.pkl')
+    if os.path.isfile(path):
+        processed = pd.read_pickle(path)
+    else:
+        processed = pd.DataFrame({col: process_string(ctlg[col]).values for col in columns},
+                                 columns=columns)
+        os.makedirs(cache_dir, exist_ok=True)
+        processed.to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    ctlg = ctlg.copy()
+    for col in columns:
+        ctlg[col] = processed[col].values
+    return ctlg
@@ -0,0 +1,159 @@
+# Local columnar cache for source files on network shares.
+#
+# Opt-in: set the environment variable TRADEMODEL_CACHE_DIR to a local
+# directory (or call ``enable``). The first time a file is read through
+# ``read_csv``, the parsed frame is written there as uncompressed Feather.
+# Later reads with the same arguments memory-map the Feather copy instead of
+# re-parsing the source. A copy is rebuilt when the source mtime or size
+# changes. Without a cache directory, ``read_csv`` is ``pd.read_csv``.
+#
+# ``read_csv_where`` keeps only the rows selected by a filter, evaluated one
+# chunk (or cached record batch) at a time, so non-matching rows are never
+# materialized all at once.
+
+import os
+import json
+import hashlib
+import pandas as pd
+
+ENV_VAR = 'TRADEMODEL_CACHE_DIR'
+_cache_dir = os.environ.get(ENV_VAR) or None
+
+def enable(path=None):
+    """
+    Turn the cache on for this session.
+
+    Parameters
+    ----------
+    path : string, optional (default=~/.trademodel/cache)
+        Local cache directory.
+    """
+    global _cache_dir
+    _cache_dir = path or os.path.join(os.path.expanduser('~'), '.trademodel', 'cache')
+
+def disable():
+    """Turn the cache off for this session. Cached copies are kept."""
+    global _cache_dir
+    _cache_dir = None
+
+def clear():
+    """Delete all cached copies."""
+    if _cache_dir and os.path.isdir(_cache_dir):
+        for f in os.listdir(_cache_dir):
+            if f.endswith('.feather') or f.endswith('.json'):
+                os.remove(os.path.join(_cache_dir, f))
+
+def _entry(path, kwargs):
+    """Cache file stem for ``path`` parsed with ``kwargs``."""
+    key = repr((os.path.abspath(str(path)), sorted(kwargs.items(), key=lambda x: x[0])))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(_cache_dir, os.path.basename(str(path)) + '.' + digest)
+
+def _stamp(path):
+    st = os.stat(path)
+    return {'mtime': st.st_mtime, 'size': st.st_size}
+
+def _load(path, kwargs):
+    """Return (memory-mapped arrow table, meta) of a valid cached copy, or None."""
+    import pyarrow.feather as feather
+
+    stem = _entry(path, kwargs)
+    try:
+        with open(stem + '.json', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta['source'] != _stamp(path) or not os.path.isfile(stem + '.feather'):
+        return None
+    return feather.read_table(stem + '.feather', memory_map=True), meta
+
+def _restore(df, meta):
+    """Restore the dtypes and index of a frame read back from a cached copy."""
+    # Arrow may map text back to a string dtype; restore the parsed dtypes
+    for col in meta['object_columns']:
+        if df[col].dtype != object:
+            df[col] = df[col].astype(object)
+    if meta['index'] is not None:
+        df = df.set_index(meta['index'])
+        df.index.names = meta['index_names']
+    return df
+
+def _store(path, kwargs, df):
+    """Write ``df``, as parsed from ``path`` with ``kwargs``, to the cache."""
+    import pyarrow.feather as feather
+
+    stem = _entry(path, kwargs)
+    stamp = _stamp(path)
+    # Feather only stores a default index, so any other index becomes columns
+    if isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+        index, index_names, flat = None, None, df
+    else:
+        index_names = list(df.index.names)
+        index = ['__index_level_{}__'.format(i) for i in range(len(index_names))]
+        flat = df.copy()
+        flat.index.names = index
+        flat = flat.reset_index()
+    os.makedirs(_cache_dir, exist_ok=True)
+    # Write to temporary files first so a crash never leaves a partial copy
+    feather.write_feather(flat, stem + '.feather.tmp', compression='uncompressed')
+    os.replace(stem + '.feather.tmp', stem + '.feather')
+    with open(stem + '.json.tmp', encoding='utf-8', mode='w') as f:
+        json.dump({'path': str(path), 'source': stamp, 'index': index,
+                   'index_names': index_names,
+                   'object_columns': [str(c) for c in flat.columns if flat[c].dtype == object]},
+                  f, ensure_ascii=False)
+    os.replace(stem + '.json.tmp', stem + '.json')
+
+def read_csv(path, **kwargs):
+    """
+    ``pd.read_csv(path, **kwargs)``, served from the local cache when enabled.
+
+    The index (e.g. from ``index_col``), column names and dtypes are the same
+    as those of ``pd.read_csv``.
+    """
+    if _cache_dir is None:
+        return pd.read_csv(path, **kwargs)
+    cached = _load(path, kwargs)
+    if cached is not None:
+        table, meta = cached
+        return _restore(table.to_pandas(), meta)
+    df = pd.read_csv(path, **kwargs)
+    _store(path, kwargs, df)
+    return df
+
+def read_csv_where(path, where, columns=None, chunksize=500000, **kwargs):
+    """
+    Rows of ``pd.read_csv(path, **kwargs)`` selected by ``where``.
+
+    Parameters
+    ----------
+    path : string
+    where : callable
+        Takes a chunk (DataFrame) and returns a boolean mask of rows to keep.
+    columns : list, optional
+        Columns to keep after filtering. All if None.
+    chunksize : int, optional (default=500000)
+        Rows parsed (or, from the cache, converted) at a time.
+
+    Without a cache the source is parsed in chunks. With a cache, the first
+    read parses and caches the whole file; later reads filter the memory-mapped
+    copy batch by batch.
+    """
+    def select(df):
+        df = df[where(df)]
+        return df if columns is None else df[columns]
+
+    if _cache_dir is None:
+        chunks = [select(df) for df in pd.read_csv(path, chunksize=chunksize, **kwargs)]
+    else:
+        cached = _load(path, kwargs)
+        if cached is None:
+            df = pd.read_csv(path, **kwargs)
+            _store(path, kwargs, df)
+            return select(df)
+        table, meta = cached
+        chunks = [select(_restore(batch.to_pandas(), meta))
+                  for batch in table.to_batches(max_chunksize=chunksize)]
+    if not chunks:
+        return select(pd.read_csv(path, nrows=0, **kwargs))
+    return pd.concat(chunks, axis=0)
@@ -0,0 +1,133 @@
+# Compact encoding of trade frames:
+#   1. HS codes as integers plus their digit length ('0101' -> 101, 4)
+#   2. Countries, partners and BANs as categoricals
+#
+# Categoricals use stable dictionaries: a value keeps its code for good, and
+# new values are appended. Frames encoded in different sessions (or threads)
+# therefore share the same categories and concatenate without falling back to
+# object. Dictionaries are kept as json lists under ~/.trademodel/dictionaries.
+# Decode back to strings only for presentation (``expand``).
+
+import os
+import json
+import threading
+import pandas as pd
+
+DICT_DIR = os.path.join(os.path.expanduser('~'), '.trademodel', 'dictionaries')
+LEN_SUFFIX = '_len'
+_dictionaries = {}
+_lock = threading.Lock()
+
+def _path(name):
+    return os.path.join(DICT_DIR, name + '.json')
+
+def dictionary(name):
+    """Categorical dtype of the stable dictionary ``name``."""
+    with _lock:
+        if name not in _dictionaries:
+            values = []
+            if os.path.isfile(_path(name)):
+                with open(_path(name), encoding='utf-8') as f:
+                    values = json.load(f)
+            _dictionaries[name] = values
+        return pd.CategoricalDtype(_dictionaries[name])
+
+def _extend(name, values):
+    """Append unseen ``values`` to dictionary ``name`` and save it."""
+    dictionary(name)
+    with _lock:
+        known = set(_dictionaries[name])
+        new = sorted(v for v in set(values) if v not in known)
+        if not new:
+            return
+        _dictionaries[name] = _dictionaries[name] + new
+        os.makedirs(DICT_DIR, exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a partial copy
+        tmp = _path(name) + '.{}.tmp'.format(threading.get_ident())
+        with open(tmp, encoding='utf-8', mode='w') as f:
+            json.dump(_dictionaries[name], f, ensure_ascii=False)
+        os.replace(tmp, _path(name))
+
+def encode_category(values, name):
+    """
+    Encode ``values`` as a categorical with the stable dictionary ``name``.
+    Missing values stay missing.
+    """
+    values = pd.Series(values)
+    unique = values.dropna().unique()
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        unique = values.cat.categories[values.cat.categories.isin(unique)]
+    _extend(name, [v.item() if hasattr(v, 'item') else v for v in unique])
+    return values.astype(dictionary(name))
+
+def encode_hs(codes):
+    """
+    Encode HS code strings as (integer values, digit lengths).
+
+    Codes with non-digit characters (e.g. 'TOTAL') and missing codes become
+    missing values of length 0.
+    """
+    codes = pd.Series(codes)
+    text = codes.astype(object).where(codes.notnull())
+    numeric = text.str.fullmatch(r'\d+', na=False)
+    lengths = text.str.len().where(numeric, 0).astype('int8')
+    values = pd.to_numeric(text.where(numeric), errors='coerce')
+    dtype = 'int32' if lengths.max() <= 9 else 'int64'
+    if not numeric.all():
+        dtype = dtype.capitalize()
+    return values.astype(dtype), lengths
+
+def decode_hs(values, lengths):
+    """Inverse of ``encode_hs``: zero-padded code strings (missing where length is 0)."""
+    values = pd.Series(values)
+    lengths = pd.Series(lengths, index=values.index)
+    codes = pd.Series(None, index=values.index, dtype=object)
+    # Pad once per distinct length rather than once per row
+    for n in lengths.unique():
+        if n == 0:
+            continue
+        mask = lengths == n
+        codes[mask] = values[mask].astype('int64').astype(str).str.zfill(int(n)).astype(object)
+    return codes
+
+def compact(df, hs=(), categories=None):
+    """
+    Return ``df`` with compactly encoded columns.
+
+    Parameters
+    ----------
+    df : DataFrame
+    hs : sequence, optional
+        HS code columns. Each is replaced by its integer value, and a
+        column '<name>_len' with the digit length is added.
+    categories : dict, optional
+        Column name to stable dictionary name, e.g. {'country': 'mof_country'}.
+
+    Already encoded columns are left as they are (or, for categoricals,
+    recast to the current dictionary), so frames can be compacted one
+    file at a time and again after concatenation.
+    """
+    df = df.copy()
+    for col in hs:
+        if col in df and col + LEN_SUFFIX not in df:
+            values, lengths = encode_hs(df[col])
+            df[col] = values.values
+            df.insert(df.columns.get_loc(col) + 1, col + LEN_SUFFIX, lengths.values)
+    for col, name in (categories or {}).items():
+        if col in df:
+            df[col] = encode_category(df[col], name).values
+    return df
+
+def expand(df):
+    """Decode a compact frame for presentation: HS codes and categoricals back to strings."""
+    df = df.copy()
+    for col in list(df.columns):
+        if col not in df:
+            continue
+        if col + LEN_SUFFIX in df:
+            df[col] = decode_hs(df[col], df[col + LEN_SUFFIX]).values
+            df = df.drop(col + LEN_SUFFIX, axis=1)
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories
+            df[col] = df[col].astype(object if df[col].hasnans else categories.dtype)
+    return df
@@ -5,106 +5,424 @@
 #   4. MOF customs data
 #   5. Product descriptions (MOF or UN)
 #   6. Country codes (MOF or UN reporter/partner)
+#
+# Source files are read through cache.read_csv, so setting TRADEMODEL_CACHE_DIR
+# serves repeated reads from a local columnar copy (see cache.py).
+#
+# The trade readers take compact=True to return HS codes as integers plus
+# digit length and countries/BANs as categoricals (see encoding.py); use
+# encoding.expand to decode for presentation.
 
 import os
+import json
+import shutil
 import itertools
 import pandas as pd
 import re
-from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
+import refdata
+import cache
+import encoding
 
-def read_itc():
+CUSTOMS_COLUMNS = {'國家': 'country', '貨品分類': 'code', '中文貨名': 'desc_zh', '英文貨名': 'desc_en',
+                   '數量': 'qty', '數量單位': 'qty_unit', '重量': 'weight', '重量單位': 'weight_unit',
+                   '價值': 'val'}
+
+def concat_parallel(func, args, workers=8, **kwargs):
+    """
+    Call ``func`` on each element of ``args`` in a thread pool and concatenate
+    the resulting frames, in the order of ``args``, with a single pd.concat.
+    Extra keyword arguments are passed to pd.concat.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(func, args))
+    return pd.concat(frames, axis=0, **kwargs)
+
+def read_itc(workers=8, compact=False):
     """
     Read ITC HS4 import data. Year range: 2001 to 2015.
     Variables: importing country, product code, partner (yearly value spread across columns).
+    Files are read concurrently by ``workers`` threads. If ``compact``, the frame is
+    compactly encoded (see encoding.py).
     """
     path = '//172.20.23.190/ds/Raw Data/2016大數爬蟲案/data/ITC HS4/all/'
     files = pd.Series(os.listdir(path))
     # Filter for import data
     files = files[files.str.contains('_I')]
-    df_map = map(lambda f: pd.read_csv(path + f, index_col=0,
-                                       dtype={'Country': 'object',
-                                              'Product Code': 'object',
-                                              'Partner': 'object',
-                                              'Value in 2001': 'float',
-                                              'Value in 2002': 'float',
-                                              'Value in 2003': 'float',
-                                              'Value in 2004': 'float',
-                                              'Value in 2005': 'float',
-                                              'Value in 2006': 'float',
-                                              'Value in 2007': 'float',
-                                              'Value in 2008': 'float',
-                                              'Value in 2009': 'float',
-                                              'Value in 2010': 'float',
-                                              'Value in 2011': 'float',
-                                              'Value in 2012': 'float',
-                                              'Value in 2013': 'float',
-                                              'Value in 2014': 'float',
-                                              'Value in 2015': 'float'}), files)
-    df = reduce(lambda x, y: pd.concat([x, y], axis=0, ignore_index=True), df_map)
+    read_file = lambda f: cache.read_csv(path + f, index_col=0,
+                                          dtype={'Country': 'object',
+                                                 'Product Code': 'object',
+                                                 'Partner': 'object',
+                                                 'Value in 2001': 'float',
+                                                 'Value in 2002': 'float',
+                                                 'Value in 2003': 'float',
+                                                 'Value in 2004': 'float',
+                                                 'Value in 2005': 'float',
+                                                 'Value in 2006': 'float',
+                                                 'Value in 2007': 'float',
+                                                 'Value in 2008': 'float',
+                                                 'Value in 2009': 'float',
+                                                 'Value in 2010': 'float',
+                                                 'Value in 2011': 'float',
+                                                 'Value in 2012': 'float',
+                                                 'Value in 2013': 'float',
+                                                 'Value in 2014': 'float',
+                                                 'Value in 2015': 'float'})
+    df = concat_parallel(read_file, files, workers, ignore_index=True)
     # Remove the leading single quote (') in product code column
-    df['Product Code'] = df['Product Code'].apply(lambda x: x[1:])
+    df['Product Code'] = df['Product Code'].str[1:]
     # Remove HS6 rows
-    df = df[df['product'].apply(len) == 4]
+    df = df[df['Product Code'].str.len() == 4]
+    if compact:
+        df = encoding.compact(df, hs=['Product Code'],
+                              categories={'Country': 'itc_country', 'Partner': 'itc_country'})
     return df
 
-def read_un(start=2011, end=2015):
+def read_un(start=2011, end=2015, reporters=None, partners=None, commodity_prefixes=None, flows=(1,),
+            columns=None, workers=8, compact=False):
     """
-    Read UN HS6 import data. Available year range: 2011 to 2015.
-    Variables: reporter, commodity, partner, year.
+    Read UN HS6 trade data. Available year range: 2011 to 2015.
+    Variables: reporter, partner, commodity, val, year (and flow if more than one flow is read).
+
+    Parameters
+    ----------
+    start, end : int, optional
+        First and last year.
+    reporters, partners : list of int, optional
+        Reporter and partner codes to keep. All if None.
+    commodity_prefixes : list of string, optional
+        Keep HS6 codes starting with any of these, e.g. ['0302', '030389']. All if None.
+    flows : list of int, optional (default=(1,))
+        Flows to keep, 1 for imports and 2 for exports. All if None.
+    columns : list, optional
+        Columns to return. All if None.
+    workers : int, optional (default=8)
+        Number of years read concurrently.
+    compact : bool, optional (default=False)
+        If True, commodity is encoded as integer plus digit length and
+        reporter/partner as categoricals (see encoding.py).
+
+    Filters are applied while each file is scanned, so only matching rows are
+    ever held in memory.
     """
+    names = ['flow', 'reporter', 'partner', 'commodity', 'val']
+    keep_flow = flows is None or len(flows) > 1
+    prefixes = None if commodity_prefixes is None else tuple(commodity_prefixes)
+
+    def where(df):
+        # Get HS6 rows (codes of length 5 lost their leading zero)
+        mask = df['commodity'].str.len() >= 5
+        if flows is not None:
+            mask &= df['flow'].isin(flows)
+        if reporters is not None:
+            mask &= df['reporter'].isin(reporters)
+        if partners is not None:
+            mask &= df['partner'].isin(partners)
+        if prefixes is not None:
+            mask &= df['commodity'].str.zfill(6).str.startswith(prefixes, na=False)
+        return mask
+
     def read_yearly(year):
         path = '//172.26.1.102/dstore/uncomtrade/annual_reduced/'
-        df = pd.read_csv(path + str(year) + '.csv', header=0,
-                         names=['flow', 'reporter', 'partner', 'commodity', 'val'],
-                         dtype={'flow': int,
-                                'reporter': int,
-                                'partner': int,
-                                'commodity': str,
-                                'val': float})
-        # Keep only import data (flow == 1)
-        df = df[df['flow'] == 1].drop('flow', axis=1)
-        # Get HS6 rows and pad 0's to have length 6
-        df = df[df['commodity'].str.len() >= 5]
-        df['commodity'] = df['commodity'].apply(lambda x: x.zfill(6))
+        df = cache.read_csv_where(path + str(year) + '.csv', where,
+                                  columns=None if columns is None else [c for c in names if c in columns],
+                                  header=0, names=names,
+                                  dtype={'flow': int,
+                                         'reporter': int,
+                                         'partner': int,
+                                         'commodity': str,
+                                         'val': float})
+        if 'flow' in df and not keep_flow:
+            df = df.drop('flow', axis=1)
+        # Pad 0's to have length 6
+        if 'commodity' in df:
+            df['commodity'] = df['commodity'].str.zfill(6)
         # Add year column
         df['year'] = year
+        if compact:
+            df = encoding.compact(df, **un_encoding)
         return df
-    df = reduce(lambda x, y: pd.concat([x, y], axis=0, ignore_index=True),
-                map(read_yearly, range(start, end + 1)))
+    un_encoding = {'hs': ['commodity'], 'categories': {'reporter': 'un_area', 'partner': 'un_area'}}
+    df = concat_parallel(read_yearly, range(start, end + 1), workers, ignore_index=True)
+    if columns is not None:
+        df = df[[c for c in df.columns
+                 if c in columns or c.endswith(encoding.LEN_SUFFIX) and c[:-len(encoding.LEN_SUFFIX)] in columns]]
+    if compact:
+        # Recast categoricals whose dictionary grew while other years were read
+        df = encoding.compact(df, **un_encoding)
     return df
     
-def read_company_trade():
+COMPANY_TRADE_PATH = ('C:/Users/2093/Desktop/Data Center/03. Data/06. companies/財政部廠商進出口資料/' +
+                      'KMG_HS6COUNTRY.csv')
+COMPANY_TRADE_PARTS = os.path.join(os.path.expanduser('~'), '.trademodel', 'company_trade')
+COMPANY_TRADE_ENCODING = {'hs': ['code'], 'categories': {'ban': 'ban', 'country': 'mof_country'}}
+
+def company_filter(bans=None, countries=None, commodity_prefixes=None):
+    """Row filter (DataFrame -> boolean mask) of MOF company trade data."""
+    prefixes = None if commodity_prefixes is None else tuple(commodity_prefixes)
+
+    def where(df):
+        mask = pd.Series(True, index=df.index)
+        if bans is not None:
+            mask &= df['ban'].isin(bans)
+        if countries is not None:
+            mask &= df['country'].isin(countries)
+        if prefixes is not None:
+            mask &= df['code'].str.startswith(prefixes, na=False)
+        return mask
+    return where
+
+def read_company_trade(bans=None, countries=None, commodity_prefixes=None, columns=None, compact=False):
     """
     Read MOF company HS6 export and import data. Month range: 2014-01 to 2016-10.
-    Variables: ban, code, country (year and month as index).
+    Variables: ban, code, country, ex, im (year and month as index).
+
+    Parameters
+    ----------
+    bans : list of string, optional
+        Business administration numbers to keep. All if None.
+    countries : list of string, optional
+        Country codes to keep. All if None.
+    commodity_prefixes : list of string, optional
+        Keep HS6 codes starting with any of these. All if None.
+    columns : list, optional
+        Columns to return, any of ban, code, country, ex, im. All if None.
+    compact : bool, optional (default=False)
+        If True, code is encoded as integer plus digit length and ban/country
+        as categoricals (see encoding.py).
+
+    Filters are applied while the file is scanned, so only matching rows are
+    ever held in memory. For data that does not fit in memory even after
+    filtering, see iter_company_trade and aggregate_company_trade.
     """
-    path = 'C:/Users/2093/Desktop/Data Center/03. Data/06. companies/財政部廠商進出口資料/KMG_HS6COUNTRY.csv'
-    df = pd.read_csv(path, names=['ban', 'code', 'country', 'year', 'month', 'ex', 'im'], header=0,
-                     dtype={'ban': str, 'code': str, 'country': str, 'year': str, 'month': str,
-                            'ex': int, 'im': int})
+    keep = company_filter(bans, countries, commodity_prefixes)
     # Remove yearly total rows
-    df = df[df['month'].notnull()]
-    # Pad zeros and construct DatetimeIndex
-    df['month'] = df['month'].apply(lambda x: x.zfill(2))
-    df.index = pd.to_datetime(df['year'] + df['month'], format='%Y%m')
-    df.index.name = 'date'
+    where = lambda df: df['month'].notnull() & keep(df)
+    df = cache.read_csv_where(COMPANY_TRADE_PATH, where,
+                              columns=None if columns is None else list(columns) + ['year', 'month'],
+                              names=['ban', 'code', 'country', 'year', 'month', 'ex', 'im'], header=0,
+                              dtype={'ban': str, 'code': str, 'country': str, 'year': str, 'month': str,
+                                     'ex': int, 'im': int})
+    # Construct DatetimeIndex from integer components rather than parsing strings
+    df.index = pd.DatetimeIndex(pd.to_datetime({'year': df['year'].astype(int),
+                                                'month': df['month'].astype(int),
+                                                'day': 1}), name='date')
     # Drop original year and month columns
     df = df.drop(['year', 'month'], axis=1)
+    if compact:
+        df = encoding.compact(df, **COMPANY_TRADE_ENCODING)
     return df
-    
-def read_customs(start='2003-01', end='2016-12'):
+
+def partition_company_trade(path=COMPANY_TRADE_PATH, dest=COMPANY_TRADE_PARTS, chunksize=1000000):
+    """
+    Split the company trade file into monthly Parquet partitions, dest/year=YYYY/month=M/.
+
+    The file is scanned in chunks, so it is never held in memory. Partitions are
+    rebuilt only if the source mtime or size changed since the last split.
+
+    Returns
+    -------
+    dest : string
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    st = os.stat(path)
+    stamp = {'mtime': st.st_mtime, 'size': st.st_size}
+    meta_path = os.path.join(dest, '_source.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            if json.load(f) == stamp:
+                return dest
+
+    # Build next to the destination and swap in, so readers never see a partial split
+    tmp = dest + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    chunks = pd.read_csv(path, names=['ban', 'code', 'country', 'year', 'month', 'ex', 'im'], header=0,
+                         dtype={'ban': str, 'code': str, 'country': str, 'year': 'Int64', 'month': 'Int64',
+                                'ex': 'int64', 'im': 'int64'}, chunksize=chunksize)
+    for i, chunk in enumerate(chunks):
+        # Remove yearly total rows
+        chunk = chunk[chunk['month'].notnull()]
+        for (year, month), part in chunk.groupby(['year', 'month']):
+            part_dir = os.path.join(tmp, 'year={}'.format(year), 'month={}'.format(month))
+            os.makedirs(part_dir, exist_ok=True)
+            table = pa.Table.from_pandas(part.drop(['year', 'month'], axis=1), preserve_index=False)
+            pq.write_table(table, os.path.join(part_dir, 'part-{}.parquet'.format(i)))
+    with open(os.path.join(tmp, '_source.json'), encoding='utf-8', mode='w') as f:
+        json.dump(stamp, f)
+    shutil.rmtree(dest, ignore_errors=True)
+    os.replace(tmp, dest)
+    return dest
+
+def company_trade_periods(dest=COMPANY_TRADE_PARTS):
+    """Sorted (year, month) pairs available in the partitioned company trade data."""
+    periods = []
+    for year_dir in os.listdir(dest):
+        if not year_dir.startswith('year='):
+            continue
+        for month_dir in os.listdir(os.path.join(dest, year_dir)):
+            if month_dir.startswith('month='):
+                periods.append((int(year_dir[5:]), int(month_dir[6:])))
+    return sorted(periods)
+
+def iter_company_trade(freq='M', start=None, end=None, bans=None, countries=None, commodity_prefixes=None,
+                       columns=None, compact=False, dest=COMPANY_TRADE_PARTS):
+    """
+    Iterate over MOF company trade data one month or one year at a time.
+
+    Parameters
+    ----------
+    freq : {'M', 'A'}, optional (default='M')
+        Partition size: month or year.
+    start, end : string, optional
+        First and last month, 'YYYY-MM'. All if None.
+    bans, countries, commodity_prefixes, columns, compact
+        As in read_company_trade.
+    dest : string, optional
+        Directory of the partitioned data, built on first use (partition_company_trade).
+
+    Yields
+    ------
+    (date, df) : tuple
+        First day of the month (or year) and its rows, with variables ban, code,
+        country, ex, im and the month as index.
+    """
+    if freq not in ['M', 'A']:
+        raise ValueError('Invalid freq "{}"'.format(freq))
+    partition_company_trade(dest=dest)
+    start = None if start is None else pd.to_datetime(start, format='%Y-%m')
+    end = None if end is None else pd.to_datetime(end, format='%Y-%m')
+    where = company_filter(bans, countries, commodity_prefixes)
+
+    def read_month(year, month):
+        part_dir = os.path.join(dest, 'year={}'.format(year), 'month={}'.format(month))
+        df = pd.concat([pd.read_parquet(os.path.join(part_dir, f)) for f in sorted(os.listdir(part_dir))],
+                       axis=0, ignore_index=True)
+        df = df[where(df)]
+        if columns is not None:
+            df = df[list(columns)]
+        # One date per partition, so no per-row date parsing
+        df.index = pd.DatetimeIndex([pd.Timestamp(year, month, 1)] * len(df), name='date')
+        if compact:
+            df = encoding.compact(df, **COMPANY_TRADE_ENCODING)
+        return df
+
+    periods = [(y, m) for y, m in company_trade_periods(dest)
+               if (start is None or pd.Timestamp(y, m, 1) >= start)
+               and (end is None or pd.Timestamp(y, m, 1) <= end)]
+    if freq == 'M':
+        for year, month in periods:
+            yield pd.Timestamp(year, month, 1), read_month(year, month)
+    else:
+        for year, group in itertools.groupby(periods, key=lambda x: x[0]):
+            df = pd.concat([read_month(y, m) for y, m in group], axis=0)
+            if compact:
+                df = encoding.compact(df, **COMPANY_TRADE_ENCODING)
+            yield pd.Timestamp(year, 1, 1), df
+
+def aggregate_company_trade(by, freq='A', sums=('ex', 'im'), nunique=(), start=None, end=None, **filters):
+    """
+    Streaming groupby of MOF company trade data, one partition at a time.
+
+    Parameters
+    ----------
+    by : list
+        Grouping variables, any of ban, code, country.
+    freq : {'M', 'A', None}, optional (default='A')
+        Aggregate per month, per year, or (None) over the whole range.
+    sums : sequence, optional (default=('ex', 'im'))
+        Variables to sum.
+    nunique : sequence, optional
+        Variables whose distinct values are counted, e.g. ['country'].
+        Output columns are named 'n_<variable>'.
+    start, end : string, optional
+        First and last month, 'YYYY-MM'.
+    **filters
+        bans, countries, commodity_prefixes as in read_company_trade.
+
+    Only one partition and the running aggregates are held in memory. For
+    freq=None, distinct counts are exact: distinct (group, value) pairs are
+    carried over between partitions.
+
+    Returns
+    -------
+    DataFrame indexed by date (unless freq is None) and ``by``.
+    """
+    by = list(by)
+    sums, nunique = list(sums), list(nunique)
+    columns = list(dict.fromkeys(by + sums + nunique))
+    results = []
+    total = None
+    pairs = {col: None for col in nunique}
+    for date, df in iter_company_trade(freq or 'M', start, end, columns=columns, **filters):
+        if freq is not None:
+            agg = df.groupby(by)[sums].sum()
+            for col in nunique:
+                agg['n_' + col] = df.groupby(by)[col].nunique()
+            agg['date'] = date
+            results.append(agg.reset_index().set_index(['date'] + by))
+            continue
+        agg = df.groupby(by)[sums].sum()
+        total = agg if total is None else total.add(agg, fill_value=0)
+        for col in nunique:
+            new = df[by + [col]].drop_duplicates()
+            pairs[col] = new if pairs[col] is None else pd.concat([pairs[col], new]).drop_duplicates()
+    if freq is not None:
+        if not results:
+            return pd.DataFrame(columns=sums + ['n_' + c for c in nunique])
+        return pd.concat(results, axis=0)
+    if total is None:
+        return pd.DataFrame(columns=sums + ['n_' + c for c in nunique])
+    # Partial sums are aligned with fill_value, which upcasts to float
+    total = total.astype('int64')
+    for col in nunique:
+        total['n_' + col] = pairs[col].groupby(by)[col].nunique()
+    return total
+
+def read_customs(start='2003-01', end='2016-12', columns=('country', 'code', 'val'), dtype=None,
+                 workers=8, compact=False):
     """
     Read MOF customs HS10 export data. Available month range: from 2003-01.
-    Variables: country, code (year and month as index).
+    Variables: country, code, val (year and month as index).
+
+    Parameters
+    ----------
+    start, end : string, optional
+        First and last month, 'YYYY-MM'.
+    columns : sequence, optional (default=('country', 'code', 'val'))
+        Columns to read. Any of country, code, desc_zh, desc_en, qty, qty_unit,
+        weight, weight_unit, val.
+    dtype : dict, optional
+        Column name to dtype, e.g. {'code': str}.
+    workers : int, optional (default=8)
+        Number of months read concurrently.
+    compact : bool, optional (default=False)
+        If True, code is encoded as integer plus digit length and country
+        as categorical (see encoding.py). Codes are then read as strings.
     """
-    def read_monthly(year, month):
-        date = str(year) + '-' + str(month).zfill(2)
-        df = pd.read_csv('//172.20.23.190/ds/Raw Data/MOF-us-2003-2017-rev/' + date + '.tsv', sep='\t',
-                         usecols=['國家', '貨品分類', '價值'])
-        df.columns = ['country', 'code', 'val']
+    names = {v: k for k, v in CUSTOMS_COLUMNS.items()}
+    invalid = [c for c in columns if c not in names]
+    if invalid:
+        raise ValueError('Invalid columns {}'.format(invalid))
+    usecols = [names[c] for c in columns]
+    if compact:
+        dtype = dict(dtype or {}, code=str)
+    if dtype is not None:
+        dtype = {names[c]: t for c, t in dtype.items()}
+    customs_encoding = {'hs': ['code'], 'categories': {'country': 'customs_country'}}
+
+    def read_monthly(date):
+        df = cache.read_csv('//172.20.23.190/ds/Raw Data/MOF-us-2003-2017-rev/' + date + '.tsv', sep='\t',
+                            usecols=usecols, dtype=dtype)
+        # usecols does not keep the requested order
+        df = df[usecols]
+        df.columns = list(columns)
         df['date'] = pd.to_datetime(date, format='%Y-%m')
         df.set_index('date', inplace=True)
+        if compact:
+            df = encoding.compact(df, **customs_encoding)
         return df
         
     start = pd.to_datetime(start, format='%Y-%m')
@@ -121,11 +439,15 @@ def read_customs(start='2003-01', end='2016-12'):
     else:
         dates = [(start.year, m) for m in range(start.month, end.month + 1)]
 
-    # Iterate over (year, month) pairs and join results
-    df_map = map(lambda x, y: read_monthly(year=x, month=y),
-                 [x[0] for x in dates], [x[1] for x in dates])
-    df = reduce(lambda x, y: pd.merge(left=x, right=y, how='outer', left_index=True, right_index=True),
-                df_map)
+    # Read months concurrently and stack them once
+    df = concat_parallel(read_monthly, [str(y) + '-' + str(m).zfill(2) for y, m in dates], workers)
+    if compact:
+        # Recast categoricals whose dictionary grew while other months were read
+        df = encoding.compact(df, **customs_encoding)
+        # Impute NA's of the measures only; missing codes and countries stay missing
+        measures = [c for c in ['qty', 'weight', 'val'] if c in df]
+        df[measures] = df[measures].fillna(0)
+        return df
     # Impute NA's
     df.fillna(0, inplace=True)
     return df
@@ -156,7 +478,7 @@ def read_product_desc(source='mof'):
         return desc
     elif source == 'un':
         path = '//172.26.1.102/dstore/uncomtrade/HS_utf-8.csv'
-        desc = pd.read_csv(path, header=0, names=['product', 'parent', 'desc'])
+        desc = cache.read_csv(path, header=0, names=['product', 'parent', 'desc'])
         return desc
     else:
         raise ValueError('Invalid source arg "{}"'.format(source))
@@ -172,16 +494,15 @@ def read_country_code(source='mof'):
         - If 'mof', then variables are code, country, region.
         - If 'un_rep' or 'un_par', then variables are code and country.
           Note that there are special codes 'all' in 'un_rep', and '0', 'all' in 'un_par'.
+          These are served from the local reference data cache (see refdata.py).
     """
     if source == 'mof':
         return pd.read_csv('C:/Users/2093/Desktop/Data Center/03. Data/05. TAITRA/CRM/country.csv',
                            usecols=[0, 1, 3], header=0, names=['code', 'country', 'region']).apply(
             lambda x: x.str.strip())
     elif source == 'un_rep':
-        return pd.read_csv('//172.26.1.102/dstore/uncomtrade/reporter.csv', header=0,
-                           names=['code', 'country'])
+        return refdata.reporters().rename(columns={'id': 'code', 'text': 'country'})
     elif source == 'un_par':
-        return pd.read_csv('//172.26.1.102/dstore/uncomtrade/partner.csv', header=0,
-                           names=['code', 'country'])
+        return refdata.partners().rename(columns={'id': 'code', 'text': 'country'})
     else:
         raise ValueError('Invalid source arg "{}"'.format(source))
\ No newline at end of file
@@ -0,0 +1,89 @@
+# Reference data registry:
+#   1. UN Comtrade reporter areas
+#   2. UN Comtrade partner areas
+#   3. UN Comtrade HS descriptions
+#
+# Nothing is fetched at import time. Each list is loaded on first access,
+# memoized for the rest of the session and kept as a local json copy that is
+# refreshed once it is older than ``ttl`` seconds. If the refresh fails (e.g.
+# offline), the stale copy is used.
+
+import os
+import json
+import time
+from functools import lru_cache
+import requests
+import pandas as pd
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.trademodel', 'refdata')
+TTL = 30 * 24 * 3600
+SOURCES = {'reporters': 'http://comtrade.un.org/data/cache/reporterAreas.json',
+           'partners': 'http://comtrade.un.org/data/cache/partnerAreas.json',
+           'hs': 'http://comtrade.un.org/data/cache/classificationHS.json'}
+
+@lru_cache(maxsize=None)
+def load(name, ttl=TTL):
+    """
+    Return the 'results' list of reference list ``name``.
+
+    Parameters
+    ----------
+    name : string
+        One of 'reporters', 'partners', 'hs'.
+    ttl : int, optional (default=30 days)
+        Maximum age in seconds of the local copy before it is refreshed.
+    """
+    if name not in SOURCES:
+        raise ValueError('Invalid reference list "{}"'.format(name))
+    path = os.path.join(CACHE_DIR, name + '.json')
+    if os.path.isfile(path) and time.time() - os.path.getmtime(path) < ttl:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    try:
+        resp = requests.get(SOURCES[name], timeout=60)
+        resp.raise_for_status()
+        results = resp.json()['results']
+    except (requests.RequestException, ValueError, KeyError):
+        if os.path.isfile(path):
+            print('Could not refresh {}; using local copy.'.format(name))
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        raise
+    # Write to a temporary file first so a crash never leaves a partial copy
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(path + '.tmp', encoding='utf-8', mode='w') as f:
+        json.dump(results, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    return results
+
+def clear():
+    """Drop in-process copies so the next access rereads the local copy (or refetches)."""
+    load.cache_clear()
+
+def reporters():
+    """Reporter areas with columns id, text. Includes the special code 'all'."""
+    return pd.DataFrame(load('reporters'), columns=['id', 'text'])
+
+def partners():
+    """Partner areas with columns id, text. Includes the special codes '0' (World) and 'all'."""
+    return pd.DataFrame(load('partners'), columns=['id', 'text'])
+
+def hs_descriptions():
+    """HS descriptions with columns id, text, parent. Includes special codes such as 'ALL', 'AG6'."""
+    return pd.DataFrame(load('hs'), columns=['id', 'text', 'parent'])
+
+def reporter_list():
+    """Reporter codes, excluding 'all'."""
+    return [d['id'] for d in load('reporters') if d['id'] != 'all']
+
+def reporter_dict():
+    """Dict of reporter code to name, excluding 'all'."""
+    return {d['id']: d['text'] for d in load('reporters') if d['id'] != 'all'}
+
+def partner_list():
+    """Partner codes, excluding 'all' and '0' (World)."""
+    return [d['id'] for d in load('partners') if d['id'] not in ('all', '0')]
+
+def partner_dict():
+    """Dict of partner code to name, excluding 'all'."""
+    return {d['id']: d['text'] for d in load('partners') if d['id'] != 'all'}
@@ -0,0 +1,269 @@
+# Local analytical store of all reader sources:
+#   1. un_trade       UN HS6 trade (year, flow, reporter, partner, commodity, val)
+#   2. itc_trade      ITC HS4 imports (year, country, partner, product, val)
+#   3. customs_trade  MOF customs HS10 exports (period, country, code, val)
+#   4. company_trade  MOF company HS6 trade (period, ban, code, country, ex, im)
+#   5. dim_hs         HS codes of both nomenclatures with their HS2/HS4/HS6 ancestors
+#   6. dim_country    MOF and UN country codes, linked by name or by a crosswalk CSV
+#
+# Fact tables carry hs2/hs4 (and hs6) columns, so sources of different code
+# depth join on a shared level, e.g. ITC HS4 against UN HS6 on hs4. Indexes
+# cover the usual (reporter, partner, commodity, period) lookups.
+#
+# Build or refresh the store, then query it:
+#
+#   python store.py ingest [--sources un itc customs company dims] [--crosswalk map.csv]
+#   python store.py query "SELECT reporter, SUM(val) FROM un_trade WHERE hs4 = '0302' GROUP BY 1"
+
+import os
+import sys
+import sqlite3
+import argparse
+import warnings
+import pandas as pd
+import reader
+
+STORE_PATH = os.path.join(os.path.expanduser('~'), '.trademodel', 'trade.sqlite')
+SOURCES = ['dims', 'un', 'itc', 'customs', 'company']
+
+SCHEMA = {
+    'un_trade': ['year INTEGER', 'flow INTEGER', 'reporter INTEGER', 'partner INTEGER',
+                 'commodity TEXT', 'hs2 TEXT', 'hs4 TEXT', 'val REAL'],
+    'itc_trade': ['year INTEGER', 'country TEXT', 'partner TEXT', 'product TEXT', 'hs2 TEXT', 'val REAL'],
+    'customs_trade': ['period TEXT', 'country TEXT', 'code TEXT', 'hs2 TEXT', 'hs4 TEXT', 'hs6 TEXT',
+                      'val REAL'],
+    'company_trade': ['period TEXT', 'ban TEXT', 'code TEXT', 'country TEXT', 'hs2 TEXT', 'hs4 TEXT',
+                      'ex INTEGER', 'im INTEGER'],
+    'dim_hs': ['source TEXT', 'code TEXT', 'level INTEGER', 'hs2 TEXT', 'hs4 TEXT', 'hs6 TEXT',
+               'parent TEXT', 'description TEXT'],
+    'dim_country': ['mof_code TEXT', 'un_code INTEGER', 'mof_name TEXT', 'un_name TEXT', 'region TEXT'],
+}
+
+INDEXES = {
+    'un_trade': [['reporter', 'partner', 'commodity', 'year'], ['partner', 'commodity', 'year'],
+                 ['commodity', 'year'], ['hs4', 'year']],
+    'itc_trade': [['country', 'partner', 'product', 'year'], ['product', 'year']],
+    'customs_trade': [['country', 'code', 'period'], ['code', 'period'], ['hs6', 'period'],
+                      ['period']],
+    'company_trade': [['ban', 'period'], ['code', 'country', 'period'], ['country', 'period'],
+                      ['period']],
+    'dim_hs': [['source', 'code'], ['hs4'], ['hs6']],
+    'dim_country': [['mof_code'], ['un_code']],
+}
+
+def prefix_columns(codes, levels=(2, 4)):
+    """Dict of 'hs<n>' to the first n digits of ``codes``, for each n in ``levels``."""
+    return {'hs' + str(n): codes.str[:n] for n in levels}
+
+def pad_even(codes):
+    """Restore leading zeros of HS codes read as numbers (codes have even length)."""
+    codes = codes.astype(str)
+    return codes.where(codes.str.len() % 2 == 0, '0' + codes)
+
+def country_key(names):
+    """Country names reduced for matching: lowercase letters, digits and CJK only, without 'the'."""
+    return (names.astype(str).str.lower().str.replace(r'\bthe\b', '', regex=True)
+            .str.replace('[^0-9a-z\u4e00-\u9fff]', '', regex=True))
+
+def country_crosswalk(mof, un):
+    """
+    Links (mof_code, un_code) of MOF and UN countries with the same name.
+
+    UN names come from the reference data (see refdata.py). Names shared by
+    several UN codes are ambiguous and left unlinked.
+    """
+    un = un.assign(key=country_key(un['un_name'])).drop_duplicates('key', keep=False)
+    mof = mof.assign(key=country_key(mof['mof_name']))
+    return mof.merge(un[['key', 'un_code']], on='key')[['mof_code', 'un_code']]
+
+class Store:
+    """
+    SQLite store of the reader sources.
+
+    Parameters
+    ----------
+    path : string, optional (default=~/.trademodel/trade.sqlite)
+    """
+
+    def __init__(self, path=STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        for table, columns in SCHEMA.items():
+            self.conn.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(table, ', '.join(columns)))
+        self.conn.commit()
+
+    def _replace(self, table, df, where=None, params=()):
+        """Replace the rows of ``table`` matching ``where`` (all rows if None) with ``df``."""
+        names = [c.split()[0] for c in SCHEMA[table]]
+        self.conn.execute('DELETE FROM {}{}'.format(table, '' if where is None else ' WHERE ' + where),
+                          params)
+        self.conn.executemany('INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * len(names))),
+                              df[names].astype(object).where(df[names].notnull(), None)
+                              .itertuples(index=False, name=None))
+        self.conn.commit()
+        print('{}: {} rows written.'.format(table, len(df)))
+
+    def index(self):
+        """Create the indexes of all tables (no-op for existing ones)."""
+        for table, indexes in INDEXES.items():
+            for cols in indexes:
+                self.conn.execute('CREATE INDEX IF NOT EXISTS {}_{} ON {} ({})'.format(
+                    table, '_'.join(cols), table, ', '.join(cols)))
+        self.conn.execute('ANALYZE')
+        self.conn.commit()
+
+    def ingest_dims(self, crosswalk=None):
+        """
+        Load the HS and country dimension tables.
+
+        Parameters
+        ----------
+        crosswalk : string, optional
+            CSV with columns mof_code, un_code linking MOF to UN country codes.
+            Without it, countries are linked by name (see country_crosswalk).
+            MOF and UN countries left unlinked are separate rows of dim_country,
+            with a warning.
+        """
+        mof = reader.read_product_desc('mof')
+        mof['product'] = pad_even(mof['product'])
+        un = reader.read_product_desc('un')
+        # Skip the special codes ('ALL', 'TOTAL', 'AG2', ...)
+        un = un[un['product'].astype(str).str.fullmatch(r'\d+')]
+        frames = []
+        for source, df in [('mof', mof), ('un', un)]:
+            codes = df['product'].astype(str)
+            frames.append(pd.DataFrame(dict(source=source, code=codes, level=codes.str.len(),
+                                            parent=df['parent'] if 'parent' in df else None,
+                                            description=df['desc'],
+                                            **prefix_columns(codes, (2, 4, 6)))))
+        self._replace('dim_hs', pd.concat(frames, ignore_index=True))
+
+        mof = reader.read_country_code('mof').rename(columns={'code': 'mof_code', 'country': 'mof_name'})
+        un = pd.concat([reader.read_country_code('un_rep'), reader.read_country_code('un_par')])
+        un = un[un['code'].str.fullmatch(r'\d+')].drop_duplicates('code')
+        un = un.rename(columns={'code': 'un_code', 'country': 'un_name'})
+        un['un_code'] = un['un_code'].astype(int)
+        if crosswalk is None:
+            links = country_crosswalk(mof, un)
+        else:
+            links = pd.read_csv(crosswalk, dtype={'mof_code': str, 'un_code': int})
+        countries = mof.merge(links, how='left', on='mof_code').merge(un, how='outer', on='un_code')
+        unlinked = countries[countries['mof_code'].notnull() & countries['un_name'].isnull()]
+        if len(unlinked):
+            warnings.warn('{} of {} MOF countries have no UN code and are separate rows of dim_country '
+                          '(e.g. {}). Pass a crosswalk CSV with columns mof_code, un_code to link them.'
+                          .format(len(unlinked), len(mof), ', '.join(unlinked['mof_name'].astype(str)[:5])),
+                          stacklevel=2)
+        self._replace('dim_country', countries)
+
+    def ingest_un(self, start=2011, end=2015):
+        """Load UN trade data (all flows), one year at a time."""
+        for year in range(start, end + 1):
+            df = reader.read_un(year, year, flows=None)
+            df = df.assign(**prefix_columns(df['commodity']))
+            self._replace('un_trade', df, 'year = ?', (year,))
+
+    def ingest_itc(self):
+        """Load ITC data, with the yearly value columns stacked into (year, val)."""
+        df = reader.read_itc()
+        df = df.rename(columns={'Country': 'country', 'Partner': 'partner', 'Product Code': 'product'})
+        values = [c for c in df.columns if c.startswith('Value in ')]
+        df = df.melt(id_vars=['country', 'partner', 'product'], value_vars=values, var_name='year',
+                     value_name='val').dropna(subset=['val'])
+        df['year'] = df['year'].str[len('Value in '):].astype(int)
+        df['hs2'] = df['product'].str[:2]
+        self._replace('itc_trade', df)
+
+    def ingest_customs(self, start='2003-01', end='2016-12'):
+        """Load MOF customs data, one year at a time."""
+        start, end = pd.Period(start, freq='M'), pd.Period(end, freq='M')
+        for year in range(start.year, end.year + 1):
+            first = max(start, pd.Period(year=year, month=1, freq='M'))
+            last = min(end, pd.Period(year=year, month=12, freq='M'))
+            df = reader.read_customs(str(first), str(last), dtype={'code': str}).reset_index()
+            df['period'] = df['date'].dt.strftime('%Y-%m')
+            df = df.assign(**prefix_columns(df['code'], (2, 4, 6)))
+            self._replace('customs_trade', df, 'period BETWEEN ? AND ?', (str(first), str(last)))
+
+    def ingest_company(self):
+        """Load MOF company trade data, one month at a time."""
+        for date, df in reader.iter_company_trade('M'):
+            df = df.reset_index(drop=True)
+            df['period'] = date.strftime('%Y-%m')
+            df = df.assign(**prefix_columns(df['code']))
+            self._replace('company_trade', df, 'period = ?', (date.strftime('%Y-%m'),))
+
+    def ingest(self, sources=SOURCES, crosswalk=None):
+        """Load ``sources`` (any of 'dims', 'un', 'itc', 'customs', 'company') and build indexes."""
+        invalid = [s for s in sources if s not in SOURCES]
+        if invalid:
+            raise ValueError('Invalid sources {}'.format(invalid))
+        for source in sources:
+            if source == 'dims':
+                self.ingest_dims(crosswalk)
+            else:
+                getattr(self, 'ingest_' + source)()
+        self.index()
+
+    def query(self, sql, params=()):
+        """Run ``sql`` and return the result as a DataFrame."""
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def select(self, table, columns=None, **filters):
+        """
+        Rows of ``table`` matching ``filters``, as a DataFrame.
+
+        Each filter is column=value or column=list of values. A value ending in
+        '*' matches a prefix, e.g. commodity='0302*', and still uses the index.
+
+        >>> store.select('un_trade', reporter=[392, 410], commodity='0302*', year=2015)
+        """
+        if table not in SCHEMA:
+            raise ValueError('Invalid table "{}"'.format(table))
+        names = [c.split()[0] for c in SCHEMA[table]]
+        clauses, params = [], []
+        for col, value in filters.items():
+            if col not in names:
+                raise ValueError('Invalid column "{}" of {}'.format(col, table))
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            terms = []
+            for v in values:
+                if v == '*':
+                    # Empty prefix: any value
+                    terms.append('{} IS NOT NULL'.format(col))
+                elif isinstance(v, str) and v.endswith('*'):
+                    # Prefix range rather than LIKE, which cannot use the index
+                    prefix = v[:-1]
+                    terms.append('({0} >= ? AND {0} < ?)'.format(col))
+                    params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+                else:
+                    terms.append('{} = ?'.format(col))
+                    params.append(v)
+            clauses.append('(' + ' OR '.join(terms) + ')')
+        sql = 'SELECT {} FROM {}'.format(', '.join(columns) if columns else '*', table)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return self.query(sql, params)
+
+def query(sql, params=(), path=STORE_PATH):
+    """Run ``sql`` against the store at ``path`` and return the result as a DataFrame."""
+    return Store(path).query(sql, params)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the local trade data store.')
+    parser.add_argument('--path', default=STORE_PATH)
+    subparsers = parser.add_subparsers(dest='command')
+    ingest = subparsers.add_parser('ingest', help='load reader sources into the store')
+    ingest.add_argument('--sources', nargs='+', default=SOURCES, choices=SOURCES)
+    ingest.add_argument('--crosswalk', help='CSV with columns mof_code, un_code '
+                                            '(default: link countries by name)')
+    sql = subparsers.add_parser('query', help='run a SQL query and print the result')
+    sql.add_argument('sql')
+    args = parser.parse_args()
+    if args.command == 'ingest':
+        Store(args.path).ingest(args.sources, args.crosswalk)
+    elif args.command == 'query':
+        query(args.sql, path=args.path).to_csv(sys.stdout, index=False)
+    else:
+        parser.print_help()